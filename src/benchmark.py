@@ -38,14 +38,40 @@ class BenchmarkRunResult:
     write_to_file_duration_seconds: float
     fetch_duration_seconds: float
     post_process_duration_seconds: float = 0
+    planning_duration_seconds: float = 0
     trino_cpu_time_seconds: float = 0
     trino_wall_time_seconds: float = 0
     trino_elapsed_time_seconds: float = 0
     is_warmup: bool = False
     cold_or_warm: str = "cold"
+    # wall-clock bounds of the query itself, to attribute container metrics to it
+    query_start_timestamp: datetime.datetime | None = None
+    query_end_timestamp: datetime.datetime | None = None
+    result_row_count: int | None = None
+    # deltas of the engine's JVM over the query, see jvm_telemetry.py
+    jvm_gc_count: int | None = None
+    jvm_gc_time_seconds: float | None = None
+    jvm_gc_time_share: float | None = None
+    jvm_gc_time_exceeded: bool | None = None
+    jvm_heap_used_before_bytes: int | None = None
+    jvm_heap_used_after_bytes: int | None = None
+    jvm_allocated_bytes: int | None = None
+    jvm_allocation_rate_bytes_per_second: float | None = None
 
 
 class Benchmark(ABC):
     @abstractmethod
     def run_all_queries(self, run_id: int) -> list[BenchmarkRunResult]:
         pass
+
+    def get_query_definition(self, query_type: QueryType, query_name: str) -> str:
+        # the definition of the query, e.g. its SQL or its FHIRPath expressions.
+        # Used to tell apart results of queries with the same name, e.g. by
+        # result_cache.py, which doesn't cache queries without one
+        return ""
+
+    def collect_sidecar_tables(self) -> dict[str, list[dict]]:
+        # additional measurements of the last `run_all_queries` call which don't fit
+        # into a BenchmarkRunResult, keyed by table name. Rows should contain the
+        # run_id, engine, query and query_type so they can be joined to the results.
+        return {}
@@ -0,0 +1,367 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import zlib
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from pathlib import Path
+
+import pandas as pd
+from loguru import logger
+
+MIB = 1024 * 1024
+
+# the resources of Synthea's hospitalInformation and practitionerInformation
+# bundles, which the patients' resources reference
+SHARED_BUNDLES = {
+    "hospitalInformation": ["Organization", "Location"],
+    "practitionerInformation": ["Practitioner", "PractitionerRole"],
+}
+
+# the resources without a reference to a patient, e.g. Medications, are
+# written to this bundle. It's uploaded with the shared bundles, before the
+# patients' bundles which may reference them.
+UNLINKED_BUNDLE = "otherInformation"
+# the unlinked resources are split into bundles of at most this many entries,
+# about the size of a patient's bundle, to stay within the servers' request
+# limits and the ingest's timeout
+UNLINKED_BUNDLE_MAX_ENTRIES = 1000
+
+# the patient's resource first, so it's easy to spot in the bundle
+PATIENT_RESOURCE_TYPE = "Patient"
+
+# the fields referencing the patient, e.g. Coverage.beneficiary and the targets
+# of a Provenance, which are lists
+PATIENT_REFERENCE_FIELDS = ["subject", "patient", "beneficiary", "target"]
+
+
+def get_patient_id(resource: dict) -> str | None:
+    if resource["resourceType"] == PATIENT_RESOURCE_TYPE:
+        return resource["id"]
+    # with `exporter.fhir.bulk_data`, Synthea references are Patient/<id>
+    for field in PATIENT_REFERENCE_FIELDS:
+        value = resource.get(field, {})
+        for reference in value if isinstance(value, list) else [value]:
+            reference = reference.get("reference", "")
+            if reference.startswith("Patient/"):
+                return reference.removeprefix("Patient/")
+    return None
+
+
+def get_chunks(path: Path, chunk_size_bytes: int) -> list[tuple[Path, int, int]]:
+    size = path.stat().st_size
+    return [
+        (path, start, min(start + chunk_size_bytes, size))
+        for start in range(0, size, chunk_size_bytes)
+    ]
+
+
+def partition_chunk(
+    chunk: tuple[Path, int, int], partitions_dir: Path, num_partitions: int
+) -> dict:
+    # writes every line of the chunk to the partition of its patient, or to the
+    # unlinked resources. Each chunk gets its own files, so the workers never
+    # write to the same file.
+    path, start, end = chunk
+    resource_type = path.stem
+    files = {}
+    lines = 0
+    unlinked = 0
+
+    with path.open("rb") as ndjson:
+        ndjson.seek(start)
+        if start > 0:
+            # the line which crosses the start belongs to the previous chunk
+            ndjson.readline()
+        while ndjson.tell() <= end:
+            line = ndjson.readline()
+            if not line:
+                break
+            if not line.strip():
+                continue
+
+            patient_id = get_patient_id(json.loads(line))
+            if patient_id is None:
+                partition = UNLINKED_BUNDLE
+                unlinked += 1
+            else:
+                bucket = zlib.crc32(patient_id.encode()) % num_partitions
+                partition = f"part-{bucket:05d}"
+                lines += 1
+
+            if partition not in files:
+                partition_dir = partitions_dir / partition
+                partition_dir.mkdir(parents=True, exist_ok=True)
+                files[partition] = (
+                    partition_dir / f"{resource_type}-{start}.ndjson"
+                ).open("wb")
+            files[partition].write(line if line.endswith(b"\n") else line + b"\n")
+
+    for file in files.values():
+        file.close()
+
+    return {"resource_type": resource_type, "resources": lines, "unlinked": unlinked}
+
+
+def to_entry(resource: dict) -> dict:
+    # PUTs with the ids of the bulk export keep the references between the
+    # resources intact and make the bundles idempotent
+    reference = f"{resource['resourceType']}/{resource['id']}"
+    return {
+        "fullUrl": f"urn:uuid:{resource['id']}",
+        "resource": resource,
+        "request": {"method": "PUT", "url": reference},
+    }
+
+
+def to_bundle(resources: list[dict]) -> dict:
+    return {
+        "resourceType": "Bundle",
+        "type": "transaction",
+        "entry": [to_entry(resource) for resource in resources],
+    }
+
+
+def get_bundle_name(patient: dict | None, patient_id: str) -> str:
+    # like Synthea's <given>_<family>_<id>.json
+    name = (patient or {}).get("name", [{}])[0]
+    parts = name.get("given", [])[:1] + [name.get("family", "")]
+    prefix = "_".join(part for part in parts if part)
+    return f"{prefix}_{patient_id}.json" if prefix else f"{patient_id}.json"
+
+
+def write_partition_bundles(partition_dir: Path, output_dir: Path) -> dict:
+    resources_by_patient = defaultdict(list)
+    for path in sorted(partition_dir.glob("*.ndjson")):
+        with path.open("rb") as ndjson:
+            for line in ndjson:
+                resource = json.loads(line)
+                resources_by_patient[get_patient_id(resource)].append(resource)
+
+    bundles = 0
+    bytes_written = 0
+    for patient_id, resources in resources_by_patient.items():
+        resources.sort(key=lambda r: r["resourceType"] != PATIENT_RESOURCE_TYPE)
+        patient = resources[0] if resources[0]["resourceType"] == "Patient" else None
+        if patient is None:
+            logger.warning(
+                "Patient/{patient_id} is referenced but not in the export",
+                patient_id=patient_id,
+            )
+
+        text = json.dumps(to_bundle(resources))
+        (output_dir / get_bundle_name(patient, patient_id)).write_text(text)
+        bundles += 1
+        bytes_written += len(text)
+
+    return {"bundles": bundles, "bytes_written": bytes_written}
+
+
+def write_unlinked_bundles(
+    unlinked_dir: Path,
+    output_dir: Path,
+    timestamp: int,
+    max_entries: int = UNLINKED_BUNDLE_MAX_ENTRIES,
+) -> dict:
+    resources = []
+    resource_types = Counter()
+    for path in sorted(unlinked_dir.glob("*.ndjson")):
+        with path.open("rb") as ndjson:
+            for line in ndjson:
+                resource = json.loads(line)
+                resources.append(resource)
+                resource_types[resource["resourceType"]] += 1
+    if not resources:
+        return {"bundles": 0, "bytes_written": 0}
+
+    logger.info(
+        "Writing {count} resources without a patient reference to the "
+        + "{name} bundles: {resource_types}",
+        count=len(resources),
+        name=UNLINKED_BUNDLE,
+        resource_types=dict(resource_types),
+    )
+    bundles = 0
+    bytes_written = 0
+    for start in range(0, len(resources), max_entries):
+        text = json.dumps(to_bundle(resources[start : start + max_entries]))
+        (output_dir / f"{UNLINKED_BUNDLE}{timestamp}-{bundles:05d}.json").write_text(
+            text
+        )
+        bundles += 1
+        bytes_written += len(text)
+    return {"bundles": bundles, "bytes_written": bytes_written}
+
+
+def write_shared_bundles(bulk_dir: Path, output_dir: Path, timestamp: int) -> dict:
+    bundles = 0
+    bytes_written = 0
+    for name, resource_types in SHARED_BUNDLES.items():
+        resources = []
+        for resource_type in resource_types:
+            path = bulk_dir / f"{resource_type}.ndjson"
+            if not path.exists():
+                logger.warning("{path} doesn't exist", path=path)
+                continue
+            with path.open("rb") as ndjson:
+                resources.extend(json.loads(line) for line in ndjson if line.strip())
+
+        text = json.dumps(to_bundle(resources))
+        (output_dir / f"{name}{timestamp}.json").write_text(text)
+        bundles += 1
+        bytes_written += len(text)
+    return {"bundles": bundles, "bytes_written": bytes_written}
+
+
+def convert(
+    bulk_dir: Path,
+    output_dir: Path,
+    chunk_size_mib: int,
+    num_partitions: int,
+    max_workers: int | None,
+) -> dict:
+    output_dir.mkdir(parents=True, exist_ok=True)
+    shared_resource_types = {
+        resource_type
+        for resource_types in SHARED_BUNDLES.values()
+        for resource_type in resource_types
+    }
+    patient_files = [
+        path
+        for path in sorted(bulk_dir.glob("*.ndjson"))
+        if path.stem not in shared_resource_types
+    ]
+    input_bytes = sum(path.stat().st_size for path in bulk_dir.glob("*.ndjson"))
+
+    start = time.perf_counter()
+    timestamp = int(time.time() * 1000)
+    shared = write_shared_bundles(bulk_dir, output_dir, timestamp)
+    shared_duration = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory(
+        prefix=".bundle-partitions-", dir=output_dir.parent
+    ) as partitions_dir, ProcessPoolExecutor(max_workers=max_workers) as executor:
+        partitions_dir = Path(partitions_dir)
+
+        # 1. split the NDJSON files into chunks and partition their lines by patient
+        partition_start = time.perf_counter()
+        chunks = [
+            chunk
+            for path in patient_files
+            for chunk in get_chunks(path, chunk_size_mib * MIB)
+        ]
+        logger.info(
+            "Partitioning {chunks} chunks of {files} files into {partitions} partitions",
+            chunks=len(chunks),
+            files=len(patient_files),
+            partitions=num_partitions,
+        )
+        chunk_results = list(
+            executor.map(
+                partial(
+                    partition_chunk,
+                    partitions_dir=partitions_dir,
+                    num_partitions=num_partitions,
+                ),
+                chunks,
+            )
+        )
+        partition_duration = time.perf_counter() - partition_start
+
+        # 2. a partition holds all resources of its patients, one bundle each
+        bundle_start = time.perf_counter()
+        bundle_results = list(
+            executor.map(
+                partial(write_partition_bundles, output_dir=output_dir),
+                sorted(partitions_dir.glob("part-*")),
+            )
+        )
+        unlinked_bundles = write_unlinked_bundles(
+            partitions_dir / UNLINKED_BUNDLE, output_dir, timestamp
+        )
+        bundle_duration = time.perf_counter() - bundle_start
+
+    resources = sum(result["resources"] for result in chunk_results)
+    unlinked = sum(result["unlinked"] for result in chunk_results)
+
+    return {
+        "input_files": len(patient_files),
+        "input_bytes": input_bytes,
+        "chunks": len(chunks),
+        "partitions": num_partitions,
+        "patient_resources": resources,
+        "unlinked_resources": unlinked,
+        "patient_bundles": sum(result["bundles"] for result in bundle_results),
+        "shared_bundles": shared["bundles"] + unlinked_bundles["bundles"],
+        "output_bytes": shared["bytes_written"]
+        + unlinked_bundles["bytes_written"]
+        + sum(result["bytes_written"] for result in bundle_results),
+        "shared_bundles_duration_seconds": shared_duration,
+        "partition_duration_seconds": partition_duration,
+        "bundle_duration_seconds": bundle_duration,
+        "total_duration_seconds": time.perf_counter() - start,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Convert Synthea's bulk NDJSON export into transaction bundles, "
+        + "one per patient plus the hospital and practitioner bundles"
+    )
+    parser.add_argument(
+        "--bulk-dir",
+        default=None,
+        help="Defaults to ../synthea/output-<population size>/bulk/fhir",
+    )
+    parser.add_argument(
+        "--output-dir",
+        default=None,
+        help="Defaults to ../synthea/output-<population size>/transactions/fhir",
+    )
+    parser.add_argument("--chunk-size-mib", type=int, default=64)
+    parser.add_argument(
+        "--partitions",
+        type=int,
+        default=256,
+        help="Number of patient partitions. Each one has to fit into a worker's memory.",
+    )
+    parser.add_argument("--max-workers", type=int, default=None)
+    parser.add_argument(
+        "--population-size",
+        default=os.getenv("SYNTHEA_POPULATION_SIZE", ""),
+        help="The population size of the converted data",
+    )
+    args = parser.parse_args()
+
+    synthea_output_dir = Path(f"../synthea/output-{args.population_size}")
+    bulk_dir = Path(args.bulk_dir or synthea_output_dir / "bulk" / "fhir")
+    output_dir = Path(args.output_dir or synthea_output_dir / "transactions" / "fhir")
+
+    result = convert(
+        bulk_dir, output_dir, args.chunk_size_mib, args.partitions, args.max_workers
+    )
+    logger.info(
+        "Wrote {bundles} bundles with {resources} resources in {duration:0.2f} s",
+        bundles=result["patient_bundles"] + result["shared_bundles"],
+        resources=result["patient_resources"] + result["unlinked_resources"],
+        duration=result["total_duration_seconds"],
+    )
+
+    output_dir = Path.cwd() / "results" / "bundle-conversion"
+    output_dir.mkdir(parents=True, exist_ok=True)
+    report = pd.DataFrame([result])
+    report["synthea_population_size"] = args.population_size
+    report.to_csv(
+        output_dir
+        / f"{time.strftime('%Y%m%d-%H%M%S')}-{args.population_size}-bundle-conversion.csv",
+        index=False,
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,30 +1,150 @@
 import argparse
-import requests
-import csv
 import datetime
+import re
+import sys
+import time
+import itertools
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import requests
+from loguru import logger
 
 PROM_URL = "http://localhost:9090/api/v1/query_range"
 
-# PromQL queries
+# Prometheus rejects range queries with more than 11,000 points per series
+MAX_POINTS_PER_QUERY = 10_000
+
+# the range of the rate() queries, i.e. a rate sample at t is the mean over
+# [t - 10s, t]. Stored in the Parquet file's metadata for query_resources.py.
+RATE_WINDOW_SECONDS = 10
+
+# PromQL queries. cAdvisor reports the filesystem, network and block device
+# counters per device and interface, they're summed up per container.
 queries = {
     "cpu": 'rate(container_cpu_usage_seconds_total{image!=""}[10s])',
     "memory_working_set_bytes": 'container_memory_working_set_bytes{image!=""}',
     "memory_rss": 'container_memory_rss{image!=""}',
-    "fs_read_bytes": "rate(container_fs_reads_bytes_total[10s])",
-    "fs_read_bytes": "rate(container_fs_writes_bytes_total[10s])",
+    "fs_read_bytes": 'sum by (name) (rate(container_fs_reads_bytes_total{image!=""}[10s]))',
+    "fs_write_bytes": 'sum by (name) (rate(container_fs_writes_bytes_total{image!=""}[10s]))',
+    "network_receive_bytes": 'sum by (name) (rate(container_network_receive_bytes_total{image!=""}[10s]))',
+    "network_transmit_bytes": 'sum by (name) (rate(container_network_transmit_bytes_total{image!=""}[10s]))',
+    "blkio_read_bytes": 'sum by (name) (rate(container_blkio_device_usage_total{image!="", operation="Read"}[10s]))',
+    "blkio_write_bytes": 'sum by (name) (rate(container_blkio_device_usage_total{image!="", operation="Write"}[10s]))',
 }
 
+SCHEMA = pa.schema(
+    [
+        ("start", pa.timestamp("s", tz="UTC")),
+        ("timestamp", pa.timestamp("ms", tz="UTC")),
+        ("container", pa.string()),
+        ("metric", pa.string()),
+        ("value", pa.float64()),
+        ("synthea_population_size", pa.string()),
+    ]
+)
+
+DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600, "d": 86400}
+
 
 def parse_time(t):
-    """Allow multiple time formats."""
+    """Allow multiple time formats. Times without a timezone are UTC."""
     try:
-        return datetime.datetime.fromisoformat(t.replace("Z", ""))
+        dt = datetime.datetime.fromisoformat(t)
     except ValueError:
-        return datetime.datetime.strptime(t, "%Y-%m-%d %H:%M:%S")
+        dt = datetime.datetime.strptime(t, "%Y-%m-%d %H:%M:%S")
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=datetime.timezone.utc)
+    return dt
+
+
+def parse_step(step: str) -> float:
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)(ms|s|m|h|d)?", step)
+    if match is None:
+        raise ValueError(f"Unsupported step: {step}")
+    return float(match.group(1)) * DURATION_UNITS[match.group(2) or "s"]
+
+
+def get_windows(
+    start: float, end: float, step_seconds: float, max_points: int
+) -> list[tuple[float, float]]:
+    # the windows are aligned to the step, so no sample is fetched twice
+    width = step_seconds * max_points
+    windows = []
+    window_start = start
+    while window_start <= end:
+        windows.append((window_start, min(window_start + width - step_seconds, end)))
+        window_start += width
+    return windows
+
+
+def fetch(
+    metric_name: str,
+    window: tuple[float, float],
+    step: str,
+    max_attempts: int,
+) -> list[dict]:
+    params = {
+        "query": queries[metric_name],
+        "start": window[0],
+        "end": window[1],
+        "step": step,
+    }
+    for attempt in range(1, max_attempts + 1):
+        try:
+            response = requests.get(PROM_URL, params=params, timeout=120)
+            r = response.json()
+            if r["status"] == "success":
+                return r["data"]["result"]
+            error = r.get("error", r)
+        except (requests.RequestException, ValueError) as exc:
+            error = exc
+
+        logger.warning(
+            "Query for {metric} failed (attempt {attempt}/{max_attempts}): {error}",
+            metric=metric_name,
+            attempt=attempt,
+            max_attempts=max_attempts,
+            error=error,
+        )
+        time.sleep(2**attempt)
+
+    raise RuntimeError(f"Query for {metric_name} failed after {max_attempts} attempts")
+
+
+def to_record_batch(
+    metric_name: str,
+    result: list[dict],
+    start_dt: datetime.datetime,
+    population_size: str,
+) -> pa.RecordBatch:
+    timestamps, containers, values = [], [], []
+    for series in result:
+        container = series["metric"].get(
+            "name", series["metric"].get("container", "unknown")
+        )
+        for ts, value in series["values"]:
+            timestamps.append(int(float(ts) * 1000))
+            containers.append(container)
+            values.append(float(value))
+
+    num_rows = len(values)
+    return pa.RecordBatch.from_arrays(
+        [
+            pa.array([start_dt] * num_rows, type=SCHEMA.field("start").type),
+            pa.array(timestamps, type=SCHEMA.field("timestamp").type),
+            pa.array(containers, type=pa.string()),
+            pa.array([metric_name] * num_rows, type=pa.string()),
+            pa.array(values, type=pa.float64()),
+            pa.array([population_size] * num_rows, type=pa.string()),
+        ],
+        schema=SCHEMA,
+    )
 
 
 def main():
-    parser = argparse.ArgumentParser(description="Export Prometheus metrics to CSV")
+    parser = argparse.ArgumentParser(description="Export Prometheus metrics to Parquet")
     parser.add_argument(
         "--start", required=True, help="Start time (ISO8601), e.g. 2025-01-23T10:00:00Z"
     )
@@ -35,11 +155,21 @@ def main():
         "--step", default="5s", help="Query resolution step, e.g. 5s or 1m"
     )
     parser.add_argument(
-        "--output", default="container_metrics.csv", help="CSV output file"
+        "--output", default="container_metrics.parquet", help="Parquet output file"
     )
     parser.add_argument(
         "--population-size", required=True, help="The population size for the run"
     )
+    parser.add_argument(
+        "--max-points-per-query",
+        type=int,
+        default=MAX_POINTS_PER_QUERY,
+        help="The time range is split into windows of at most this many steps",
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=8, help="Queries in flight at once"
+    )
+    parser.add_argument("--max-attempts", type=int, default=3)
 
     args = parser.parse_args()
 
@@ -50,56 +180,64 @@ def main():
         else datetime.datetime.now(datetime.timezone.utc)
     )
 
-    params = {
-        "start": start_dt.timestamp(),
-        "end": end_dt.timestamp(),
-        "step": args.step,
-        "population_size": args.population_size,
-    }
+    windows = get_windows(
+        start_dt.timestamp(),
+        end_dt.timestamp(),
+        parse_step(args.step),
+        args.max_points_per_query,
+    )
+    logger.info(
+        "Fetching {metrics} metrics in {windows} windows",
+        metrics=len(queries),
+        windows=len(windows),
+    )
 
-    rows = []
-
-    for metric_name, query in queries.items():
-        params["query"] = query
-        r = requests.get(PROM_URL, params=params).json()
-
-        if r["status"] != "success":
-            print(f"Query failed for metric {metric_name}: {r}")
-            continue
-
-        for result in r["data"]["result"]:
-            container = result["metric"].get(
-                "name", result["metric"].get("container", "unknown")
-            )
-            for ts, value in result["values"]:
-                rows.append(
-                    {
-                        "start": start_dt,
-                        "timestamp": ts,
-                        "container": container,
-                        "metric": metric_name,
-                        "value": value,
-                        "synthea_population_size": args.population_size,
-                    }
+    rows = 0
+    failed = 0
+    # the results are written as they arrive. Only `concurrency` queries are
+    # submitted at once and each one is dropped once it's written, so at most
+    # the results of the queries in flight are kept in memory.
+    tasks = itertools.product(queries, windows)
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor, pq.ParquetWriter(
+        args.output,
+        SCHEMA.with_metadata({"rate_window_seconds": str(RATE_WINDOW_SECONDS)}),
+        compression="zstd",
+    ) as writer:
+        futures = {}
+        while True:
+            for metric_name, window in itertools.islice(
+                tasks, args.concurrency - len(futures)
+            ):
+                future = executor.submit(
+                    fetch, metric_name, window, args.step, args.max_attempts
                 )
+                futures[future] = metric_name
+            if not futures:
+                break
+
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                metric_name = futures.pop(future)
+                try:
+                    result = future.result()
+                except RuntimeError as exc:
+                    logger.error("{error}", error=exc)
+                    failed += 1
+                    continue
+
+                batch = to_record_batch(
+                    metric_name, result, start_dt, args.population_size
+                )
+                if batch.num_rows > 0:
+                    writer.write_batch(batch)
+                    rows += batch.num_rows
 
-    with open(args.output, "w", newline="") as f:
-        writer = csv.DictWriter(
-            f,
-            fieldnames=[
-                "start",
-                "timestamp",
-                "container",
-                "metric",
-                "value",
-                "synthea_population_size",
-            ],
-        )
-        writer.writeheader()
-        writer.writerows(rows)
-
-    print(f"Saved {args.output}")
+    logger.info("Saved {rows} samples to {output}", rows=rows, output=args.output)
+    if failed:
+        logger.error("{failed} queries failed", failed=failed)
+        return 1
+    return 0
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,119 @@
+import os
+import time
+
+import docker
+import requests
+from docker.models.containers import Container
+from loguru import logger
+
+from services import (
+    BLAZE_BASE_URL,
+    FHIR_COMPOSE_PROJECT_NAME,
+    HAPI_BASE_URL,
+    get_container_name,
+)
+
+TRINO_CONTAINER = get_container_name("trino")
+BLAZE_CONTAINER = get_container_name("blaze", FHIR_COMPOSE_PROJECT_NAME)
+HAPI_CONTAINER = get_container_name("hapi-fhir", FHIR_COMPOSE_PROJECT_NAME)
+PATHLING_CONTAINER = get_container_name("pathling")
+
+# used to wait for a service to accept queries again after it was restarted
+READINESS_URLS = {
+    TRINO_CONTAINER: "http://localhost:8080/v1/info",
+    BLAZE_CONTAINER: f"{BLAZE_BASE_URL}/metadata",
+    HAPI_CONTAINER: f"{HAPI_BASE_URL}/metadata",
+    PATHLING_CONTAINER: "http://localhost:8082/fhir/metadata",
+}
+
+
+def get_container(name: str) -> Container:
+    return docker.from_env().containers.get(name)
+
+
+def get_limits(name: str) -> dict[str, str | int]:
+    host_config = get_container(name).attrs["HostConfig"]
+    return {
+        "cpuset_cpus": host_config.get("CpusetCpus") or "",
+        "mem_limit": host_config.get("Memory") or 0,
+        "memswap_limit": host_config.get("MemorySwap") or 0,
+    }
+
+
+def set_cpuset(name: str, cores: int | None):
+    # None removes the restriction again, i.e. allows all of the host's CPUs
+    cpu_count = os.cpu_count() or 1
+    if cores is not None and cores > cpu_count:
+        raise ValueError(f"Can't pin {name} to {cores} cores, the host has {cpu_count}")
+
+    cpuset = f"0-{(cores or cpu_count) - 1}"
+    logger.info("Setting cpuset of {name} to {cpuset}", name=name, cpuset=cpuset)
+    get_container(name).update(cpuset_cpus=cpuset)
+
+
+def set_memory_limit(name: str, limit_bytes: int):
+    logger.info(
+        "Setting memory limit of {name} to {limit} MiB",
+        name=name,
+        limit=limit_bytes // (1024 * 1024),
+    )
+    # no swap, otherwise a too small limit shows up as a slow-down, not a failure
+    get_container(name).update(mem_limit=limit_bytes, memswap_limit=limit_bytes)
+
+
+def get_original_cpuset(limits: dict[str, str | int]) -> str:
+    return limits["cpuset_cpus"] or f"0-{(os.cpu_count() or 1) - 1}"
+
+
+def restore_cpuset(name: str, limits: dict[str, str | int]):
+    # leaves the memory limit alone, so a container without one doesn't get one
+    get_container(name).update(cpuset_cpus=get_original_cpuset(limits))
+
+
+def restore_limits(name: str, limits: dict[str, str | int]):
+    container = get_container(name)
+    cpuset = get_original_cpuset(limits)
+    # Docker can't remove a memory limit once set (0 means "unchanged" and
+    # anything below 6 MB is rejected), so fall back to the host's memory
+    host_memory = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    mem_limit = limits["mem_limit"] or host_memory
+    if not limits["mem_limit"]:
+        logger.warning(
+            "{name} had no memory limit, but Docker can't remove one. It stays "
+            + "limited to the host's {memory_mib} MiB until it's recreated, e.g. "
+            + "with `docker compose up -d --force-recreate`.",
+            name=name,
+            memory_mib=host_memory // (1024 * 1024),
+        )
+    memswap_limit = limits["memswap_limit"] or -1
+    container.update(
+        cpuset_cpus=cpuset, mem_limit=mem_limit, memswap_limit=memswap_limit
+    )
+
+
+def wait_until_ready(name: str, timeout_seconds: float = 600):
+    url = READINESS_URLS.get(name)
+    if url is None:
+        return
+    wait_for_url(url, name, timeout_seconds)
+
+
+def wait_for_url(url: str, name: str, timeout_seconds: float = 600):
+    deadline = time.perf_counter() + timeout_seconds
+    while time.perf_counter() < deadline:
+        try:
+            response = requests.get(url, timeout=5)
+            # Trino's /v1/info reports whether it is still starting up
+            if response.ok and not response.json().get("starting", False):
+                return
+        except (requests.RequestException, ValueError):
+            pass
+        time.sleep(2)
+
+    raise TimeoutError(f"{name} did not become ready within {timeout_seconds} s")
+
+
+def restart_and_wait(name: str, timeout_seconds: float = 600):
+    logger.info("Restarting {name}", name=name)
+    get_container(name).restart()
+    wait_until_ready(name, timeout_seconds)
@@ -0,0 +1,413 @@
+import argparse
+import collections
+import datetime
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+
+import docker
+import pyarrow as pa
+import pyarrow.parquet as pq
+from loguru import logger
+
+from collect_metrics import SCHEMA
+from services import FHIR_COMPOSE_PROJECT_NAME, get_container_name
+
+CGROUP_ROOT = Path("/sys/fs/cgroup")
+
+DEFAULT_CONTAINERS = [
+    get_container_name("trino"),
+    get_container_name("minio"),
+    get_container_name("blaze", FHIR_COMPOSE_PROJECT_NAME),
+    get_container_name("hapi-fhir", FHIR_COMPOSE_PROJECT_NAME),
+    get_container_name("hapi-fhir-postgres", FHIR_COMPOSE_PROJECT_NAME),
+]
+
+# counters are written as rates per second between two samples, with the same
+# names as collect_metrics.py's. The CPU usage counter is in seconds, so its
+# rate is in cores.
+COUNTER_METRICS = {
+    "cpu_seconds": "cpu",
+    "blkio_read_bytes": "blkio_read_bytes",
+    "blkio_write_bytes": "blkio_write_bytes",
+    "network_receive_bytes": "network_receive_bytes",
+    "network_transmit_bytes": "network_transmit_bytes",
+}
+GAUGE_METRICS = ["memory_working_set_bytes", "memory_rss"]
+
+
+def parse_flat_keyed(text: str) -> dict[str, int]:
+    # e.g. cpu.stat and memory.stat: "<key> <value>" per line
+    values = {}
+    for line in text.splitlines():
+        key, _, value = line.partition(" ")
+        if value:
+            values[key] = int(value)
+    return values
+
+
+def parse_io_stat(text: str) -> tuple[int, int]:
+    # one line per device: "8:0 rbytes=... wbytes=... rios=... wios=..."
+    read_bytes, write_bytes = 0, 0
+    for line in text.splitlines():
+        for field in line.split()[1:]:
+            key, _, value = field.partition("=")
+            if key == "rbytes":
+                read_bytes += int(value)
+            elif key == "wbytes":
+                write_bytes += int(value)
+    return read_bytes, write_bytes
+
+
+def parse_net_dev(text: str) -> tuple[int, int]:
+    # /proc/<pid>/net/dev of a process in the container's network namespace
+    receive_bytes, transmit_bytes = 0, 0
+    for line in text.splitlines()[2:]:
+        interface, _, fields = line.partition(":")
+        if interface.strip() == "lo":
+            continue
+        fields = fields.split()
+        receive_bytes += int(fields[0])
+        transmit_bytes += int(fields[8])
+    return receive_bytes, transmit_bytes
+
+
+class CgroupReader:
+    """
+    Reads a container's counters from its cgroup v2 files and its network
+    namespace. Only a few small files per sample, so it's cheap enough for
+    sub-second intervals.
+    """
+
+    def __init__(self, container):
+        pid = container.attrs["State"]["Pid"]
+        # e.g. "0::/system.slice/docker-<id>.scope"
+        cgroup = Path(f"/proc/{pid}/cgroup").read_text().strip().split("::", 1)[1]
+        self.cgroup_dir = CGROUP_ROOT / cgroup.lstrip("/")
+        self.net_dev = Path(f"/proc/{pid}/net/dev")
+        if not (self.cgroup_dir / "cpu.stat").exists():
+            raise FileNotFoundError(f"No cgroup v2 files in {self.cgroup_dir}")
+
+    def read(self) -> tuple[dict[str, float], dict[str, float]]:
+        cpu = parse_flat_keyed((self.cgroup_dir / "cpu.stat").read_text())
+        memory = parse_flat_keyed((self.cgroup_dir / "memory.stat").read_text())
+        memory_current = int((self.cgroup_dir / "memory.current").read_text())
+        read_bytes, write_bytes = parse_io_stat(
+            (self.cgroup_dir / "io.stat").read_text()
+        )
+        receive_bytes, transmit_bytes = parse_net_dev(self.net_dev.read_text())
+
+        counters = {
+            "cpu_seconds": cpu["usage_usec"] / 1e6,
+            "blkio_read_bytes": read_bytes,
+            "blkio_write_bytes": write_bytes,
+            "network_receive_bytes": receive_bytes,
+            "network_transmit_bytes": transmit_bytes,
+        }
+        gauges = {
+            # like cAdvisor's working set, the page cache which can be reclaimed
+            # first isn't counted
+            "memory_working_set_bytes": max(
+                memory_current - memory.get("inactive_file", 0), 0
+            ),
+            "memory_rss": memory.get("anon", 0),
+        }
+        return counters, gauges
+
+
+class DockerStatsReader:
+    """
+    Reads a container's counters from the Docker stats API. Works without access
+    to the host's cgroup files, but a request takes tens of milliseconds.
+    """
+
+    def __init__(self, container):
+        self.container = container
+
+    def read(self) -> tuple[dict[str, float], dict[str, float]]:
+        stats = self.container.stats(stream=False, one_shot=True)
+        memory = stats.get("memory_stats", {})
+        memory_stats = memory.get("stats", {})
+        networks = (stats.get("networks") or {}).values()
+        blkio = stats.get("blkio_stats", {}).get("io_service_bytes_recursive") or []
+
+        counters = {
+            "cpu_seconds": stats["cpu_stats"]["cpu_usage"]["total_usage"] / 1e9,
+            "blkio_read_bytes": sum(
+                entry["value"] for entry in blkio if entry["op"].lower() == "read"
+            ),
+            "blkio_write_bytes": sum(
+                entry["value"] for entry in blkio if entry["op"].lower() == "write"
+            ),
+            "network_receive_bytes": sum(network["rx_bytes"] for network in networks),
+            "network_transmit_bytes": sum(
+                network["tx_bytes"] for network in networks
+            ),
+        }
+        gauges = {
+            "memory_working_set_bytes": max(
+                memory.get("usage", 0) - memory_stats.get("inactive_file", 0), 0
+            ),
+            # anon with cgroup v2, rss with v1
+            "memory_rss": memory_stats.get("anon", memory_stats.get("rss", 0)),
+        }
+        return counters, gauges
+
+
+class ContainerSampler:
+    """
+    Samples the containers' CPU, memory, block IO and network counters at a fixed
+    interval on a background thread. The samples go into a ring buffer which a
+    second thread flushes to a Parquet file in collect_metrics.py's format, so
+    encoding and writing never delay a sample.
+    """
+
+    def __init__(
+        self,
+        output_path: Path,
+        containers: list[str] = DEFAULT_CONTAINERS,
+        interval_seconds: float = 0.25,
+        source: str = "auto",
+        buffer_size: int = 1_000_000,
+        flush_interval_seconds: float = 10,
+        population_size: str = os.getenv("SYNTHEA_POPULATION_SIZE", ""),
+    ):
+        self.output_path = output_path
+        self.containers = containers
+        self.interval_seconds = interval_seconds
+        self.source = source
+        self.flush_interval_seconds = flush_interval_seconds
+        self.population_size = population_size
+
+        self.buffer: collections.deque[tuple[int, str, str, float]] = (
+            collections.deque(maxlen=buffer_size)
+        )
+        self.docker_client: docker.DockerClient | None = None
+        self.readers: dict[str, CgroupReader | DockerStatsReader | None] = {}
+        self.previous: dict[str, tuple[float, dict[str, float]]] = {}
+
+        self._stop_event = threading.Event()
+        self._sampler_thread = threading.Thread(
+            target=self._sample_loop, name="container-sampler", daemon=True
+        )
+        self._flusher_thread = threading.Thread(
+            target=self._flush_loop, name="container-sampler-flush", daemon=True
+        )
+        self._writer: pq.ParquetWriter | None = None
+        self._start = datetime.datetime.now(datetime.UTC)
+
+        self.samples = 0
+        self.rows_buffered = 0
+        self.rows_written = 0
+        self.overruns = 0
+        self.sample_duration_seconds = 0.0
+
+    def start(self) -> "ContainerSampler":
+        self.output_path.parent.mkdir(parents=True, exist_ok=True)
+        # the duration of a rate's window is its sampling interval, see
+        # query_resources.py
+        self._writer = pq.ParquetWriter(
+            self.output_path,
+            SCHEMA.with_metadata(
+                {"rate_window_seconds": str(self.interval_seconds)}
+            ),
+            compression="zstd",
+        )
+        self._start = datetime.datetime.now(datetime.UTC)
+        self._sampler_thread.start()
+        self._flusher_thread.start()
+        logger.info(
+            "Sampling {containers} every {interval} s into {path}",
+            containers=self.containers,
+            interval=self.interval_seconds,
+            path=self.output_path,
+        )
+        return self
+
+    def stop(self):
+        self._stop_event.set()
+        self._sampler_thread.join()
+        self._flusher_thread.join()
+        self._flush()
+        self._writer.close()
+
+        dropped = self.rows_buffered - self.rows_written
+        logger.info(
+            "Took {samples} samples, {mean_ms:0.2f} ms each on average, "
+            + "{overruns} intervals overran",
+            samples=self.samples,
+            mean_ms=1000 * self.sample_duration_seconds / max(self.samples, 1),
+            overruns=self.overruns,
+        )
+        if dropped > 0:
+            logger.warning(
+                "The ring buffer overflowed, {dropped} rows were dropped",
+                dropped=dropped,
+            )
+
+    def __enter__(self) -> "ContainerSampler":
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _get_reader(self, name: str) -> CgroupReader | DockerStatsReader | None:
+        if name in self.readers:
+            return self.readers[name]
+
+        reader = None
+        try:
+            if self.docker_client is None:
+                self.docker_client = docker.from_env()
+            container = self.docker_client.containers.get(name)
+            if self.source in ["auto", "cgroup"]:
+                try:
+                    reader = CgroupReader(container)
+                except OSError as exc:
+                    if self.source == "cgroup":
+                        raise
+                    logger.info(
+                        "Using the Docker stats API for {name}: {error}",
+                        name=name,
+                        error=exc,
+                    )
+            if reader is None:
+                reader = DockerStatsReader(container)
+        except (docker.errors.DockerException, OSError) as exc:
+            logger.warning("Not sampling {name}: {error}", name=name, error=exc)
+        self.readers[name] = reader
+        return reader
+
+    def _sample(self):
+        for name in self.containers:
+            reader = self._get_reader(name)
+            if reader is None:
+                continue
+
+            try:
+                timestamp = time.time()
+                counters, gauges = reader.read()
+            except (OSError, docker.errors.APIError, KeyError):
+                # e.g. restarted for a cold run, which changes its PID. Its
+                # counters start over, so don't compute a rate across it.
+                self.readers.pop(name, None)
+                self.previous.pop(name, None)
+                continue
+
+            timestamp_ms = int(timestamp * 1000)
+            for metric in GAUGE_METRICS:
+                self.buffer.append((timestamp_ms, name, metric, float(gauges[metric])))
+            self.rows_buffered += len(GAUGE_METRICS)
+
+            if name in self.previous:
+                previous_timestamp, previous_counters = self.previous[name]
+                elapsed = timestamp - previous_timestamp
+                for counter, metric in COUNTER_METRICS.items():
+                    delta = counters[counter] - previous_counters[counter]
+                    if elapsed > 0 and delta >= 0:
+                        self.buffer.append(
+                            (timestamp_ms, name, metric, delta / elapsed)
+                        )
+                        self.rows_buffered += 1
+            self.previous[name] = (timestamp, counters)
+
+    def _sample_loop(self):
+        next_tick = time.monotonic()
+        while not self._stop_event.is_set():
+            sample_start = time.monotonic()
+            self._sample()
+            self.samples += 1
+            self.sample_duration_seconds += time.monotonic() - sample_start
+
+            next_tick += self.interval_seconds
+            now = time.monotonic()
+            if next_tick < now:
+                # skip the missed ticks instead of sampling in a burst
+                self.overruns += 1
+                next_tick = now + self.interval_seconds
+            self._stop_event.wait(next_tick - now)
+
+    def _flush_loop(self):
+        while not self._stop_event.wait(self.flush_interval_seconds):
+            self._flush()
+
+    def _flush(self):
+        rows = []
+        while self.buffer:
+            rows.append(self.buffer.popleft())
+        if not rows:
+            return
+
+        timestamps, containers, metrics, values = zip(*rows)
+        self._writer.write_batch(
+            pa.RecordBatch.from_arrays(
+                [
+                    pa.array(
+                        [self._start] * len(rows), type=SCHEMA.field("start").type
+                    ),
+                    pa.array(timestamps, type=SCHEMA.field("timestamp").type),
+                    pa.array(containers, type=pa.string()),
+                    pa.array(metrics, type=pa.string()),
+                    pa.array(values, type=pa.float64()),
+                    pa.array([self.population_size] * len(rows), type=pa.string()),
+                ],
+                schema=SCHEMA,
+            )
+        )
+        self.rows_written += len(rows)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Sample the benchmark containers' resource usage at a "
+        + "sub-second interval, without cAdvisor and Prometheus"
+    )
+    parser.add_argument("--output", default="container-samples.parquet")
+    parser.add_argument(
+        "--containers",
+        type=lambda value: value.split(","),
+        default=DEFAULT_CONTAINERS,
+    )
+    parser.add_argument("--interval-seconds", type=float, default=0.25)
+    parser.add_argument(
+        "--source",
+        choices=["auto", "cgroup", "docker"],
+        default="auto",
+        help="Read the cgroup v2 files directly or use the Docker stats API. "
+        + "'auto' prefers the cgroup files.",
+    )
+    parser.add_argument(
+        "--duration-seconds",
+        type=float,
+        default=None,
+        help="Defaults to sampling until interrupted",
+    )
+    parser.add_argument(
+        "--population-size",
+        default=os.getenv("SYNTHEA_POPULATION_SIZE", ""),
+        help="The population size for the run",
+    )
+    args = parser.parse_args()
+
+    sampler = ContainerSampler(
+        Path(args.output),
+        args.containers,
+        args.interval_seconds,
+        args.source,
+        population_size=args.population_size,
+    )
+    with sampler:
+        try:
+            if args.duration_seconds is None:
+                threading.Event().wait()
+            else:
+                time.sleep(args.duration_seconds)
+        except KeyboardInterrupt:
+            pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,288 @@
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+import pandas as pd
+from deltalake import ColumnProperties, WriterProperties, write_deltalake
+from loguru import logger
+
+from container_limits import restart_and_wait
+from engine_registry import get_engines
+from engine_worker import EngineWorker
+from failure_policy import classify_failure
+from warehouse import (
+    BENCHMARK_RESOURCE_TYPES,
+    DEFAULT_SCHEMA,
+    DELTALAKE_STORAGE_OPTIONS,
+    get_delta_table,
+    get_table_layout,
+    get_table_url,
+    register_schema,
+)
+
+MIB = 1024 * 1024
+
+# each encoding is written to its own warehouse variant, i.e. s3a://fhir/<name>/
+ENCODINGS: dict[str, dict] = {
+    "enc_uncompressed": {"compression": "UNCOMPRESSED"},
+    "enc_snappy": {"compression": "SNAPPY"},
+    "enc_zstd1": {"compression": "ZSTD", "compression_level": 1},
+    "enc_zstd3": {"compression": "ZSTD", "compression_level": 3},
+    "enc_zstd9": {"compression": "ZSTD", "compression_level": 9},
+    "enc_zstd19": {"compression": "ZSTD", "compression_level": 19},
+    "enc_snappy_rg16k": {"compression": "SNAPPY", "max_row_group_size": 16 * 1024},
+    "enc_snappy_rg1m": {"compression": "SNAPPY", "max_row_group_size": 1024 * 1024},
+    "enc_snappy_nodict": {"compression": "SNAPPY", "dictionary_enabled": False},
+    "enc_zstd3_nodict": {
+        "compression": "ZSTD",
+        "compression_level": 3,
+        "dictionary_enabled": False,
+    },
+}
+
+# the engines which read the Delta tables. Blaze and HAPI have their own storage.
+SWEEP_ENGINES = ["trino", "pathling"]
+
+# per-query bytes read from storage, by engine: (sidecar table, column)
+INPUT_BYTES_METRICS = {
+    "trino": ("trino-query-metrics", "physical_input_bytes"),
+    "pathling": ("spark-query-metrics", "input_bytes"),
+}
+
+
+def get_writer_properties(encoding: dict) -> WriterProperties:
+    return WriterProperties(
+        compression=encoding.get("compression"),
+        compression_level=encoding.get("compression_level"),
+        max_row_group_size=encoding.get("max_row_group_size"),
+        default_column_properties=ColumnProperties(
+            dictionary_enabled=encoding.get("dictionary_enabled", True)
+        ),
+    )
+
+
+def build_variant(variant: str, source_schema: str):
+    writer_properties = get_writer_properties(ENCODINGS[variant])
+    for resource_type in BENCHMARK_RESOURCE_TYPES:
+        logger.info(
+            "Writing {resource_type} with encoding {variant}",
+            resource_type=resource_type,
+            variant=variant,
+        )
+        source = get_delta_table(source_schema, resource_type)
+        # streamed from the source's files, so the table never has to fit in memory
+        write_deltalake(
+            get_table_url(variant, resource_type, scheme="s3"),
+            source.to_pyarrow_dataset(),
+            mode="overwrite",
+            schema_mode="overwrite",
+            engine="rust",
+            writer_properties=writer_properties,
+            storage_options=DELTALAKE_STORAGE_OPTIONS,
+        )
+    register_schema(variant, BENCHMARK_RESOURCE_TYPES)
+
+
+def to_rows(
+    variant: str, results: list, sidecar_tables: dict[str, list[dict]], engine: str
+) -> list[dict]:
+    table_name, column = INPUT_BYTES_METRICS[engine]
+    input_bytes = {
+        (row["run_id"], row["query_type"], row["query"]): row.get(column, 0)
+        for row in sidecar_tables.get(table_name, [])
+    }
+
+    rows = []
+    for result in results:
+        key = (result.run_id, str(result.query_type), result.query)
+        rows.append(
+            {
+                "variant": variant,
+                "engine": result.engine,
+                "cold_or_warm": result.cold_or_warm,
+                "run_id": result.run_id,
+                "query_type": str(result.query_type),
+                "query": result.query,
+                "is_warmup": result.is_warmup,
+                "total_duration_seconds": result.total_duration_seconds,
+                "input_bytes": input_bytes.get(key, 0),
+            }
+        )
+    return rows
+
+
+def run_variant(variant: str, engine: str, cold_or_warm: str, runs: int) -> list[dict]:
+    spec = get_engines([engine])[0]
+    kwargs = spec.kwargs | {"schema": variant}
+
+    rows = []
+    worker = None
+    try:
+        if cold_or_warm == "cold":
+            for run_id in range(runs):
+                # a fresh driver JVM for pathling, restarted MinIO and Trino for trino
+                for container in spec.cold_reset_containers:
+                    restart_and_wait(container)
+                worker = EngineWorker(f"{engine}-{variant}", spec.factory, kwargs)
+                results = worker.call(
+                    "run_all_queries", run_id=run_id, cold_or_warm="cold"
+                )
+                rows.extend(
+                    to_rows(
+                        variant, results, worker.call("collect_sidecar_tables"), engine
+                    )
+                )
+                worker.stop()
+        else:
+            worker = EngineWorker(f"{engine}-{variant}", spec.factory, kwargs)
+            # the first run only warms up the engine
+            for run_id in range(runs + 1):
+                results = worker.call(
+                    "run_all_queries",
+                    run_id=run_id,
+                    is_warmup=(run_id == 0),
+                    cold_or_warm="warm",
+                )
+                rows.extend(
+                    to_rows(
+                        variant, results, worker.call("collect_sidecar_tables"), engine
+                    )
+                )
+    except Exception as exc:
+        logger.error(
+            "{engine} failed on {variant} ({failure_kind}): {error}",
+            engine=engine,
+            variant=variant,
+            failure_kind=classify_failure(exc),
+            error=exc,
+        )
+    finally:
+        if worker is not None:
+            worker.stop()
+    return rows
+
+
+def summarize(runs: pd.DataFrame, sizes: pd.DataFrame) -> pd.DataFrame:
+    measured = runs[~runs["is_warmup"]]
+    per_query = (
+        measured.groupby(["variant", "engine", "cold_or_warm", "query_type", "query"])
+        .agg(
+            median_duration_seconds=("total_duration_seconds", "median"),
+            median_input_bytes=("input_bytes", "median"),
+        )
+        .reset_index()
+    )
+    summary = (
+        per_query.groupby(["variant", "engine", "cold_or_warm"])
+        .agg(
+            total_median_duration_seconds=("median_duration_seconds", "sum"),
+            total_input_bytes=("median_input_bytes", "sum"),
+        )
+        .reset_index()
+    )
+    summary["scan_throughput_mib_per_second"] = (
+        summary["total_input_bytes"] / MIB / summary["total_median_duration_seconds"]
+    )
+
+    variant_sizes = (
+        sizes.groupby("schema")["total_size_bytes"]
+        .sum()
+        .reset_index()
+        .rename(columns={"schema": "variant", "total_size_bytes": "size_bytes"})
+    )
+    return summary.merge(variant_sizes, on="variant", how="left")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Rewrite the Delta tables with different Parquet encodings and "
+        + "run the Trino and Pathling queries against each of them"
+    )
+    parser.add_argument(
+        "--encodings",
+        type=lambda value: value.split(","),
+        default=list(ENCODINGS.keys()),
+        help=f"Comma-separated encodings. Available: {list(ENCODINGS.keys())}",
+    )
+    parser.add_argument(
+        "--engines",
+        type=lambda value: value.split(","),
+        default=SWEEP_ENGINES,
+    )
+    parser.add_argument(
+        "--modes",
+        type=lambda value: value.split(","),
+        default=["cold", "warm"],
+    )
+    parser.add_argument("--source-schema", default=DEFAULT_SCHEMA)
+    parser.add_argument(
+        "--skip-build",
+        action="store_true",
+        help="Re-use the variants written by a previous sweep",
+    )
+    parser.add_argument(
+        "--runs", type=int, default=3, help="Measured runs per variant and mode"
+    )
+    parser.add_argument(
+        "--population-size",
+        default=os.getenv("SYNTHEA_POPULATION_SIZE", ""),
+        help="The population size of the loaded data",
+    )
+    args = parser.parse_args()
+
+    unknown_encodings = set(args.encodings) - set(ENCODINGS.keys())
+    if unknown_encodings:
+        logger.error("Unknown encodings: {unknown}", unknown=unknown_encodings)
+        return 1
+
+    if not args.skip_build:
+        for variant in args.encodings:
+            build_variant(variant, args.source_schema)
+
+    sizes = pd.DataFrame(
+        [
+            get_table_layout(schema, resource_type)
+            for schema in [args.source_schema] + args.encodings
+            for resource_type in BENCHMARK_RESOURCE_TYPES
+        ]
+    )
+
+    all_rows = []
+    for variant in args.encodings:
+        for engine in args.engines:
+            for cold_or_warm in args.modes:
+                logger.info(
+                    "Running {engine} {cold_or_warm} against {variant}",
+                    engine=engine,
+                    cold_or_warm=cold_or_warm,
+                    variant=variant,
+                )
+                all_rows.extend(run_variant(variant, engine, cold_or_warm, args.runs))
+
+    output_dir = Path.cwd() / "results" / "encoding-sweep"
+    output_dir.mkdir(parents=True, exist_ok=True)
+    file_name_prefix = f"{time.strftime('%Y%m%d-%H%M%S')}-{args.population_size}"
+
+    sizes["synthea_population_size"] = args.population_size
+    sizes.to_csv(output_dir / f"{file_name_prefix}-encoding-sizes.csv", index=False)
+
+    if not all_rows:
+        logger.error("No successful runs")
+        return 1
+
+    runs = pd.DataFrame(all_rows)
+    runs["synthea_population_size"] = args.population_size
+    runs.to_csv(output_dir / f"{file_name_prefix}-encoding-runs.csv", index=False)
+
+    summary = summarize(runs, sizes)
+    summary["synthea_population_size"] = args.population_size
+    summary.to_csv(output_dir / f"{file_name_prefix}-encoding-summary.csv", index=False)
+
+    logger.info(summary)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
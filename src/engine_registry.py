@@ -0,0 +1,160 @@
+from dataclasses import dataclass, field, replace
+from importlib.metadata import entry_points
+from typing import Any
+
+from loguru import logger
+
+from failure_policy import RetryPolicy, SparkDegradingRetryPolicy
+from services import (
+    BLAZE_BASE_URL,
+    BLAZE_METRICS_URL,
+    FHIR_COMPOSE_PROJECT_NAME,
+    HAPI_BASE_URL,
+    HAPI_METRICS_URL,
+    HAPI_SQL_PROFILING,
+    get_container_name,
+)
+
+# third-party engines can register themselves by exposing an `EngineSpec` (or a
+# list of them) under this entry point group, e.g. in their pyproject.toml:
+#   [project.entry-points."analytics_on_fhir_benchmark.engines"]
+#   duckdb = "my_package.engines:DUCKDB_ENGINE"
+ENTRY_POINT_GROUP = "analytics_on_fhir_benchmark.engines"
+
+
+@dataclass(frozen=True)
+class EngineSpec:
+    name: str
+    # "module:attribute" of the `Benchmark` implementation. It is only imported
+    # inside the engine's worker process, never by the orchestrator.
+    factory: str
+    kwargs: dict[str, Any] = field(default_factory=dict)
+    # optional keyword arguments of `run_all_queries` this engine understands
+    run_options: tuple[str, ...] = ()
+    # containers to restart between rounds of a cold run
+    cold_reset_containers: tuple[str, ...] = ()
+    cold_reset_container_delay_seconds: float = 0
+    # engine method which resets its client-side state for a cold run. If unset,
+    # the whole worker process is restarted instead.
+    cold_reset_method: str | None = None
+    # how to retry a failed round, see failure_policy.py
+    retry_policy: RetryPolicy = field(default_factory=RetryPolicy)
+
+
+BUILTIN_ENGINES: list[EngineSpec] = [
+    EngineSpec(
+        name="trino",
+        factory="trino_benchmark:TrinoBenchmark",
+        cold_reset_containers=(
+            get_container_name("minio"),
+            get_container_name("trino"),
+        ),
+    ),
+    # the same questions against the flattened tables built by flatten_tables.py
+    EngineSpec(
+        name="trino-flat",
+        factory="trino_benchmark:TrinoBenchmark",
+        kwargs={"queries_dir": "queries-flat", "engine_name": "trino-flat"},
+        cold_reset_containers=(
+            get_container_name("minio"),
+            get_container_name("trino"),
+        ),
+    ),
+    EngineSpec(
+        name="pathling",
+        factory="pathling_benchmark:PathlingBenchmark",
+        # restarts the driver JVM from the local jar cache without paying for a
+        # new interpreter and the pyspark/pathling imports
+        cold_reset_method="reset",
+        # we occasionally observe transient OOM issues, so retry with degraded
+        # settings
+        retry_policy=SparkDegradingRetryPolicy(max_attempts=5),
+    ),
+    EngineSpec(
+        name="blaze",
+        factory="pyrate_benchmark:PyrateBenchmark",
+        kwargs={
+            "fhir_server_base_url": f"{BLAZE_BASE_URL}/",
+            "fhir_server_name": "blaze",
+            "jvm_metrics_url": BLAZE_METRICS_URL,
+        },
+        run_options=("only_hemoglobin_simple",),
+        cold_reset_containers=(get_container_name("blaze", FHIR_COMPOSE_PROJECT_NAME),),
+    ),
+    EngineSpec(
+        name="hapi",
+        factory="pyrate_benchmark:PyrateBenchmark",
+        kwargs={
+            "fhir_server_base_url": f"{HAPI_BASE_URL}/",
+            "fhir_server_name": "hapi",
+            "jvm_metrics_url": HAPI_METRICS_URL,
+            "postgres_container": (
+                get_container_name("hapi-fhir-postgres", FHIR_COMPOSE_PROJECT_NAME)
+                if HAPI_SQL_PROFILING
+                else None
+            ),
+        },
+        run_options=("only_hemoglobin_simple",),
+        cold_reset_containers=(
+            get_container_name("hapi-fhir-postgres", FHIR_COMPOSE_PROJECT_NAME),
+            get_container_name("hapi-fhir", FHIR_COMPOSE_PROJECT_NAME),
+        ),
+        cold_reset_container_delay_seconds=30,
+    ),
+]
+
+
+
+def get_cached_spec(spec: EngineSpec) -> EngineSpec:
+    # the engine behind result_cache.py's cache, e.g. "trino-cached". A cold run
+    # restarts the worker, which also empties the cache. The retry policies change
+    # the wrapped engine's kwargs, which the cache doesn't accept, so a failed round
+    # is only retried as is.
+    return replace(
+        spec,
+        name=f"{spec.name}-cached",
+        factory="result_cache:CachedBenchmark",
+        kwargs={"engine_factory": spec.factory, "engine_kwargs": spec.kwargs},
+        cold_reset_method=None,
+        retry_policy=RetryPolicy(),
+    )
+
+
+BUILTIN_ENGINES += [get_cached_spec(spec) for spec in list(BUILTIN_ENGINES)]
+
+
+def discover_engines() -> dict[str, EngineSpec]:
+    engines = {spec.name: spec for spec in BUILTIN_ENGINES}
+
+    for entry_point in entry_points(group=ENTRY_POINT_GROUP):
+        try:
+            loaded = entry_point.load()
+        except Exception as exc:
+            logger.error(
+                "Failed to load engine plugin {name}: {error}",
+                name=entry_point.name,
+                error=exc,
+            )
+            continue
+
+        specs = loaded if isinstance(loaded, (list, tuple)) else [loaded]
+        for spec in specs:
+            if spec.name in engines:
+                logger.warning(
+                    "Engine plugin {entry_point} overrides engine {name}",
+                    entry_point=entry_point.name,
+                    name=spec.name,
+                )
+            engines[spec.name] = spec
+
+    return engines
+
+
+def get_engines(names: list[str]) -> list[EngineSpec]:
+    available = discover_engines()
+    unknown = [name for name in names if name not in available]
+    if unknown:
+        raise ValueError(
+            f"Unknown engines {unknown}. Available: {sorted(available.keys())}"
+        )
+    return [available[name] for name in names]
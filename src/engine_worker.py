@@ -0,0 +1,188 @@
+import importlib
+import multiprocessing
+import traceback
+from multiprocessing.connection import Connection
+from typing import TYPE_CHECKING, Any, Callable
+
+from loguru import logger
+
+if TYPE_CHECKING:
+    from engine_registry import EngineSpec
+
+# use "spawn" so every worker starts from a fresh interpreter instead of a copy
+# of the orchestrator's memory (which would include pandas results etc.)
+_MP_CONTEXT = multiprocessing.get_context("spawn")
+
+
+class EngineWorkerError(Exception):
+    """Raised in the orchestrator when a call failed inside the worker."""
+
+    def __init__(self, exc_type: str, message: str, remote_traceback: str):
+        super().__init__(f"{exc_type}: {message}")
+        self.exc_type = exc_type
+        self.message = message
+        self.remote_traceback = remote_traceback
+
+
+class EngineWorkerCrashed(Exception):
+    """Raised when the worker process died while serving a call."""
+
+    def __init__(self, name: str, exitcode: int | None):
+        super().__init__(f"Engine worker {name} exited with code {exitcode}")
+        self.name = name
+        self.exitcode = exitcode
+
+
+def load_factory(factory: str | Callable) -> Callable:
+    if callable(factory):
+        return factory
+
+    module_name, _, attribute = factory.partition(":")
+    return getattr(importlib.import_module(module_name), attribute)
+
+
+def _error_message(exc: BaseException) -> tuple:
+    return ("error", type(exc).__name__, str(exc), traceback.format_exc())
+
+
+def _serve(conn: Connection, engine_factory: str | Callable, engine_kwargs: dict):
+    try:
+        engine = load_factory(engine_factory)(**engine_kwargs)
+    except Exception as exc:
+        conn.send(_error_message(exc))
+        return
+
+    conn.send(("ready",))
+
+    while True:
+        try:
+            method, kwargs = conn.recv()
+        except EOFError:
+            # the orchestrator went away
+            break
+
+        if method == "shutdown":
+            conn.send(("ok", None))
+            break
+
+        try:
+            conn.send(("ok", getattr(engine, method)(**kwargs)))
+        except Exception as exc:
+            conn.send(_error_message(exc))
+
+    conn.close()
+
+
+class EngineWorker:
+    """
+    Runs a single engine adapter in its own process. The orchestrator talks to it
+    using a minimal request/response protocol over a pipe:
+    `(method, kwargs)` -> `("ok", value)` or `("error", type, message, traceback)`.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        engine_factory: str | Callable,
+        engine_kwargs: dict[str, Any] | None = None,
+        shutdown_timeout_seconds: float = 60,
+    ):
+        self.name = name
+        self.engine_factory = engine_factory
+        self.engine_kwargs = engine_kwargs or {}
+        self.shutdown_timeout_seconds = shutdown_timeout_seconds
+        self._process: multiprocessing.Process | None = None
+        self._conn: Connection | None = None
+
+    @classmethod
+    def from_spec(cls, spec: "EngineSpec") -> "EngineWorker":
+        return cls(spec.name, spec.factory, spec.kwargs)
+
+    @property
+    def is_running(self) -> bool:
+        return self._process is not None and self._process.is_alive()
+
+    def start(self):
+        if self.is_running:
+            return
+
+        logger.info("Starting engine worker {name}", name=self.name)
+        parent_conn, child_conn = _MP_CONTEXT.Pipe()
+        self._process = _MP_CONTEXT.Process(
+            target=_serve,
+            args=(child_conn, self.engine_factory, self.engine_kwargs),
+            name=f"engine-worker-{self.name}",
+            daemon=True,
+        )
+        self._process.start()
+        child_conn.close()
+        self._conn = parent_conn
+
+        # block until the engine is constructed so that start-up cost is never
+        # attributed to the first query
+        try:
+            self._receive()
+        except EngineWorkerError:
+            # the engine failed to initialize and the worker exits on its own
+            self.stop()
+            raise
+
+    def call(self, method: str, **kwargs) -> Any:
+        self.start()
+        try:
+            self._conn.send((method, kwargs))
+        except (BrokenPipeError, ConnectionResetError):
+            self._raise_crashed()
+        return self._receive()
+
+    def stop(self):
+        if self._process is None:
+            return
+
+        logger.info("Stopping engine worker {name}", name=self.name)
+        if self._process.is_alive():
+            try:
+                self._conn.send(("shutdown", {}))
+                self._conn.recv()
+            except (EOFError, BrokenPipeError, ConnectionResetError):
+                pass
+            self._process.join(self.shutdown_timeout_seconds)
+
+        if self._process.is_alive():
+            logger.warning(
+                "Engine worker {name} did not shut down in time. Killing it.",
+                name=self.name,
+            )
+            self._process.kill()
+            self._process.join()
+
+        self._conn.close()
+        self._process = None
+        self._conn = None
+
+    def restart(self):
+        self.stop()
+        self.start()
+
+    def _receive(self) -> Any:
+        try:
+            message = self._conn.recv()
+        except (EOFError, ConnectionResetError):
+            self._raise_crashed()
+
+        status = message[0]
+        if status == "ready":
+            return None
+        if status == "ok":
+            return message[1]
+
+        _, exc_type, exc_message, remote_traceback = message
+        raise EngineWorkerError(exc_type, exc_message, remote_traceback)
+
+    def _raise_crashed(self):
+        self._process.join(self.shutdown_timeout_seconds)
+        exitcode = self._process.exitcode
+        self._conn.close()
+        self._process = None
+        self._conn = None
+        raise EngineWorkerCrashed(self.name, exitcode)
@@ -0,0 +1,176 @@
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Any
+
+from engine_worker import EngineWorkerCrashed, EngineWorkerError
+
+
+class FailureKind(Enum):
+    DRIVER_OOM = "driver-oom"
+    DRIVER_LOST = "driver-lost"
+    EXECUTOR_LOST = "executor-lost"
+    S3_TIMEOUT = "s3-timeout"
+    WORKER_CRASHED = "worker-crashed"
+    UNKNOWN = "unknown"
+
+    def __str__(self):
+        return str(self.value).lower()
+
+
+# checked in order, the first matching kind wins. Matched against the exception
+# message and, for errors raised inside a worker, the remote traceback.
+FAILURE_PATTERNS: list[tuple[FailureKind, list[str]]] = [
+    (
+        FailureKind.DRIVER_OOM,
+        [
+            "java.lang.OutOfMemoryError",
+            "GC overhead limit exceeded",
+            "Java heap space",
+            "Requested array size exceeds VM limit",
+        ],
+    ),
+    (
+        FailureKind.EXECUTOR_LOST,
+        [
+            "ExecutorLostFailure",
+            "Executor heartbeat timed out",
+            "FetchFailedException",
+            "MetadataFetchFailedException",
+        ],
+    ),
+    (
+        FailureKind.S3_TIMEOUT,
+        [
+            "SocketTimeoutException",
+            "ConnectTimeoutException",
+            "AWSClientIOException",
+            "Timeout waiting for connection from pool",
+            "Read timed out",
+        ],
+    ),
+    (
+        FailureKind.DRIVER_LOST,
+        [
+            # the py4j gateway lost its JVM, most likely it exited after an OOM
+            "Py4JNetworkError",
+            "Answer from Java side is empty",
+            "Error while receiving",
+            "SparkContext was shut down",
+            "Cannot call methods on a stopped SparkContext",
+        ],
+    ),
+]
+
+# failures that are likely to go away with less memory pressure
+MEMORY_RELATED_FAILURES = {
+    FailureKind.DRIVER_OOM,
+    FailureKind.DRIVER_LOST,
+    FailureKind.EXECUTOR_LOST,
+    FailureKind.WORKER_CRASHED,
+}
+
+
+def classify_failure(exc: BaseException) -> FailureKind:
+    if isinstance(exc, EngineWorkerCrashed):
+        # a SIGKILL'd worker is almost always the kernel's OOM killer
+        if exc.exitcode == -9:
+            return FailureKind.DRIVER_OOM
+        return FailureKind.WORKER_CRASHED
+
+    text = str(exc)
+    if isinstance(exc, EngineWorkerError):
+        text = f"{exc.exc_type} {exc.message}\n{exc.remote_traceback}"
+
+    for kind, patterns in FAILURE_PATTERNS:
+        if any(pattern in text for pattern in patterns):
+            return kind
+
+    return FailureKind.UNKNOWN
+
+
+@dataclass
+class RetryDecision:
+    # the engine's constructor kwargs for the next attempt
+    engine_kwargs: dict[str, Any]
+    restart_worker: bool
+    backoff_seconds: float = 0
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    max_attempts: int = 1
+    backoff_seconds: float = 30
+
+    def next_attempt(
+        self, attempt: int, kind: FailureKind, engine_kwargs: dict[str, Any]
+    ) -> RetryDecision:
+        # by default, retry with the same configuration in a fresh worker
+        return RetryDecision(
+            engine_kwargs=engine_kwargs,
+            restart_worker=True,
+            backoff_seconds=self.backoff_seconds,
+        )
+
+
+@dataclass(frozen=True)
+class SparkDegradingRetryPolicy(RetryPolicy):
+    """
+    Retries memory related failures in a restarted SparkSession with more, smaller
+    shuffle partitions and a smaller broadcast join threshold.
+    """
+
+    base_shuffle_partitions: int = 200
+    shuffle_partitions_factor: int = 2
+    # Spark's default of 10 MiB
+    base_broadcast_threshold_bytes: int = 10 * 1024 * 1024
+    broadcast_threshold_divisor: int = 4
+    # below this, broadcast joins are disabled entirely
+    min_broadcast_threshold_bytes: int = 1024 * 1024
+    s3_timeout_backoff_seconds: float = 60
+    extra_conf: dict[str, str] = field(default_factory=dict)
+
+    def next_attempt(
+        self, attempt: int, kind: FailureKind, engine_kwargs: dict[str, Any]
+    ) -> RetryDecision:
+        if kind == FailureKind.S3_TIMEOUT:
+            # nothing to degrade, MinIO is likely just overloaded. The session is
+            # fine though, so keep it and its caches.
+            return RetryDecision(
+                engine_kwargs=engine_kwargs,
+                restart_worker=False,
+                backoff_seconds=self.s3_timeout_backoff_seconds * attempt,
+            )
+
+        if kind not in MEMORY_RELATED_FAILURES:
+            return super().next_attempt(attempt, kind, engine_kwargs)
+
+        spark_conf = dict(engine_kwargs.get("spark_conf") or {})
+
+        shuffle_partitions = int(
+            spark_conf.get(
+                "spark.sql.shuffle.partitions", self.base_shuffle_partitions
+            )
+        )
+        spark_conf["spark.sql.shuffle.partitions"] = str(
+            shuffle_partitions * self.shuffle_partitions_factor
+        )
+
+        broadcast_threshold = int(
+            spark_conf.get(
+                "spark.sql.autoBroadcastJoinThreshold",
+                self.base_broadcast_threshold_bytes,
+            )
+        )
+        if broadcast_threshold > 0:
+            broadcast_threshold = broadcast_threshold // self.broadcast_threshold_divisor
+            if broadcast_threshold < self.min_broadcast_threshold_bytes:
+                broadcast_threshold = -1
+        spark_conf["spark.sql.autoBroadcastJoinThreshold"] = str(broadcast_threshold)
+
+        spark_conf.update(self.extra_conf)
+
+        return RetryDecision(
+            engine_kwargs={**engine_kwargs, "spark_conf": spark_conf},
+            restart_worker=True,
+            backoff_seconds=self.backoff_seconds,
+        )
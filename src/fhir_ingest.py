@@ -0,0 +1,410 @@
+import argparse
+import datetime
+import json
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+import numpy as np
+import pandas as pd
+import requests
+from loguru import logger
+from requests.adapters import HTTPAdapter
+
+from services import BLAZE_BASE_URL, HAPI_BASE_URL
+
+FHIR_SERVERS = {
+    "blaze": BLAZE_BASE_URL,
+    "hapi": HAPI_BASE_URL,
+}
+
+# Organizations, Locations and Practitioners referenced by the patient bundles,
+# so they have to be loaded first. bulk_to_transactions.py writes the resources
+# without a patient, e.g. Medications, to the otherInformation bundle.
+SHARED_BUNDLE_PREFIXES = [
+    "hospitalInformation",
+    "practitionerInformation",
+    "otherInformation",
+]
+
+# responses worth retrying. Transactions are atomic, so a failed bundle left
+# nothing behind, and with PUTs a retried bundle can't create duplicates either.
+RETRYABLE_STATUS_CODES = {408, 409, 412, 429, 500, 502, 503, 504}
+
+
+class AimdConcurrencyLimiter:
+    """
+    Additive increase, multiplicative decrease of the number of bundles in
+    flight: one more per window of successful bundles below the latency
+    target, halved on errors and slow bundles.
+    """
+
+    def __init__(
+        self,
+        initial_limit: int,
+        min_limit: int,
+        max_limit: int,
+        latency_target_seconds: float,
+        decrease_factor: float = 0.5,
+    ):
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target_seconds = latency_target_seconds
+        self.decrease_factor = decrease_factor
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    @contextmanager
+    def slot(self) -> Iterator[int]:
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+            in_flight = self.in_flight
+        try:
+            yield in_flight
+        finally:
+            with self._condition:
+                self.in_flight -= 1
+                self._condition.notify_all()
+
+    def on_success(self, latency_seconds: float):
+        with self._condition:
+            if latency_seconds > self.latency_target_seconds:
+                self._decrease()
+            else:
+                self.limit = min(self.limit + 1 / self.limit, self.max_limit)
+                self._condition.notify_all()
+
+    def on_failure(self):
+        with self._condition:
+            self._decrease()
+
+    def _decrease(self):
+        # the bundles in flight when the server got slow all report it, which
+        # should only count as a single congestion signal
+        now = time.perf_counter()
+        if now - self._last_decrease < self.latency_target_seconds:
+            return
+        self.limit = max(self.limit * self.decrease_factor, self.min_limit)
+        self._last_decrease = now
+
+
+def to_idempotent_bundle(bundle: dict, base_url: str) -> dict:
+    # Synthea creates the patient's resources with POSTs to urn:uuid: full URLs,
+    # so re-sending a bundle would duplicate them. With PUTs to the same ids, a
+    # retry only updates the resources the previous attempt created.
+    full_urls = {}
+    for entry in bundle.get("entry", []):
+        request = entry.get("request", {})
+        full_url = entry.get("fullUrl", "")
+        # conditional creates, like the hospital's, are idempotent already
+        if (
+            request.get("method") != "POST"
+            or "ifNoneExist" in request
+            or not full_url.startswith("urn:uuid:")
+        ):
+            continue
+        resource = entry["resource"]
+        resource["id"] = full_url.removeprefix("urn:uuid:")
+        full_urls[full_url] = f"{resource['resourceType']}/{resource['id']}"
+        entry["request"] = {"method": "PUT", "url": full_urls[full_url]}
+
+    if not full_urls:
+        return bundle
+
+    # the references to the entries point to their new ids instead
+    text = json.dumps(bundle)
+    for full_url, reference in full_urls.items():
+        text = text.replace(f'"{full_url}"', f'"{reference}"')
+    bundle = json.loads(text)
+    for entry in bundle["entry"]:
+        if entry.get("fullUrl") in full_urls.values():
+            entry["fullUrl"] = f"{base_url}/{entry['fullUrl']}"
+    return bundle
+
+
+class BundleUploader:
+    def __init__(
+        self,
+        server_name: str,
+        base_url: str,
+        limiter: AimdConcurrencyLimiter,
+        max_attempts: int,
+        timeout_seconds: float,
+    ):
+        self.server_name = server_name
+        self.base_url = base_url.rstrip("/")
+        self.limiter = limiter
+        self.max_attempts = max_attempts
+        self.timeout_seconds = timeout_seconds
+        self._local = threading.local()
+
+    def _get_session(self) -> requests.Session:
+        # one connection per thread, re-used for all of its bundles
+        if not hasattr(self._local, "session"):
+            session = requests.Session()
+            session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=1))
+            session.headers["Content-Type"] = "application/fhir+json"
+            self._local.session = session
+        return self._local.session
+
+    def upload(self, bundle_path: Path) -> dict:
+        bundle = to_idempotent_bundle(
+            json.loads(bundle_path.read_text()), self.base_url
+        )
+        body = json.dumps(bundle).encode()
+        resource_count = len(bundle.get("entry", []))
+
+        start_timestamp = datetime.datetime.now(datetime.UTC)
+        start = time.perf_counter()
+        status_code = None
+        error = None
+        latency = None
+        attempt = 0
+        for attempt in range(1, self.max_attempts + 1):
+            with self.limiter.slot() as in_flight:
+                attempt_start = time.perf_counter()
+                try:
+                    response = self._get_session().post(
+                        self.base_url, data=body, timeout=self.timeout_seconds
+                    )
+                    status_code = response.status_code
+                    error = None if response.ok else response.text[:500]
+                except requests.RequestException as exc:
+                    status_code = None
+                    error = str(exc)
+                latency = time.perf_counter() - attempt_start
+
+            if error is None:
+                self.limiter.on_success(latency)
+                break
+
+            self.limiter.on_failure()
+            if status_code is not None and status_code not in RETRYABLE_STATUS_CODES:
+                break
+            logger.warning(
+                "Attempt {attempt} of {bundle} to {server} failed ({status_code}): {error}",
+                attempt=attempt,
+                bundle=bundle_path.name,
+                server=self.server_name,
+                status_code=status_code,
+                error=error,
+            )
+            # exponential backoff with jitter
+            time.sleep(min(2**attempt, 60) * random.uniform(0.5, 1.5))
+
+        if error is not None:
+            logger.error(
+                "Failed to upload {bundle} to {server}: {error}",
+                bundle=bundle_path.name,
+                server=self.server_name,
+                error=error,
+            )
+
+        return {
+            "server": self.server_name,
+            "bundle": bundle_path.name,
+            "start_timestamp": start_timestamp,
+            "resource_count": resource_count,
+            "size_bytes": len(body),
+            "status_code": status_code,
+            "succeeded": error is None,
+            "attempts": attempt,
+            "latency_seconds": latency,
+            "total_duration_seconds": time.perf_counter() - start,
+            "in_flight": in_flight,
+            "concurrency_limit": self.limiter.limit,
+            "error": error,
+        }
+
+
+def get_bundle_paths(bundles_dir: Path) -> tuple[list[Path], list[Path]]:
+    shared, patients = [], []
+    for path in sorted(bundles_dir.glob("*.json")):
+        if any(path.name.startswith(prefix) for prefix in SHARED_BUNDLE_PREFIXES):
+            shared.append(path)
+        else:
+            patients.append(path)
+    # hospitals before practitioners, as the practitioners reference them
+    shared.sort(
+        key=lambda path: next(
+            index
+            for index, prefix in enumerate(SHARED_BUNDLE_PREFIXES)
+            if path.name.startswith(prefix)
+        )
+    )
+    return shared, patients
+
+
+def ingest(
+    server_name: str,
+    base_url: str,
+    bundles_dir: Path,
+    initial_concurrency: int,
+    max_concurrency: int,
+    latency_target_seconds: float,
+    max_attempts: int,
+    timeout_seconds: float,
+) -> list[dict]:
+    limiter = AimdConcurrencyLimiter(
+        initial_limit=initial_concurrency,
+        min_limit=1,
+        max_limit=max_concurrency,
+        latency_target_seconds=latency_target_seconds,
+    )
+    uploader = BundleUploader(
+        server_name, base_url, limiter, max_attempts, timeout_seconds
+    )
+    shared, patients = get_bundle_paths(bundles_dir)
+    logger.info(
+        "Uploading {shared} shared and {patients} patient bundles to {server}",
+        shared=len(shared),
+        patients=len(patients),
+        server=server_name,
+    )
+
+    rows = [uploader.upload(path) for path in shared]
+    if not all(row["succeeded"] for row in rows):
+        logger.error("Not uploading the patient bundles without the shared ones")
+        return rows
+
+    # more threads than the limiter allows in flight, the limiter holds them back
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        for row in executor.map(uploader.upload, patients):
+            rows.append(row)
+            if len(rows) % 1000 == 0:
+                logger.info(
+                    "Uploaded {count} bundles to {server}, concurrency limit {limit:0.1f}",
+                    count=len(rows),
+                    server=server_name,
+                    limit=limiter.limit,
+                )
+    return rows
+
+
+def summarize(bundles: pd.DataFrame) -> pd.DataFrame:
+    summaries = []
+    for server, server_bundles in bundles.groupby("server"):
+        succeeded = server_bundles[server_bundles["succeeded"]]
+        start = server_bundles["start_timestamp"].min()
+        end = (
+            server_bundles["start_timestamp"]
+            + pd.to_timedelta(server_bundles["total_duration_seconds"], unit="s")
+        ).max()
+        duration = (end - start).total_seconds()
+        latencies = succeeded["latency_seconds"].to_numpy()
+        summaries.append(
+            {
+                "server": server,
+                "bundles": len(server_bundles),
+                "failed_bundles": int((~server_bundles["succeeded"]).sum()),
+                "retried_bundles": int((server_bundles["attempts"] > 1).sum()),
+                "resources": int(succeeded["resource_count"].sum()),
+                "duration_seconds": duration,
+                "resources_per_second": succeeded["resource_count"].sum()
+                / max(duration, 1e-9),
+                "bundles_per_second": len(succeeded) / max(duration, 1e-9),
+                "p50_bundle_latency_seconds": np.percentile(latencies, 50)
+                if len(latencies)
+                else None,
+                "p99_bundle_latency_seconds": np.percentile(latencies, 99)
+                if len(latencies)
+                else None,
+                "mean_concurrency_limit": server_bundles["concurrency_limit"].mean(),
+                "final_concurrency_limit": server_bundles["concurrency_limit"].iloc[-1],
+            }
+        )
+    return pd.DataFrame(summaries)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Upload the Synthea transaction bundles to the FHIR servers with "
+        + "an adaptive concurrency and measure the import throughput"
+    )
+    parser.add_argument(
+        "--servers",
+        type=lambda value: value.split(","),
+        default=list(FHIR_SERVERS.keys()),
+        help=f"Comma-separated servers. Available: {list(FHIR_SERVERS.keys())}",
+    )
+    parser.add_argument(
+        "--bundles-dir",
+        default=None,
+        help="Defaults to ../synthea/output-<population size>/transactions/fhir",
+    )
+    parser.add_argument("--initial-concurrency", type=int, default=8)
+    parser.add_argument("--max-concurrency", type=int, default=64)
+    parser.add_argument(
+        "--latency-target-seconds",
+        type=float,
+        default=30,
+        help="Bundles slower than this reduce the concurrency",
+    )
+    parser.add_argument("--max-attempts", type=int, default=5)
+    parser.add_argument("--timeout-seconds", type=float, default=300)
+    parser.add_argument(
+        "--population-size",
+        default=os.getenv("SYNTHEA_POPULATION_SIZE", ""),
+        help="The population size of the uploaded data",
+    )
+    parser.add_argument(
+        "--output-prefix",
+        default=None,
+        help="Prefix of the result files, defaults to the population size",
+    )
+    args = parser.parse_args()
+    if args.max_attempts < 1:
+        parser.error("--max-attempts must be at least 1")
+    output_prefix = args.output_prefix or args.population_size
+
+    bundles_dir = Path(
+        args.bundles_dir
+        or f"../synthea/output-{args.population_size}/transactions/fhir"
+    )
+
+    all_rows = []
+    for server in args.servers:
+        all_rows.extend(
+            ingest(
+                server,
+                FHIR_SERVERS[server],
+                bundles_dir,
+                args.initial_concurrency,
+                args.max_concurrency,
+                args.latency_target_seconds,
+                args.max_attempts,
+                args.timeout_seconds,
+            )
+        )
+
+    output_dir = Path.cwd() / "results" / "import-resource-metrics"
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    bundles = pd.DataFrame(all_rows)
+    bundles["synthea_population_size"] = args.population_size
+    bundles.to_csv(
+        output_dir / f"{output_prefix}-fhir-ingest-bundles.csv", index=False
+    )
+
+    summary = summarize(bundles)
+    summary["synthea_population_size"] = args.population_size
+    summary.to_csv(
+        output_dir / f"{output_prefix}-fhir-ingest-summary.csv", index=False
+    )
+
+    logger.info(summary)
+    return 0 if bundles["succeeded"].all() else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,10 @@
+SELECT
+    condition.id AS condition_id,
+    condition.onsetdatetime AS onset_datetime,
+    condition_coding.system AS coding_system,
+    condition_coding.code AS coding_code,
+    condition_coding.display AS coding_display,
+    REGEXP_EXTRACT(condition.subject.reference, '^Patient/(.+)$', 1) AS patient_id,
+    REGEXP_EXTRACT(condition.encounter.reference, '^Encounter/(.+)$', 1) AS encounter_id
+FROM fhir.default.condition AS condition
+CROSS JOIN UNNEST(condition.code.coding) AS condition_coding
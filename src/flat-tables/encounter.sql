@@ -0,0 +1,8 @@
+SELECT
+    encounter.id AS encounter_id,
+    encounter.status,
+    encounter.period.start AS period_start,
+    encounter.period."end" AS period_end,
+    REGEXP_EXTRACT(encounter.subject.reference, '^Patient/(.+)$', 1) AS patient_id,
+    DATE(FROM_ISO8601_TIMESTAMP(encounter.period.start)) AS period_start_date
+FROM fhir.default.encounter
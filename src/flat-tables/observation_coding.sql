@@ -0,0 +1,13 @@
+SELECT
+    observation.id AS observation_id,
+    observation.subject.reference AS subject_reference,
+    observation.effectivedatetime AS effective_datetime,
+    observation_coding.system AS coding_system,
+    observation_coding.code AS coding_code,
+    observation_coding.display AS coding_display,
+    observation.valuequantity.system AS value_quantity_system,
+    observation.valuequantity.code AS value_quantity_code,
+    observation.valuequantity.value AS value_quantity_value,
+    REGEXP_EXTRACT(observation.subject.reference, '^Patient/(.+)$', 1) AS patient_id
+FROM fhir.default.observation AS observation
+CROSS JOIN UNNEST(observation.code.coding) AS observation_coding
@@ -0,0 +1,6 @@
+SELECT
+    id AS patient_id,
+    gender,
+    birthdate,
+    DATE(birthdate) AS birth_date
+FROM fhir.default.patient
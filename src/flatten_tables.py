@@ -0,0 +1,113 @@
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+import pandas as pd
+import trino
+from loguru import logger
+
+from trino_benchmark import TABLE_PATTERN
+from warehouse import DEFAULT_SCHEMA, get_schema_url
+
+# the analytics-ready tables queried by src/queries-flat/
+FLAT_SCHEMA = "flat"
+FLAT_TABLES_DIR = Path.cwd() / "flat-tables"
+
+
+def get_table_size(cursor, table_name: str) -> tuple[int, int]:
+    # from the hidden columns, the Delta connector has no $files table
+    cursor.execute(
+        'SELECT count(*), coalesce(sum(file_size), 0) FROM (SELECT "$path", '
+        + f'max("$file_size") AS file_size FROM fhir.{FLAT_SCHEMA}.{table_name} '
+        + 'GROUP BY "$path")'
+    )
+    num_files, total_size_bytes = cursor.fetchall()[0]
+    return num_files, total_size_bytes
+
+
+def materialize(cursor, table_name: str, select: str) -> dict:
+    cursor.execute(f"DROP TABLE IF EXISTS fhir.{FLAT_SCHEMA}.{table_name}")
+    cursor.fetchall()
+
+    start = time.perf_counter()
+    cursor.execute(f"CREATE TABLE fhir.{FLAT_SCHEMA}.{table_name} AS {select}")
+    row_count = cursor.fetchall()[0][0]
+    duration = time.perf_counter() - start
+
+    logger.info(
+        "Materialized {row_count} rows into fhir.{schema}.{table_name} in {duration:0.2f} s",
+        row_count=row_count,
+        schema=FLAT_SCHEMA,
+        table_name=table_name,
+        duration=duration,
+    )
+
+    num_files, total_size_bytes = get_table_size(cursor, table_name)
+    return {
+        "table_name": table_name,
+        "duration_seconds": duration,
+        "row_count": row_count,
+        "num_files": num_files,
+        "total_size_bytes": total_size_bytes,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Materialize flattened tables (one row per coding, parsed reference ids) "
+        + f"into fhir.{FLAT_SCHEMA} for the queries in src/queries-flat/"
+    )
+    parser.add_argument(
+        "--source-schema",
+        default=DEFAULT_SCHEMA,
+        help="The warehouse variant to flatten",
+    )
+    parser.add_argument(
+        "--population-size",
+        default=os.getenv("SYNTHEA_POPULATION_SIZE", ""),
+        help="The population size of the flattened data",
+    )
+    args = parser.parse_args()
+
+    connection = trino.dbapi.connect(
+        host="localhost", port="8080", user="trino", catalog="fhir"
+    )
+    cursor = connection.cursor()
+
+    # managed tables, so dropping them also removes their files
+    cursor.execute(
+        f"CREATE SCHEMA IF NOT EXISTS fhir.{FLAT_SCHEMA} "
+        + f"WITH (location = '{get_schema_url(FLAT_SCHEMA)}/')"
+    )
+    cursor.fetchall()
+
+    rows = []
+    for file in sorted(FLAT_TABLES_DIR.glob("*.sql")):
+        select = TABLE_PATTERN.sub(
+            lambda match: f"fhir.{args.source_schema}.{match.group(1)}",
+            file.read_text(),
+        )
+        rows.append(materialize(cursor, file.stem, select))
+
+    cursor.close()
+
+    # the build cost of the flattened tables, next to what their queries gain
+    output_dir = Path.cwd() / "results" / "flat-tables"
+    output_dir.mkdir(parents=True, exist_ok=True)
+    tables = pd.DataFrame(rows)
+    tables["source_schema"] = args.source_schema
+    tables["synthea_population_size"] = args.population_size
+    tables.to_csv(
+        output_dir
+        / f"{time.strftime('%Y%m%d-%H%M%S')}-{args.population_size}-flat-tables.csv",
+        index=False,
+    )
+
+    logger.info(tables)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
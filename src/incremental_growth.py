@@ -0,0 +1,435 @@
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+import pandas as pd
+from loguru import logger
+from pathling import PathlingContext
+from pyspark.sql import SparkSession
+
+from bulk_to_transactions import convert
+from engine_registry import get_engines
+from engine_worker import EngineWorker
+from failure_policy import classify_failure
+from fhir_ingest import ingest, summarize
+from layout_variants import STATS_COLUMNS
+from population_ladder import (
+    REPO_DIR,
+    SYNTHEA_SEED,
+    get_jvm_metrics_urls,
+    get_synthea_command,
+    rename_bulk_files,
+    run,
+    start_fhir_servers,
+    stop_fhir_servers,
+    vacuum_hapi_database,
+)
+from services import COMPOSE_PROJECT_NAME, HAPI_SQL_PROFILING, get_container_name
+from spark_session import create_spark_session, stop_spark_session
+from warehouse import (
+    BENCHMARK_RESOURCE_TYPES,
+    get_delta_table,
+    get_table_layout,
+    get_table_url,
+    register_schema,
+)
+
+# the same settings as the Pathling server's import and warehousekeeper's vacuum
+GROWTH_SPARK_CONF = {
+    "spark.sql.parquet.compression.codec": "zstd",
+    "spark.hadoop.parquet.compression.codec.zstd.level": "9",
+    "spark.databricks.delta.retentionDurationCheck.enabled": "false",
+}
+
+# Blaze and HAPI of the grown dataset listen on base and base + 1
+DEFAULT_FHIR_PORT_BASE = 18100
+
+TABLE_STATES = ["appended", "optimized"]
+
+
+def get_state_schema(schema: str, state: str) -> str:
+    # every increment is appended to both, the latter is compacted after each
+    # append like by warehousekeeper
+    return schema if state == "appended" else f"{schema}_optimized"
+
+
+def get_increment_dir(schema: str, step: int) -> Path:
+    return REPO_DIR / "synthea" / schema / f"step-{step}"
+
+
+def generate_increment(schema: str, step: int, increment_size: int) -> Path:
+    # each step has its own population seed, so the patients' ids are disjoint.
+    # Step 0 uses the seed of generate-fhir-data.
+    increment_dir = get_increment_dir(schema, step)
+    bulk_dir = increment_dir / "bulk" / "fhir"
+    transactions_dir = increment_dir / "transactions" / "fhir"
+    if (bulk_dir / "Patient.ndjson").exists() and any(transactions_dir.glob("*.json")):
+        logger.info("Reusing the increment in {path}", path=increment_dir)
+        return increment_dir
+
+    run(
+        get_synthea_command(
+            increment_size,
+            seed=SYNTHEA_SEED + step,
+            base_directory=(increment_dir / "bulk").relative_to(REPO_DIR).as_posix(),
+        ),
+        cwd=REPO_DIR,
+    )
+    rename_bulk_files(bulk_dir)
+    convert(bulk_dir, transactions_dir, 64, 256, None)
+    return increment_dir
+
+
+def get_increment_patient_ids(increment_dir: Path) -> set[str]:
+    with (increment_dir / "bulk" / "fhir" / "Patient.ndjson").open("rb") as ndjson:
+        return {json.loads(line)["id"] for line in ndjson if line.strip()}
+
+
+def get_table_patient_ids(schema: str) -> set[str] | None:
+    try:
+        table = get_delta_table(schema, "Patient")
+    except Exception:
+        # the first step creates the tables
+        return None
+    return set(table.to_pyarrow_table(columns=["id"]).column("id").to_pylist())
+
+
+def is_appended(schema: str, patient_ids: set[str]) -> bool:
+    table_patient_ids = get_table_patient_ids(schema)
+    if table_patient_ids is None:
+        return False
+
+    overlap = len(patient_ids & table_patient_ids)
+    if overlap == len(patient_ids):
+        # a previous, interrupted run already appended this step
+        return True
+    if overlap > 0:
+        raise ValueError(
+            f"{overlap} of the increment's patients are already in fhir.{schema}, "
+            + "the increments' id spaces aren't disjoint"
+        )
+    return False
+
+
+def append_increment(
+    spark: SparkSession,
+    pc: PathlingContext,
+    increment_dir: Path,
+    schema: str,
+    optimize: bool,
+) -> dict:
+    append_duration = 0
+    optimize_duration = 0
+    for resource_type in BENCHMARK_RESOURCE_TYPES:
+        ndjson_path = increment_dir / "bulk" / "fhir" / f"{resource_type}.ndjson"
+        target_url = get_table_url(schema, resource_type)
+
+        start = time.perf_counter()
+        spark.conf.set(
+            "spark.databricks.delta.properties.defaults.dataSkippingStatsColumns",
+            STATS_COLUMNS[resource_type],
+        )
+        df = pc.encode(spark.read.text(ndjson_path.as_posix()), resource_type)
+        df.write.format("delta").mode("append").save(target_url)
+        append_duration += time.perf_counter() - start
+
+        if optimize:
+            start = time.perf_counter()
+            spark.sql(f"OPTIMIZE delta.`{target_url}`")
+            spark.sql(f"VACUUM delta.`{target_url}` RETAIN 0 HOURS")
+            optimize_duration += time.perf_counter() - start
+
+    return {
+        "append_duration_seconds": append_duration,
+        "optimize_duration_seconds": optimize_duration,
+    }
+
+
+def load_increment_into_warehouse(
+    increment_dir: Path, schema: str, step: int
+) -> list[dict]:
+    patient_ids = get_increment_patient_ids(increment_dir)
+    # the appended schema last, so it marks the step as done
+    pending = [
+        state
+        for state in reversed(TABLE_STATES)
+        if not is_appended(get_state_schema(schema, state), patient_ids)
+    ]
+    if not pending:
+        logger.info("Step {step} is already in the warehouse", step=step)
+        return []
+
+    spark, _ = create_spark_session(GROWTH_SPARK_CONF)
+    pc = PathlingContext.create(spark, enable_delta=True, enable_terminology=False)
+    rows = []
+    try:
+        for state in pending:
+            state_schema = get_state_schema(schema, state)
+            logger.info(
+                "Appending step {step} to fhir.{schema}", step=step, schema=state_schema
+            )
+            result = append_increment(
+                spark, pc, increment_dir, state_schema, optimize=(state == "optimized")
+            )
+            rows.append({"target": f"delta-{state}", "step": step} | result)
+    finally:
+        stop_spark_session(spark)
+
+    for state in pending:
+        register_schema(get_state_schema(schema, state), BENCHMARK_RESOURCE_TYPES)
+    return rows
+
+
+def load_increment_into_fhir_servers(
+    increment_dir: Path, project: str, ports: dict[str, int], step: int
+) -> list[dict]:
+    rows = []
+    for server, port in ports.items():
+        bundles = pd.DataFrame(
+            ingest(
+                server,
+                f"http://localhost:{port}/fhir",
+                increment_dir / "transactions" / "fhir",
+                initial_concurrency=8,
+                max_concurrency=64,
+                latency_target_seconds=30,
+                max_attempts=5,
+                timeout_seconds=300,
+            )
+        )
+        summary = summarize(bundles).iloc[0].to_dict()
+        rows.append(
+            {
+                "target": server,
+                "step": step,
+                "append_duration_seconds": summary["duration_seconds"],
+                "optimize_duration_seconds": 0,
+                "resources_per_second": summary["resources_per_second"],
+                "failed_bundles": summary["failed_bundles"],
+            }
+        )
+
+    # HAPI's equivalent of the Delta tables' OPTIMIZE
+    start = time.perf_counter()
+    vacuum_hapi_database(project, ports)
+    for row in rows:
+        if row["target"] == "hapi":
+            row["optimize_duration_seconds"] = time.perf_counter() - start
+    return rows
+
+
+def run_engine(engine: str, kwargs: dict, runs: int) -> list[dict]:
+    spec = get_engines([engine])[0]
+    rows = []
+    worker = None
+    try:
+        worker = EngineWorker(engine, spec.factory, dict(spec.kwargs) | kwargs)
+        # the first run only warms up the engine
+        for run_id in range(runs + 1):
+            results = worker.call(
+                "run_all_queries",
+                run_id=run_id,
+                is_warmup=(run_id == 0),
+                cold_or_warm="warm",
+            )
+            rows.extend(
+                {
+                    "engine": result.engine,
+                    "run_id": result.run_id,
+                    "query_type": str(result.query_type),
+                    "query": result.query,
+                    "is_warmup": result.is_warmup,
+                    "total_duration_seconds": result.total_duration_seconds,
+                    "planning_duration_seconds": result.planning_duration_seconds,
+                    "status": "success",
+                    "failure_kind": "",
+                    "error": "",
+                }
+                for result in results
+            )
+    except Exception as exc:
+        failure_kind = classify_failure(exc)
+        logger.error(
+            "{engine} failed ({failure_kind}): {error}",
+            engine=engine,
+            failure_kind=failure_kind,
+            error=exc,
+        )
+        # kept in the results, so an engine missing from the summary shows why
+        rows.append(
+            {
+                "engine": engine,
+                "status": "failed",
+                "failure_kind": str(failure_kind),
+                "error": str(exc).splitlines()[0] if str(exc) else "",
+            }
+        )
+    finally:
+        if worker is not None:
+            worker.stop()
+    return rows
+
+
+def run_step_benchmarks(
+    schema: str,
+    project: str,
+    ports: dict[str, int] | None,
+    engines: list[str],
+    runs: int,
+) -> list[dict]:
+    rows = []
+    for engine in engines:
+        if engine in ["blaze", "hapi"]:
+            if ports is None:
+                continue
+            kwargs = {
+                "fhir_server_base_url": f"http://localhost:{ports[engine]}/fhir/",
+                "jvm_metrics_url": get_jvm_metrics_urls(ports)[engine],
+            }
+            if engine == "hapi" and HAPI_SQL_PROFILING:
+                kwargs["postgres_container"] = get_container_name(
+                    "hapi-fhir-postgres", project
+                )
+            rows.extend(
+                {"table_state": "fhir-server"} | row
+                for row in run_engine(engine, kwargs, runs)
+            )
+            continue
+
+        for state in TABLE_STATES:
+            kwargs = {"schema": get_state_schema(schema, state)}
+            rows.extend(
+                {"table_state": state} | row
+                for row in run_engine(engine, kwargs, runs)
+            )
+    return rows
+
+
+def get_layouts(schema: str, step: int) -> list[dict]:
+    return [
+        {"step": step, "table_state": state}
+        | get_table_layout(get_state_schema(schema, state), resource_type)
+        for state in TABLE_STATES
+        for resource_type in BENCHMARK_RESOURCE_TYPES
+    ]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Grow a dataset by appending disjoint Synthea increments to the "
+        + "Delta tables and FHIR servers and re-run the benchmarks after each append"
+    )
+    parser.add_argument(
+        "--schema",
+        default="growth",
+        help="The appended tables' schema. <schema>_optimized gets the same appends, "
+        + "compacted and vacuumed after each one.",
+    )
+    parser.add_argument("--increment-size", type=int, default=1000)
+    parser.add_argument("--increments", type=int, default=5)
+    parser.add_argument(
+        "--engines",
+        type=lambda value: value.split(","),
+        default=["trino", "pathling", "blaze", "hapi"],
+    )
+    parser.add_argument(
+        "--skip-fhir-servers",
+        action="store_true",
+        help="Only grow the Delta tables",
+    )
+    parser.add_argument("--fhir-port-base", type=int, default=DEFAULT_FHIR_PORT_BASE)
+    parser.add_argument(
+        "--stop-fhir-servers",
+        action="store_true",
+        help="Stop the FHIR servers when done. Their volumes are kept.",
+    )
+    parser.add_argument(
+        "--runs", type=int, default=3, help="Measured runs per engine and step"
+    )
+    args = parser.parse_args()
+
+    project = f"{COMPOSE_PROJECT_NAME}-{args.schema}"
+    ports = None
+    if not args.skip_fhir_servers:
+        ports = {"blaze": args.fhir_port_base, "hapi": args.fhir_port_base + 1}
+        start_fhir_servers(project, ports)
+
+    ingest_rows, run_rows, layout_rows = [], [], []
+    for step in range(args.increments):
+        population_size = args.increment_size * (step + 1)
+        logger.info(
+            "Growing fhir.{schema} to {population_size} patients",
+            schema=args.schema,
+            population_size=population_size,
+        )
+        increment_dir = generate_increment(args.schema, step, args.increment_size)
+
+        # the FHIR servers first, their PUTs can be repeated if the append fails
+        step_ingest_rows = []
+        if ports is not None and not is_appended(
+            args.schema, get_increment_patient_ids(increment_dir)
+        ):
+            step_ingest_rows.extend(
+                load_increment_into_fhir_servers(increment_dir, project, ports, step)
+            )
+        step_ingest_rows.extend(
+            load_increment_into_warehouse(increment_dir, args.schema, step)
+        )
+        ingest_rows.extend(
+            row | {"synthea_population_size": population_size}
+            for row in step_ingest_rows
+        )
+        layout_rows.extend(
+            row | {"synthea_population_size": population_size}
+            for row in get_layouts(args.schema, step)
+        )
+
+        run_rows.extend(
+            {"step": step, "synthea_population_size": population_size} | row
+            for row in run_step_benchmarks(
+                args.schema, project, ports, args.engines, args.runs
+            )
+        )
+
+    if ports is not None and args.stop_fhir_servers:
+        stop_fhir_servers(project, ports)
+
+    output_dir = Path.cwd() / "results" / "incremental-growth"
+    output_dir.mkdir(parents=True, exist_ok=True)
+    file_name_prefix = f"{time.strftime('%Y%m%d-%H%M%S')}-{args.schema}"
+
+    pd.DataFrame(ingest_rows).to_csv(
+        output_dir / f"{file_name_prefix}-growth-ingest.csv", index=False
+    )
+    pd.DataFrame(layout_rows).to_csv(
+        output_dir / f"{file_name_prefix}-growth-layout.csv", index=False
+    )
+
+    runs = pd.DataFrame(run_rows)
+    runs.to_csv(output_dir / f"{file_name_prefix}-growth-runs.csv", index=False)
+    succeeded = runs[runs["status"] == "success"] if not runs.empty else runs
+    if succeeded.empty:
+        logger.error("No successful runs")
+        return 1
+
+    summary = (
+        succeeded[~succeeded["is_warmup"].astype(bool)]
+        .groupby(
+            ["synthea_population_size", "table_state", "engine", "query_type", "query"]
+        )
+        .agg(
+            median_duration_seconds=("total_duration_seconds", "median"),
+            median_planning_duration_seconds=("planning_duration_seconds", "median"),
+        )
+        .reset_index()
+    )
+    summary.to_csv(output_dir / f"{file_name_prefix}-growth-summary.csv", index=False)
+
+    logger.info(summary)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
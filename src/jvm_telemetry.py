@@ -0,0 +1,235 @@
+import os
+import re
+from dataclasses import dataclass
+from typing import Callable
+
+import requests
+from loguru import logger
+
+from benchmark import BenchmarkRunResult
+
+# runs whose JVM spent more than this share of the query's latency in GC are
+# flagged with `jvm_gc_time_exceeded`
+GC_TIME_SHARE_THRESHOLD = float(os.getenv("JVM_GC_TIME_SHARE_THRESHOLD", "0.1"))
+
+# ZGC and Shenandoah report their concurrent cycles, which run next to the
+# application, besides their pauses. Only the pauses count as GC time. All of
+# G1's collectors pause, including "G1 Concurrent GC" (its Remark and Cleanup).
+CONCURRENT_COLLECTOR_PATTERN = re.compile(r"\bcycles\b", re.IGNORECASE)
+
+# a sample of the Prometheus text format, e.g.
+# `jvm_memory_used_bytes{area="heap",id="G1 Eden Space"} 1.2E9`
+PROMETHEUS_SAMPLE_PATTERN = re.compile(r"^(\w+)(?:\{(.*)\})?\s+(\S+)")
+PROMETHEUS_LABEL_PATTERN = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+
+@dataclass(frozen=True)
+class PrometheusJvmMetrics:
+    gc_count: str
+    gc_time_seconds: str
+    # the label distinguishing the collectors of the GC metrics
+    gc_label: str
+    heap_used_bytes: str
+    allocated_bytes: str
+    # only the samples with these labels are summed up
+    heap_labels: tuple[tuple[str, str], ...] = (("area", "heap"),)
+    allocated_labels: tuple[tuple[str, str], ...] = ()
+
+
+# the JVM metrics of the FHIR servers, by `fhir_server_name`
+PROMETHEUS_JVM_METRICS = {
+    # Blaze uses the Prometheus client's hotspot exports. The bytes allocated in
+    # the eden space are the ones allocated by the application.
+    "blaze": PrometheusJvmMetrics(
+        gc_count="jvm_gc_collection_seconds_count",
+        gc_time_seconds="jvm_gc_collection_seconds_sum",
+        gc_label="gc",
+        heap_used_bytes="jvm_memory_bytes_used",
+        allocated_bytes="jvm_memory_pool_allocated_bytes_total",
+        allocated_labels=(("pool", "G1 Eden Space"),),
+    ),
+    # HAPI's Spring Boot actuator uses Micrometer
+    "hapi": PrometheusJvmMetrics(
+        gc_count="jvm_gc_pause_seconds_count",
+        gc_time_seconds="jvm_gc_pause_seconds_sum",
+        gc_label="gc",
+        heap_used_bytes="jvm_memory_used_bytes",
+        allocated_bytes="jvm_gc_memory_allocated_bytes_total",
+    ),
+}
+
+# the jmx catalog of config/trino/catalog/jmx.properties. The wildcard table has a
+# row per collector.
+TRINO_GC_QUERY = """
+SELECT
+    object_name,
+    collectioncount,
+    collectiontime
+FROM jmx.current."java.lang:type=garbagecollector,name=*"
+"""
+TRINO_ALLOCATED_BYTES_QUERY = """
+SELECT totalthreadallocatedbytes FROM jmx.current."java.lang:type=threading"
+"""
+TRINO_STATUS_URL = "http://localhost:8080/v1/status"
+
+
+@dataclass
+class JvmSnapshot:
+    gc_count: int
+    gc_time_seconds: float
+    heap_used_bytes: int
+    # None if the JVM doesn't report it
+    allocated_bytes: int | None = None
+
+
+def is_pausing_collector(name: str) -> bool:
+    return CONCURRENT_COLLECTOR_PATTERN.search(name) is None
+
+
+def read_trino_jmx(connection) -> JvmSnapshot:
+    cursor = connection.cursor()
+    cursor.execute(TRINO_GC_QUERY)
+    collectors = [
+        (count, time_ms)
+        for object_name, count, time_ms in cursor.fetchall()
+        if is_pausing_collector(object_name)
+    ]
+    cursor.execute(TRINO_ALLOCATED_BYTES_QUERY)
+    allocated_bytes = cursor.fetchone()[0]
+    cursor.close()
+
+    # the jmx connector only maps simple attributes, not the heap's MemoryUsage
+    response = requests.get(
+        TRINO_STATUS_URL, headers={"X-Trino-User": "trino"}, timeout=10
+    )
+    response.raise_for_status()
+
+    return JvmSnapshot(
+        gc_count=sum(count for count, _ in collectors),
+        gc_time_seconds=sum(time_ms for _, time_ms in collectors) / 1000.0,
+        heap_used_bytes=response.json()["heapUsed"],
+        allocated_bytes=allocated_bytes,
+    )
+
+
+def read_spark_mxbeans(spark) -> JvmSnapshot:
+    # Spark runs in local mode, so the driver's JVM also runs the executors
+    management = spark._jvm.java.lang.management.ManagementFactory
+    collectors = [
+        collector
+        for collector in management.getGarbageCollectorMXBeans()
+        if is_pausing_collector(collector.getName())
+    ]
+    gc_time_ms = sum(collector.getCollectionTime() for collector in collectors)
+    return JvmSnapshot(
+        gc_count=sum(collector.getCollectionCount() for collector in collectors),
+        gc_time_seconds=gc_time_ms / 1000.0,
+        heap_used_bytes=management.getMemoryMXBean().getHeapMemoryUsage().getUsed(),
+        allocated_bytes=management.getThreadMXBean().getTotalThreadAllocatedBytes(),
+    )
+
+
+def parse_prometheus_text(text: str) -> list[tuple[str, dict[str, str], float]]:
+    samples = []
+    for line in text.splitlines():
+        match = PROMETHEUS_SAMPLE_PATTERN.match(line)
+        if match is None:
+            continue
+        name, labels, value = match.groups()
+        samples.append(
+            (name, dict(PROMETHEUS_LABEL_PATTERN.findall(labels or "")), float(value))
+        )
+    return samples
+
+
+def read_prometheus(url: str, metrics: PrometheusJvmMetrics) -> JvmSnapshot:
+    response = requests.get(url, timeout=10)
+    response.raise_for_status()
+    samples = parse_prometheus_text(response.text)
+
+    def total(name: str, labels: tuple[tuple[str, str], ...] = ()) -> float | None:
+        values = [
+            value
+            for sample_name, sample_labels, value in samples
+            if sample_name == name
+            and all(sample_labels.get(key) == v for key, v in labels)
+            and is_pausing_collector(sample_labels.get(metrics.gc_label, ""))
+        ]
+        return sum(values) if values else None
+
+    allocated_bytes = total(metrics.allocated_bytes, metrics.allocated_labels)
+    return JvmSnapshot(
+        gc_count=int(total(metrics.gc_count) or 0),
+        gc_time_seconds=total(metrics.gc_time_seconds) or 0.0,
+        heap_used_bytes=int(total(metrics.heap_used_bytes, metrics.heap_labels) or 0),
+        allocated_bytes=int(allocated_bytes) if allocated_bytes is not None else None,
+    )
+
+
+class JvmTelemetry:
+    """
+    Snapshots an engine's JVM before and after each of its queries and attaches
+    the GC, heap and allocation deltas to the query's result.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        read_snapshot: Callable[[], JvmSnapshot],
+        gc_time_share_threshold: float = GC_TIME_SHARE_THRESHOLD,
+    ):
+        self.name = name
+        self.read_snapshot = read_snapshot
+        self.gc_time_share_threshold = gc_time_share_threshold
+        self.before: JvmSnapshot | None = None
+
+    def _read(self) -> JvmSnapshot | None:
+        try:
+            return self.read_snapshot()
+        except Exception as exc:
+            # telemetry is nice to have, never fail the benchmark because of it
+            logger.warning(
+                "Failed to read the JVM telemetry of {name}: {error}",
+                name=self.name,
+                error=exc,
+            )
+            return None
+
+    def before_query(self):
+        self.before = self._read()
+
+    def after_query(self, result: BenchmarkRunResult):
+        before, self.before = self.before, None
+        after = self._read() if before is not None else None
+        # the counters start over if the JVM was restarted in between
+        if after is None or after.gc_count < before.gc_count:
+            return
+
+        result.jvm_gc_count = after.gc_count - before.gc_count
+        result.jvm_gc_time_seconds = after.gc_time_seconds - before.gc_time_seconds
+        result.jvm_heap_used_before_bytes = before.heap_used_bytes
+        result.jvm_heap_used_after_bytes = after.heap_used_bytes
+        if before.allocated_bytes is not None and after.allocated_bytes is not None:
+            result.jvm_allocated_bytes = after.allocated_bytes - before.allocated_bytes
+            if result.total_duration_seconds > 0:
+                result.jvm_allocation_rate_bytes_per_second = (
+                    result.jvm_allocated_bytes / result.total_duration_seconds
+                )
+
+        if result.total_duration_seconds > 0:
+            result.jvm_gc_time_share = (
+                result.jvm_gc_time_seconds / result.total_duration_seconds
+            )
+            result.jvm_gc_time_exceeded = (
+                result.jvm_gc_time_share > self.gc_time_share_threshold
+            )
+            if result.jvm_gc_time_exceeded:
+                logger.warning(
+                    "{name} spent {share:.0%} of {query} in GC "
+                    + "({gc_count} collections, {gc_time:.3f} s)",
+                    name=self.name,
+                    share=result.jvm_gc_time_share,
+                    query=result.query,
+                    gc_count=result.jvm_gc_count,
+                    gc_time=result.jvm_gc_time_seconds,
+                )
@@ -0,0 +1,222 @@
+import argparse
+import math
+import re
+import sys
+import time
+from pathlib import Path
+
+import pandas as pd
+from loguru import logger
+from pyspark.sql import Column, DataFrame, SparkSession
+from pyspark.sql import functions as F
+
+from spark_session import create_spark_session, stop_spark_session
+from warehouse import (
+    BENCHMARK_RESOURCE_TYPES,
+    DEFAULT_SCHEMA,
+    get_table_layout,
+    get_table_url,
+    register_schema,
+)
+
+MIB = 1024 * 1024
+
+# the queries join on subject.reference (resolve() for Pathling) and Patient.id
+SUBJECT_KEYS = {
+    "Patient": "id",
+    "Observation": "subject.reference",
+    "Condition": "subject.reference",
+    "Encounter": "subject.reference",
+}
+
+# the queries filter on code.coding. Arrays have no min/max statistics and can't be
+# Z-ordered, so the tables are range-partitioned by their first coding instead.
+CODE_KEYS = {
+    "Observation": "code.coding[0].code",
+    "Condition": "code.coding[0].code",
+}
+
+# Delta only collects statistics for the first 32 (leaf) columns by default, which
+# for the nested FHIR schemas doesn't include subject.reference.
+STATS_COLUMNS = {
+    "Patient": "id,gender,birthDate",
+    "Observation": "id,subject.reference,effectiveDateTime",
+    "Condition": "id,subject.reference,encounter.reference,onsetDateTime",
+    "Encounter": "id,subject.reference,period.start",
+}
+
+LAYOUTS = ["zorder_subject", "cluster_subject", "cluster_code", "compact"]
+
+DEFAULT_VARIANTS = [
+    "zorder_subject",
+    "cluster_subject",
+    "cluster_code",
+    "compact_32m",
+    "compact_128m",
+    "compact_1024m",
+]
+
+
+def parse_variant(variant: str) -> tuple[str, int | None]:
+    # e.g. "compact_128m" or "cluster_code_256m"
+    match = re.fullmatch(r"(\w+?)(?:_(\d+)m)?", variant)
+    if match is None or match.group(1) not in LAYOUTS:
+        raise ValueError(f"Unknown layout variant {variant}. Available: {LAYOUTS}")
+
+    target_file_size_mib = match.group(2)
+    return match.group(1), int(target_file_size_mib) if target_file_size_mib else None
+
+
+def get_num_files(source_size_bytes: int, target_file_size_bytes: int) -> int:
+    return max(1, math.ceil(source_size_bytes / target_file_size_bytes))
+
+
+def write_table(
+    spark: SparkSession, df: DataFrame, resource_type: str, target_url: str
+):
+    spark.conf.set(
+        "spark.databricks.delta.properties.defaults.dataSkippingStatsColumns",
+        STATS_COLUMNS[resource_type],
+    )
+    df.write.format("delta").mode("overwrite").option(
+        "overwriteSchema", "true"
+    ).save(target_url)
+
+
+def build_table(
+    spark: SparkSession,
+    source_schema: str,
+    variant: str,
+    resource_type: str,
+    default_target_file_size_bytes: int,
+):
+    layout, target_file_size_mib = parse_variant(variant)
+    target_file_size_bytes = (
+        target_file_size_mib * MIB
+        if target_file_size_mib is not None
+        else default_target_file_size_bytes
+    )
+
+    source_url = get_table_url(source_schema, resource_type)
+    target_url = get_table_url(variant, resource_type)
+    source_size_bytes = get_table_layout(source_schema, resource_type)[
+        "total_size_bytes"
+    ]
+    num_files = get_num_files(source_size_bytes, target_file_size_bytes)
+
+    df = spark.read.format("delta").load(source_url)
+
+    sort_key: Column | None = None
+    if layout == "cluster_subject":
+        sort_key = F.expr(SUBJECT_KEYS[resource_type])
+    elif layout == "cluster_code" and resource_type in CODE_KEYS:
+        sort_key = F.expr(CODE_KEYS[resource_type])
+
+    logger.info(
+        "Writing {resource_type} of variant {variant} to {target_url} in ~{num_files} files",
+        resource_type=resource_type,
+        variant=variant,
+        target_url=target_url,
+        num_files=num_files,
+    )
+
+    if sort_key is not None:
+        # range partitioning gives each file a narrow, non-overlapping key range
+        df = df.repartitionByRange(num_files, sort_key).sortWithinPartitions(sort_key)
+    else:
+        df = df.repartition(num_files)
+
+    write_table(spark, df, resource_type, target_url)
+
+    if layout == "zorder_subject":
+        spark.conf.set(
+            "spark.databricks.delta.optimize.maxFileSize", str(target_file_size_bytes)
+        )
+        spark.sql(
+            f"OPTIMIZE delta.`{target_url}` ZORDER BY ({SUBJECT_KEYS[resource_type]})"
+        )
+
+
+def write_layout_report(schemas: list[str], output_dir: Path) -> pd.DataFrame:
+    rows = []
+    for schema in schemas:
+        for resource_type in BENCHMARK_RESOURCE_TYPES:
+            try:
+                rows.append(get_table_layout(schema, resource_type))
+            except Exception as exc:
+                logger.warning(
+                    "Failed to read the layout of {schema}/{resource_type}: {error}",
+                    schema=schema,
+                    resource_type=resource_type,
+                    error=exc,
+                )
+
+    report = pd.DataFrame(rows)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    report.to_csv(
+        output_dir / f"{time.strftime('%Y%m%d-%H%M%S')}-layout.csv", index=False
+    )
+    return report
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Write differently laid out copies of the Delta tables. "
+        + "Run the benchmarks against a variant by setting BENCHMARK_SCHEMA=<variant>."
+    )
+    parser.add_argument(
+        "command",
+        choices=["build", "report"],
+        help="Build (and register) the variants or only report their file layout",
+    )
+    parser.add_argument(
+        "--variants",
+        type=lambda value: value.split(","),
+        default=DEFAULT_VARIANTS,
+        help=f"Comma-separated <layout>[_<target file size>m] variants, layouts: {LAYOUTS}",
+    )
+    parser.add_argument("--source-schema", default=DEFAULT_SCHEMA)
+    parser.add_argument(
+        "--target-file-size-mib",
+        type=int,
+        default=128,
+        help="Used by variants which don't specify their own target file size",
+    )
+    parser.add_argument(
+        "--skip-register",
+        action="store_true",
+        help="Don't register the variants' tables in the Hive metastore via Trino",
+    )
+    args = parser.parse_args()
+
+    # validate before starting any (slow) work
+    for variant in args.variants:
+        parse_variant(variant)
+
+    if args.command == "build":
+        spark, _ = create_spark_session()
+        try:
+            for variant in args.variants:
+                for resource_type in BENCHMARK_RESOURCE_TYPES:
+                    build_table(
+                        spark,
+                        args.source_schema,
+                        variant,
+                        resource_type,
+                        args.target_file_size_mib * MIB,
+                    )
+                if not args.skip_register:
+                    register_schema(variant, BENCHMARK_RESOURCE_TYPES)
+        finally:
+            stop_spark_session(spark)
+
+    report = write_layout_report(
+        [args.source_schema] + args.variants,
+        Path.cwd() / "results" / "layout-variants",
+    )
+    logger.info(report)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,16 +1,16 @@
 import datetime
+import json
 import os
 from pathlib import Path
 import sys
 import time
 from loguru import logger
 import pandas as pd
-import docker
-import gc
 
-from pathling_benchmark import PathlingBenchmark
-from pyrate_benchmark import PyrateBenchmark
-from trino_benchmark import TrinoBenchmark
+from engine_registry import EngineSpec, get_engines
+from engine_worker import EngineWorker
+from failure_policy import classify_failure
+from services import get_benchmark_schema
 
 NUM_RUNS_PER_ENGINE: int = 10
 
@@ -18,33 +18,73 @@ NUM_RUNS_PER_ENGINE: int = 10
 # ENGINES_TO_TEST = ["pathling"]
 # BENCHMARK_RUN_PREFIX = "only-pathling"
 
+# "cold", "warm" or "warm-cache". The latter is a warm run where engines which
+# support it (currently pathling) explicitly cache the datasets before timing.
 COLD_WARM_SEQUENCE = ["warm"]
+WARM_MODES = ["warm", "warm-cache"]
 RUN_ONLY_HEMOGLOBIN_SIMPLE: bool = False
-ENGINES_TO_TEST = ["trino", "blaze", "hapi", "pathling"]
+# engines run in this order within each round. See engine_registry.py for the
+# available ones.
+ENGINES_TO_TEST = ["trino", "pathling", "blaze", "hapi"]
 BENCHMARK_RUN_PREFIX = "all-engines"
 
-def main() -> int:
-    results = pd.DataFrame()
+# samples the containers' CPU, memory and IO at this interval while the benchmarks
+# run, next to the results. None to only rely on cAdvisor and Prometheus.
+CONTAINER_SAMPLER_INTERVAL_SECONDS: float | None = 0.25
+
+# optional `run_all_queries` arguments, only passed to engines which support them
+RUN_OPTIONS = {"only_hemoglobin_simple": RUN_ONLY_HEMOGLOBIN_SIMPLE}
+
+
+def restart_containers_for_cold_run(spec: EngineSpec):
+    # only needed for cold runs, so don't pay for the import otherwise
+    import docker
 
     docker_client = docker.from_env()
+    for index, container_name in enumerate(spec.cold_reset_containers):
+        if index > 0 and spec.cold_reset_container_delay_seconds > 0:
+            time.sleep(spec.cold_reset_container_delay_seconds)
+        logger.info(
+            "Restarting {container_name} for cold run", container_name=container_name
+        )
+        docker_client.containers.get(container_name).restart()
+
+
+def write_sidecar_table(
+    output_dir: Path, file_name_prefix: str, table_name: str, df: pd.DataFrame
+):
+    # sidecar tables live in their own sub-directories so they aren't picked up by
+    # the plotting scripts which glob the benchmark results.
+    table_dir = output_dir / table_name
+    table_dir.mkdir(parents=True, exist_ok=True)
+    df.to_csv(table_dir / f"{file_name_prefix}-{table_name}.csv", index=False)
+
+
+def main() -> int:
+    results = pd.DataFrame()
 
     logger.info("Setting up benchmarks")
-    trino = TrinoBenchmark()
-    pyrate_hapi = PyrateBenchmark(
-        fhir_server_base_url="http://localhost:8084/fhir/",
-        fhir_server_name="hapi",
-    )
-    pyrate_blaze = PyrateBenchmark(
-        fhir_server_base_url="http://localhost:8083/fhir/",
-        fhir_server_name="blaze",
-    )
-    pathling = PathlingBenchmark()
+    engines = get_engines(ENGINES_TO_TEST)
+    # every engine runs in its own worker process so that e.g. the Spark driver's
+    # memory doesn't linger while the FHIR servers are measured. The workers are
+    # started lazily on first use, so unselected engines are never even imported.
+    workers = {spec.name: EngineWorker.from_spec(spec) for spec in engines}
+
+    # the resource counts are always determined via trino, even if it isn't tested
+    trino = workers.get("trino") or EngineWorker.from_spec(get_engines(["trino"])[0])
 
     resources_to_count = ["Patient", "Observation", "Encounter", "Condition"]
 
-    resource_count_total = trino.get_resource_counts_total(resources_to_count)
+    resource_count_total = trino.call(
+        "get_resource_counts_total", resource_types=resources_to_count
+    )
+
+    resource_counts = trino.call(
+        "get_resource_counts", resource_types=resources_to_count
+    )
 
-    resource_counts = trino.get_resource_counts(resources_to_count)
+    # started again on first use, if trino is tested
+    trino.stop()
 
     logger.info("Resource counts: {resource_counts}", resource_counts=resource_counts)
 
@@ -56,144 +96,217 @@ def main() -> int:
 
     benchmark_timestamp = datetime.datetime.now(datetime.UTC)
 
-    failed_run_count = 0
+    output_dir = Path.cwd() / "results" / "benchmark-runs" / BENCHMARK_RUN_PREFIX
+    output_dir.mkdir(parents=True, exist_ok=True)
+    file_name_prefix = f"{time.strftime('%Y%m%d-%H%M%S')}-{resource_count_total}"
 
-    for cold_or_warm in COLD_WARM_SEQUENCE:
-        logger.info(
-            "Running benchmarks in {cold_or_warm} state", cold_or_warm=cold_or_warm
-        )
+    sampler = None
+    if CONTAINER_SAMPLER_INTERVAL_SECONDS is not None:
+        # imports docker, so only if it's used
+        from container_sampler import ContainerSampler
 
-        runs_to_perform = NUM_RUNS_PER_ENGINE
-        if cold_or_warm == "warm":
-            runs_to_perform = runs_to_perform + 1
+        sampler = ContainerSampler(
+            output_dir
+            / "container-samples"
+            / f"{file_name_prefix}-container-samples.parquet",
+            interval_seconds=CONTAINER_SAMPLER_INTERVAL_SECONDS,
+        ).start()
 
-        for i in range(runs_to_perform):
+    failed_run_count = 0
+    # one row per attempt of an engine's round, including the failed ones
+    attempts = []
+    # additional per-query measurements reported by the engines, by table name
+    sidecar_tables: dict[str, list[dict]] = {}
+
+    # the workers and the sampler's threads are shut down even if the run fails
+    try:
+        for cold_or_warm in COLD_WARM_SEQUENCE:
             logger.info(
-                "Run {i} out of {total_runs}", i=i + 1, total_runs=NUM_RUNS_PER_ENGINE
+                "Running benchmarks in {cold_or_warm} state", cold_or_warm=cold_or_warm
             )
 
-            # trino
-            if "trino" in ENGINES_TO_TEST:
-                trino_results = trino.run_all_queries(
-                    run_id=i,
-                    is_warmup=(cold_or_warm == "warm" and i == 0),
-                    cold_or_warm=cold_or_warm,
+            runs_to_perform = NUM_RUNS_PER_ENGINE
+            if cold_or_warm in WARM_MODES:
+                runs_to_perform = runs_to_perform + 1
+                # all rounds of one engine before the next one, so only a single
+                # engine's worker is alive at a time, e.g. the Spark driver's memory
+                # doesn't linger while Trino and the FHIR servers are measured
+                schedule = [
+                    (spec, i) for spec in engines for i in range(runs_to_perform)
+                ]
+            else:
+                # a cold run restarts the engine after every round anyway
+                schedule = [
+                    (spec, i) for i in range(runs_to_perform) for spec in engines
+                ]
+
+            for spec, i in schedule:
+                logger.info(
+                    "{engine}: run {i} out of {total_runs}",
+                    engine=spec.name,
+                    i=i + 1,
+                    total_runs=runs_to_perform,
                 )
-                results = pd.concat([results, pd.DataFrame(trino_results)])
 
-                if cold_or_warm == "cold":
-                    logger.info("Restarting trino and minio containers for cold run")
-                    docker_client.containers.get(
-                        "analytics-on-fhir-benchmark-minio-1"
-                    ).restart()
-                    docker_client.containers.get(
-                        "analytics-on-fhir-benchmark-trino-1"
-                    ).restart()
-                gc.collect()
-
-                logger.info("Done with trino. Waiting for 30s")
-                time.sleep(30)
-
-            # pathling
-            if "pathling" in ENGINES_TO_TEST:
-                # we occasionally observe transient OOM issues, so add retries here
-                max_retries = 5
-                retry_count = 0
-                while retry_count < max_retries:
+                worker = workers[spec.name]
+                run_options = {
+                    option: RUN_OPTIONS[option]
+                    for option in spec.run_options
+                    if option in RUN_OPTIONS
+                }
+
+                retry_policy = spec.retry_policy
+                engine_kwargs = spec.kwargs
+                attempt = 1
+                while attempt <= retry_policy.max_attempts:
+                    attempt_record = {
+                        "run_id": i,
+                        "engine": spec.name,
+                        "cold_or_warm": cold_or_warm,
+                        "attempt": attempt,
+                        "start_timestamp": datetime.datetime.now(datetime.UTC),
+                        "engine_kwargs": json.dumps(engine_kwargs, sort_keys=True),
+                    }
+                    attempt_start = time.perf_counter()
                     try:
-                        pathling_results = pathling.run_all_queries(
+                        engine_results = worker.call(
+                            "run_all_queries",
                             run_id=i,
-                            is_warmup=(cold_or_warm == "warm" and i == 0),
+                            is_warmup=(cold_or_warm in WARM_MODES and i == 0),
                             cold_or_warm=cold_or_warm,
+                            **run_options,
+                        )
+                        engine_sidecar_tables = worker.call("collect_sidecar_tables")
+
+                        # only kept once both calls succeeded, so a retry doesn't add
+                        # the results of the same round twice
+                        engine_results_df = pd.DataFrame(engine_results)
+                        engine_results_df["attempt"] = attempt
+                        results = pd.concat([results, engine_results_df])
+                        for table_name, rows in engine_sidecar_tables.items():
+                            sidecar_tables.setdefault(table_name, []).extend(rows)
+
+                        attempts.append(
+                            attempt_record
+                            | {
+                                "status": "success",
+                                "failure_kind": "",
+                                "error": "",
+                                "duration_seconds": time.perf_counter()
+                                - attempt_start,
+                            }
                         )
-                        results = pd.concat([results, pd.DataFrame(pathling_results)])
-                        if cold_or_warm == "cold":
-                            logger.info("Resetting pathling/spark for cold run")
-                            pathling.reset()
                         break
                     except Exception as exc:
+                        # a crashed worker is restarted on the next call
+                        failure_kind = classify_failure(exc)
+                        attempts.append(
+                            attempt_record
+                            | {
+                                "status": "failed",
+                                "failure_kind": str(failure_kind),
+                                "error": str(exc).splitlines()[0] if str(exc) else "",
+                                "duration_seconds": time.perf_counter()
+                                - attempt_start,
+                            }
+                        )
                         logger.error(
-                            "Pathling benchmark failed {error}. Attempt {retry_count} out of {max_retries}.",
-                            retry_count=retry_count,
-                            max_retries=max_retries,
+                            "{engine} benchmark failed ({failure_kind}) {error}. Attempt {attempt} out of {max_attempts}.",
+                            engine=spec.name,
+                            failure_kind=failure_kind,
+                            attempt=attempt,
+                            max_attempts=retry_policy.max_attempts,
                             error=exc,
                         )
                         failed_run_count += 1
-                        retry_count += 1
 
-                gc.collect()
-                logger.info("Done with pathling. Waiting for 30s")
-                time.sleep(30)
+                        if attempt == retry_policy.max_attempts:
+                            break
 
-            if "blaze" in ENGINES_TO_TEST:
-                # pyrate Blaze
-                pyrate_blaze_results = pyrate_blaze.run_all_queries(
-                    run_id=i,
-                    is_warmup=(cold_or_warm == "warm" and i == 0),
-                    cold_or_warm=cold_or_warm,
-                    only_hemoglobin_simple=RUN_ONLY_HEMOGLOBIN_SIMPLE,
-                )
-                results = pd.concat([results, pd.DataFrame(pyrate_blaze_results)])
+                        decision = retry_policy.next_attempt(
+                            attempt, failure_kind, engine_kwargs
+                        )
+                        engine_kwargs = decision.engine_kwargs
+                        if decision.restart_worker:
+                            worker.stop()
+                            worker.engine_kwargs = engine_kwargs
+                        time.sleep(decision.backoff_seconds)
+                        attempt += 1
+
+                # don't carry degraded settings over into the next round
+                if worker.engine_kwargs != spec.kwargs:
+                    worker.stop()
+                    worker.engine_kwargs = spec.kwargs
 
                 if cold_or_warm == "cold":
-                    logger.info("Restarting blaze for cold run")
-                    docker_client.containers.get(
-                        "analytics-on-fhir-benchmark-blaze-1"
-                    ).restart()
-                gc.collect()
-                logger.info("Done with pyrate Blaze. Waiting for 30s")
+                    restart_containers_for_cold_run(spec)
+                    reset = False
+                    if spec.cold_reset_method is not None and worker.is_running:
+                        try:
+                            worker.call(spec.cold_reset_method)
+                            reset = True
+                        except Exception as exc:
+                            logger.error(
+                                "Failed to reset {engine} for cold run, restarting its "
+                                + "worker instead: {error}",
+                                engine=spec.name,
+                                error=exc,
+                            )
+                    if not reset:
+                        # stopping the worker also shuts down any in-process
+                        # engine, the next round starts fresh.
+                        worker.stop()
+
+                if cold_or_warm in WARM_MODES and i == runs_to_perform - 1:
+                    # done with this engine, shut it down before the next one starts
+                    worker.stop()
+
+                logger.info("Done with {engine}. Waiting for 30s", engine=spec.name)
                 time.sleep(30)
 
-            if "hapi" in ENGINES_TO_TEST:
-                # pyrate HAPI
-                pyrate_hapi_results = pyrate_hapi.run_all_queries(
-                    run_id=i,
-                    is_warmup=(cold_or_warm == "warm" and i == 0),
-                    cold_or_warm=cold_or_warm,
-                    only_hemoglobin_simple=RUN_ONLY_HEMOGLOBIN_SIMPLE,
-                )
-                results = pd.concat([results, pd.DataFrame(pyrate_hapi_results)])
-
-                if cold_or_warm == "cold":
-                    logger.info("Restarting HAPI Postgres for cold run")
-                    docker_client.containers.get(
-                        "analytics-on-fhir-benchmark-hapi-fhir-postgres-1"
-                    ).restart()
-                    time.sleep(30)
-                    logger.info("Restarting HAPI Server for cold run")
-                    docker_client.containers.get(
-                        "analytics-on-fhir-benchmark-hapi-fhir-1"
-                    ).restart()
-                gc.collect()
-                logger.info("Done with pyrate HAPI. Waiting for 30s")
-                time.sleep(30)
+            logger.info("{warm_or_cold} run completed.", warm_or_cold=cold_or_warm)
+    finally:
+        for worker in workers.values():
+            worker.stop()
 
-        logger.info("{warm_or_cold} run completed.", warm_or_cold=cold_or_warm)
+        if sampler is not None:
+            sampler.stop()
 
     logger.info(
         "All benchmarks completed. Failed runs: {failed_run_count}",
         failed_run_count=failed_run_count,
     )
-    output_dir = Path.cwd() / "results" / "benchmark-runs" / BENCHMARK_RUN_PREFIX
-    output_dir.mkdir(parents=True, exist_ok=True)
 
-    results["benchmark_timestamp"] = benchmark_timestamp
+    def add_run_metadata(df: pd.DataFrame) -> pd.DataFrame:
+        df["benchmark_timestamp"] = benchmark_timestamp
+
+        # append the resource_count_total as a fixed-value column. Makes it easier to later facet by it.
+        df["resource_count_total"] = resource_count_total
 
-    # append the resource_count_total as a fixed-value column. Makes it easier to later facet by it.
-    results["resource_count_total"] = resource_count_total
+        df["synthea_population_size"] = os.getenv("SYNTHEA_POPULATION_SIZE", "")
 
-    results["synthea_population_size"] = os.getenv("SYNTHEA_POPULATION_SIZE", "")
+        # the warehouse variant (e.g. a layout variant) Trino and Pathling read from
+        df["benchmark_schema"] = get_benchmark_schema()
 
-    for resource_type in resource_counts.keys():
-        results[f"resource_count_{resource_type.lower()}"] = resource_counts[
-            resource_type
-        ]
+        for resource_type in resource_counts.keys():
+            df[f"resource_count_{resource_type.lower()}"] = resource_counts[
+                resource_type
+            ]
+        return df
 
-    results.to_csv(
-        output_dir
-        / f"{time.strftime("%Y%m%d-%H%M%S")}-{resource_count_total}-benchmark-results.csv",
+    add_run_metadata(results).to_csv(
+        output_dir / f"{file_name_prefix}-benchmark-results.csv",
         index=False,
     )
+
+    sidecar_tables["attempts"] = attempts
+    for table_name, rows in sidecar_tables.items():
+        write_sidecar_table(
+            output_dir,
+            file_name_prefix,
+            table_name,
+            add_run_metadata(pd.DataFrame(rows)),
+        )
     return 0
 
 
@@ -0,0 +1,266 @@
+import argparse
+import os
+import statistics
+import sys
+import time
+from dataclasses import replace
+from pathlib import Path
+
+import pandas as pd
+from loguru import logger
+
+from benchmark import QueryType
+from container_limits import (
+    BLAZE_CONTAINER,
+    HAPI_CONTAINER,
+    TRINO_CONTAINER,
+    get_limits,
+    restart_and_wait,
+    restore_limits,
+    set_memory_limit,
+)
+from engine_registry import get_engines
+from engine_worker import EngineWorker
+from failure_policy import classify_failure
+
+MIB = 1024 * 1024
+
+# the container whose memory limit is bisected. For pathling, the driver runs in
+# the worker process and its `spark.driver.memory` is bisected instead.
+# Note that the JVM heap flags of the containers (e.g. HAPI's -Xmx48g) are fixed,
+# so a too small limit usually shows up as the container being OOM killed.
+MEMORY_TARGETS = {
+    "trino": TRINO_CONTAINER,
+    # the flattened tables are queried by the same Trino
+    "trino-flat": TRINO_CONTAINER,
+    "blaze": BLAZE_CONTAINER,
+    "hapi": HAPI_CONTAINER,
+    "pathling": None,
+}
+
+DEFAULT_QUERIES = [
+    "extract/gender-age",
+    "extract/diabetes",
+    "extract/hemoglobin",
+    "count/gender-age",
+    "count/diabetes",
+    "count/hemoglobin",
+    "aggregate/observations-by-code",
+]
+
+
+def probe(
+    engine: str, query_type: QueryType, query_name: str, memory_mib: int, runs: int
+) -> dict:
+    spec = get_engines([engine])[0]
+    container = MEMORY_TARGETS[engine]
+
+    if container is None:
+        spark_conf = dict(spec.kwargs.get("spark_conf") or {})
+        spark_conf["spark.driver.memory"] = f"{memory_mib}m"
+        spec = replace(spec, kwargs=spec.kwargs | {"spark_conf": spark_conf})
+
+    worker = EngineWorker.from_spec(spec)
+    durations = []
+    status = "success"
+    failure_kind = ""
+    try:
+        if container is not None:
+            # a limit too small for the container to even start up is a failed
+            # probe as well, the bisection continues above it
+            set_memory_limit(container, memory_mib * MIB)
+            # start from a fresh JVM so its ergonomics see the new limit
+            restart_and_wait(container)
+
+        # the first run only warms up the engine
+        for run_id in range(runs + 1):
+            results = worker.call(
+                "run_all_queries",
+                run_id=run_id,
+                is_warmup=(run_id == 0),
+                cold_or_warm="warm",
+                query_types=[query_type],
+                query_names=[query_name],
+            )
+            if not results:
+                status = "unsupported"
+                break
+            if run_id > 0:
+                durations.extend(r.total_duration_seconds for r in results)
+    except Exception as exc:
+        status = "failed"
+        failure_kind = str(classify_failure(exc))
+        logger.warning(
+            "{engine} {query_type}/{query_name} failed with {memory_mib} MiB: {error}",
+            engine=engine,
+            query_type=query_type,
+            query_name=query_name,
+            memory_mib=memory_mib,
+            error=exc,
+        )
+    finally:
+        worker.stop()
+
+    return {
+        "engine": engine,
+        "query_type": str(query_type),
+        "query": query_name,
+        "memory_mib": memory_mib,
+        "status": status,
+        "failure_kind": failure_kind,
+        "median_duration_seconds": statistics.median(durations)
+        if status == "success" and durations
+        else None,
+    }
+
+
+def bisect_memory(
+    engine: str,
+    query_type: QueryType,
+    query_name: str,
+    max_memory_mib: int,
+    min_memory_mib: int,
+    resolution_mib: int,
+    tolerance: float,
+    runs: int,
+) -> tuple[list[dict], dict]:
+    curve = []
+
+    baseline = probe(engine, query_type, query_name, max_memory_mib, runs)
+    curve.append(baseline)
+
+    summary = {
+        "engine": engine,
+        "query_type": str(query_type),
+        "query": query_name,
+        "status": baseline["status"],
+        "minimal_viable_memory_mib": None,
+        "baseline_memory_mib": max_memory_mib,
+        "baseline_median_duration_seconds": baseline["median_duration_seconds"],
+        "tolerance": tolerance,
+    }
+    if baseline["status"] != "success":
+        return curve, summary
+
+    max_duration = baseline["median_duration_seconds"] * (1 + tolerance)
+
+    # invariant: `high` is viable, `low` is the largest known non-viable value
+    low, high = min_memory_mib - resolution_mib, max_memory_mib
+    while high - low > resolution_mib:
+        mid = (low + high) // 2
+        result = probe(engine, query_type, query_name, mid, runs)
+        curve.append(result)
+
+        is_viable = (
+            result["status"] == "success"
+            and result["median_duration_seconds"] <= max_duration
+        )
+        if is_viable:
+            high = mid
+        else:
+            low = mid
+
+    summary["minimal_viable_memory_mib"] = high
+    return curve, summary
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Bisect the minimal memory each engine needs per query"
+    )
+    parser.add_argument(
+        "--engines",
+        type=lambda value: value.split(","),
+        default=["trino", "pathling", "blaze", "hapi"],
+    )
+    parser.add_argument(
+        "--queries",
+        type=lambda value: value.split(","),
+        default=DEFAULT_QUERIES,
+        help="Comma-separated <query type>/<query name> pairs",
+    )
+    parser.add_argument(
+        "--max-memory-mib",
+        type=int,
+        default=64 * 1024,
+        help="Upper bound of the search. Also used for the baseline latency.",
+    )
+    parser.add_argument("--min-memory-mib", type=int, default=512)
+    parser.add_argument("--resolution-mib", type=int, default=256)
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="Maximum slow-down relative to the baseline before a limit counts as too small",
+    )
+    parser.add_argument(
+        "--runs", type=int, default=3, help="Measured runs per probe (plus a warm-up)"
+    )
+    parser.add_argument(
+        "--population-size",
+        default=os.getenv("SYNTHEA_POPULATION_SIZE", ""),
+        help="The population size of the loaded data",
+    )
+    args = parser.parse_args()
+
+    unknown_engines = set(args.engines) - set(MEMORY_TARGETS)
+    if unknown_engines:
+        parser.error(
+            f"No memory target for {unknown_engines}, "
+            + f"available: {list(MEMORY_TARGETS)}"
+        )
+
+    original_limits = {
+        MEMORY_TARGETS[engine]: get_limits(MEMORY_TARGETS[engine])
+        for engine in args.engines
+        if MEMORY_TARGETS[engine] is not None
+    }
+
+    curves = []
+    summaries = []
+    try:
+        for engine in args.engines:
+            for query in args.queries:
+                query_type, _, query_name = query.partition("/")
+                logger.info(
+                    "Searching the memory floor of {engine} for {query}",
+                    engine=engine,
+                    query=query,
+                )
+                curve, summary = bisect_memory(
+                    engine,
+                    QueryType(query_type),
+                    query_name,
+                    args.max_memory_mib,
+                    args.min_memory_mib,
+                    args.resolution_mib,
+                    args.tolerance,
+                    args.runs,
+                )
+                curves.extend(curve)
+                summaries.append(summary)
+    finally:
+        for container, limits in original_limits.items():
+            restore_limits(container, limits)
+            restart_and_wait(container)
+
+    output_dir = Path.cwd() / "results" / "memory-search"
+    output_dir.mkdir(parents=True, exist_ok=True)
+    file_name_prefix = f"{time.strftime('%Y%m%d-%H%M%S')}-{args.population_size}"
+
+    curves_df = pd.DataFrame(curves)
+    curves_df["synthea_population_size"] = args.population_size
+    curves_df.to_csv(output_dir / f"{file_name_prefix}-memory-curve.csv", index=False)
+
+    summaries_df = pd.DataFrame(summaries)
+    summaries_df["synthea_population_size"] = args.population_size
+    summaries_df.to_csv(
+        output_dir / f"{file_name_prefix}-memory-floor.csv", index=False
+    )
+
+    logger.info(summaries_df)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
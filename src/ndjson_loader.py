@@ -0,0 +1,316 @@
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import pandas as pd
+import requests
+from loguru import logger
+from pathling import PathlingContext
+from pyspark import SparkContext
+from pyspark.sql import functions as F
+
+from container_limits import PATHLING_CONTAINER, get_container, restart_and_wait
+from layout_variants import STATS_COLUMNS, SUBJECT_KEYS, get_num_files, write_table
+from spark_session import create_spark_session, stop_spark_session
+from warehouse import (
+    BENCHMARK_RESOURCE_TYPES,
+    DEFAULT_SCHEMA,
+    get_table_layout,
+    get_table_url,
+    register_schema,
+)
+
+MIB = 1024 * 1024
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+
+PATHLING_IMPORT_URL = "http://localhost:8082/fhir/$import"
+
+# the tables of the Pathling server import, zstd level 9 as in compose.pathling.yaml
+LOADER_SPARK_CONF = {
+    "spark.sql.parquet.compression.codec": "zstd",
+    "spark.hadoop.parquet.compression.codec.zstd.level": "9",
+}
+
+
+def get_peak_rss_bytes(status: str) -> int:
+    # the high water mark of the resident set size from /proc/<pid>/status
+    for line in status.splitlines():
+        if line.startswith("VmHWM:"):
+            return int(line.split()[1]) * 1024
+    return 0
+
+
+def get_driver_jvm_peak_rss_bytes() -> int:
+    # the driver JVM is a child process of the py4j gateway
+    process = getattr(SparkContext._gateway, "proc", None)
+    if process is None:
+        return 0
+    return get_peak_rss_bytes(Path(f"/proc/{process.pid}/status").read_text())
+
+
+def get_container_jvm_peak_rss_bytes(name: str) -> int:
+    # the JVM is the container's entrypoint, i.e. PID 1 in its namespace
+    exit_code, output = get_container(name).exec_run("cat /proc/1/status")
+    if exit_code != 0:
+        logger.warning("Failed to read the status of {name}", name=name)
+        return 0
+    return get_peak_rss_bytes(output.decode())
+
+
+def load(
+    bulk_dir: Path,
+    schema: str,
+    resource_types: list[str],
+    chunk_size_mib: int,
+    target_file_size_mib: int,
+    row_group_size_mib: int,
+    ndjson_to_parquet_ratio: float,
+) -> tuple[dict, list[dict]]:
+    spark, startup = create_spark_session(
+        LOADER_SPARK_CONF
+        | {
+            # every chunk of the NDJSON files is parsed and encoded by its own task
+            "spark.sql.files.maxPartitionBytes": str(chunk_size_mib * MIB),
+            # large row groups, so the files don't need to be compacted afterwards
+            "spark.hadoop.parquet.block.size": str(row_group_size_mib * MIB),
+        }
+    )
+    pc = PathlingContext.create(spark, enable_delta=True, enable_terminology=False)
+
+    tables = []
+    load_start = time.perf_counter()
+    try:
+        for resource_type in resource_types:
+            ndjson_path = bulk_dir / f"{resource_type}.ndjson"
+            ndjson_size_bytes = ndjson_path.stat().st_size
+            num_files = get_num_files(
+                ndjson_size_bytes,
+                int(target_file_size_mib * MIB * ndjson_to_parquet_ratio),
+            )
+            logger.info(
+                "Loading {ndjson_path} into ~{num_files} files",
+                ndjson_path=ndjson_path,
+                num_files=num_files,
+            )
+
+            table_start = time.perf_counter()
+            df = pc.encode(spark.read.text(ndjson_path.as_posix()), resource_type)
+
+            # sorted by the join key in a single pass, like the cluster_subject layout
+            sort_key = F.expr(SUBJECT_KEYS[resource_type])
+            df = df.repartitionByRange(num_files, sort_key).sortWithinPartitions(
+                sort_key
+            )
+            write_table(
+                spark, df, resource_type, get_table_url(schema, resource_type)
+            )
+
+            tables.append(
+                {
+                    "method": "ndjson-loader",
+                    "ndjson_size_bytes": ndjson_size_bytes,
+                    "load_duration_seconds": time.perf_counter() - table_start,
+                }
+                | get_table_layout(schema, resource_type)
+            )
+
+        load_duration = time.perf_counter() - load_start
+        jvm_peak_rss_bytes = get_driver_jvm_peak_rss_bytes()
+    finally:
+        stop_spark_session(spark)
+
+    register_schema(schema, resource_types)
+
+    return {
+        "method": "ndjson-loader",
+        "schema": schema,
+        "session_startup_duration_seconds": startup[
+            "session_startup_duration_seconds"
+        ],
+        "import_duration_seconds": load_duration,
+        "optimize_duration_seconds": 0,
+        "total_duration_seconds": load_duration,
+        "jvm_peak_rss_bytes": jvm_peak_rss_bytes,
+        # ru_maxrss is in KiB on Linux
+        "python_peak_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        * 1024,
+    }, tables
+
+
+def get_import_request(resource_types: list[str]) -> dict:
+    # the repo's import request, restricted to the loaded resource types
+    request = json.loads((REPO_DIR / "pathling-import-request.json").read_text())
+    request["parameter"] = [
+        parameter
+        for parameter in request["parameter"]
+        if parameter["name"] != "source"
+        or any(
+            part.get("valueCode") in resource_types for part in parameter["part"]
+        )
+    ]
+    return request
+
+
+def run_pathling_import(resource_types: list[str]) -> tuple[dict, list[dict]]:
+    # a fresh server, so the peak memory is the import's only
+    restart_and_wait(PATHLING_CONTAINER)
+
+    logger.info("Running the Pathling server's $import")
+    import_start = time.perf_counter()
+    response = requests.post(
+        PATHLING_IMPORT_URL,
+        json=get_import_request(resource_types),
+        headers={"Content-Type": "application/fhir+json"},
+        timeout=24 * 60 * 60,
+    )
+    response.raise_for_status()
+    import_duration = time.perf_counter() - import_start
+    jvm_peak_rss_bytes = get_container_jvm_peak_rss_bytes(PATHLING_CONTAINER)
+
+    tables = [
+        {"method": "pathling-import"} | get_table_layout(DEFAULT_SCHEMA, resource_type)
+        for resource_type in resource_types
+    ]
+
+    logger.info("Running warehousekeeper's optimize and vacuum")
+    optimize_start = time.perf_counter()
+    subprocess.run(
+        [
+            "docker",
+            "compose",
+            "-f",
+            "compose.warehousekeeper.yaml",
+            "up",
+            "--abort-on-container-exit",
+            "warehousekeeper",
+        ],
+        cwd=REPO_DIR,
+        # the compose file mounts config files relative to $PWD
+        env=os.environ | {"PWD": REPO_DIR.as_posix()},
+        check=True,
+    )
+    optimize_duration = time.perf_counter() - optimize_start
+
+    tables.extend(
+        {"method": "pathling-import+optimize"}
+        | get_table_layout(DEFAULT_SCHEMA, resource_type)
+        for resource_type in resource_types
+    )
+
+    return {
+        "method": "pathling-import+optimize",
+        "schema": DEFAULT_SCHEMA,
+        "session_startup_duration_seconds": 0,
+        "import_duration_seconds": import_duration,
+        "optimize_duration_seconds": optimize_duration,
+        "total_duration_seconds": import_duration + optimize_duration,
+        "jvm_peak_rss_bytes": jvm_peak_rss_bytes,
+        "python_peak_rss_bytes": 0,
+    }, tables
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Load the Synthea bulk NDJSON directly into sorted Delta tables "
+        + "and compare it to the Pathling server's $import and warehousekeeper's optimize"
+    )
+    parser.add_argument(
+        "--bulk-dir",
+        default=None,
+        help="Defaults to ../synthea/output-<population size>/bulk/fhir",
+    )
+    parser.add_argument(
+        "--schema",
+        default="ndjson",
+        help="The warehouse variant to write to. Use 'default' to replace the $import.",
+    )
+    parser.add_argument(
+        "--resource-types",
+        type=lambda value: value.split(","),
+        default=BENCHMARK_RESOURCE_TYPES,
+    )
+    parser.add_argument(
+        "--chunk-size-mib",
+        type=int,
+        default=128,
+        help="Size of the NDJSON chunks parsed in parallel",
+    )
+    parser.add_argument("--target-file-size-mib", type=int, default=512)
+    parser.add_argument("--row-group-size-mib", type=int, default=128)
+    parser.add_argument(
+        "--ndjson-to-parquet-ratio",
+        type=float,
+        default=10,
+        help="Expected size of the NDJSON relative to the Parquet files, used to "
+        + "estimate the number of files",
+    )
+    parser.add_argument(
+        "--compare-pathling-import",
+        action="store_true",
+        help="Also run the Pathling server's $import and warehousekeeper. "
+        + "Overwrites the default schema with the same data.",
+    )
+    parser.add_argument(
+        "--population-size",
+        default=os.getenv("SYNTHEA_POPULATION_SIZE", ""),
+        help="The population size of the loaded data",
+    )
+    args = parser.parse_args()
+
+    unknown_resource_types = set(args.resource_types) - set(STATS_COLUMNS.keys())
+    if unknown_resource_types:
+        logger.error(
+            "No sort key and statistics columns for {unknown}",
+            unknown=unknown_resource_types,
+        )
+        return 1
+
+    bulk_dir = Path(
+        args.bulk_dir or f"../synthea/output-{args.population_size}/bulk/fhir"
+    )
+
+    runs, tables = [], []
+    run, run_tables = load(
+        bulk_dir,
+        args.schema,
+        args.resource_types,
+        args.chunk_size_mib,
+        args.target_file_size_mib,
+        args.row_group_size_mib,
+        args.ndjson_to_parquet_ratio,
+    )
+    runs.append(run)
+    tables.extend(run_tables)
+
+    if args.compare_pathling_import:
+        run, run_tables = run_pathling_import(args.resource_types)
+        runs.append(run)
+        tables.extend(run_tables)
+
+    output_dir = Path.cwd() / "results" / "ndjson-loader"
+    output_dir.mkdir(parents=True, exist_ok=True)
+    file_name_prefix = f"{time.strftime('%Y%m%d-%H%M%S')}-{args.population_size}"
+
+    runs = pd.DataFrame(runs)
+    runs["synthea_population_size"] = args.population_size
+    runs.to_csv(output_dir / f"{file_name_prefix}-ndjson-loader.csv", index=False)
+
+    tables = pd.DataFrame(tables)
+    tables["synthea_population_size"] = args.population_size
+    tables.to_csv(
+        output_dir / f"{file_name_prefix}-ndjson-loader-layout.csv", index=False
+    )
+
+    logger.info(runs)
+    logger.info(tables)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,68 +1,224 @@
 import datetime
+import json
 import os
+import re
 import time
 from pathling import PathlingContext, Expression as exp
-from pyspark.sql import SparkSession, DataFrame
+from pyspark import StorageLevel
+from pyspark.sql import DataFrame
 from pyspark.sql.functions import count_distinct, count
 from loguru import logger
 from pathlib import Path
 
 from benchmark import Benchmark, BenchmarkRunResult, QueryType, QUERY_TYPES_TO_RUN
+from jvm_telemetry import JvmTelemetry, read_spark_mxbeans
+from query_parameters import (
+    get_condition_codes,
+    get_query_parameters,
+    to_fhirpath_code_disjunction,
+)
+from spark_metrics import (
+    SparkStageMetricsCollector,
+    count_files_read,
+    count_rows_written,
+    get_join_strategies,
+    summarize_stage_metrics,
+)
+from spark_session import create_spark_session, stop_spark_session
+from warehouse import get_benchmark_schema, get_schema_url, get_table_layout
+
+# storage levels selectable for the "warm-cache" mode. Note that PySpark's
+# MEMORY_ONLY and MEMORY_AND_DISK store the data serialized.
+CACHE_STORAGE_LEVELS = {
+    "memory": StorageLevel(False, True, False, True),
+    "memory_ser": StorageLevel.MEMORY_ONLY,
+    "memory_and_disk": StorageLevel.MEMORY_AND_DISK_DESER,
+    "memory_and_disk_ser": StorageLevel.MEMORY_AND_DISK,
+    "disk": StorageLevel.DISK_ONLY,
+}
+
+# the resources used by the benchmark queries
+CACHED_RESOURCE_TYPES = ["Patient", "Observation", "Condition", "Encounter"]
+
+
+def check_fhirpath_parentheses(expression: str):
+    # Pathling only parses the filters when a query runs, so a typo would only
+    # show up in the middle of the benchmark. String literals are skipped.
+    depth = 0
+    for token in re.findall(r"'(?:[^'\\]|\\.)*'|[()]", expression):
+        if token == "(":
+            depth += 1
+        elif token == ")":
+            depth -= 1
+        if depth < 0:
+            break
+    if depth != 0:
+        raise ValueError(f"Unbalanced parentheses in FHIRPath: {expression}")
+
 
 class PathlingBenchmark(Benchmark):
-    def __init__(self):
+    def __init__(
+        self,
+        spark_conf: dict[str, str] | None = None,
+        cache_storage_level: str | None = None,
+        schema: str | None = None,
+    ):
+        # applied on top of get_default_spark_conf(), e.g. by a retry policy
+        self.spark_conf = spark_conf or {}
+        self.cache_storage_level = cache_storage_level or os.getenv(
+            "PATHLING_CACHE_STORAGE_LEVEL", "memory_and_disk"
+        )
+        if self.cache_storage_level not in CACHE_STORAGE_LEVELS:
+            raise ValueError(
+                f"Unknown cache storage level {self.cache_storage_level}. "
+                + f"Available: {list(CACHE_STORAGE_LEVELS.keys())}"
+            )
+        # the warehouse variant to read from, e.g. a differently laid out copy
+        self.schema = schema or get_benchmark_schema()
+        self.warehouse_url = get_schema_url(self.schema)
+        self.scanned_table_pattern = re.compile(
+            re.escape(self.warehouse_url) + r"/(\w+)\.parquet"
+        )
+        self.table_num_files: dict[str, int] = {}
+        self.sidecar_tables: dict[str, list[dict]] = {}
+        self.cached_data = None
+        self.pending_session_startups: list[dict] = []
+        # reads the current session's JVM, so it survives `reset`
+        self.jvm_telemetry = JvmTelemetry(
+            "pathling", lambda: read_spark_mxbeans(self.pc.spark)
+        )
         self._init_pc()
         logger.info("Completed initialization.")
 
     def _init_pc(self):
-        spark = (
-            SparkSession.builder.config(
-                "spark.jars.packages",
-                "au.csiro.pathling:library-runtime:7.2.0,io.delta:delta-spark_2.12:3.3.0,org.apache.hadoop:hadoop-aws:3.3.4",
-            )
-            .config("fs.s3a.access.key", "admin")
-            .config("fs.s3a.secret.key", "miniopass")
-            .config("spark.sql.extensions", "io.delta.sql.DeltaSparkSessionExtension")
-            .config(
-                "spark.sql.catalog.spark_catalog",
-                "org.apache.spark.sql.delta.catalog.DeltaCatalog",
-            )
-            .config(
-                "spark.driver.memory",
-                os.getenv("SPARK_DRIVER_MEMORY", "64g"),
-            )
-            .config(
-                "spark.hadoop.fs.s3a.endpoint",
-                "localhost:9000",
-            )
-            .config(
-                "spark.hadoop.fs.s3a.connection.ssl.enabled",
-                "false",
-            )
-            .config("spark.serializer", "org.apache.spark.serializer.KryoSerializer")
-            .config(
-                "spark.hadoop.fs.s3a.path.style.access",
-                "true",
-            )
-            .config("spark.sql.shuffle.partitions", "200")
-            .config("spark.sql.adaptive.enabled", "true")
-            .config("spark.local.dir", Path.cwd() / "spark-tmp")
-            .getOrCreate()
-        )
+        spark, startup = create_spark_session(self.spark_conf)
+        # reported with the next run, as there's no run_id yet
+        self.pending_session_startups.append(startup)
 
         self.pc = PathlingContext.create(
             spark, enable_delta=True, enable_terminology=False
         )
+        self.stage_metrics_collector = SparkStageMetricsCollector(spark)
 
     def run_all_queries(
-        self, run_id: int, is_warmup: bool = False, cold_or_warm: str = "cold"
+        self,
+        run_id: int,
+        is_warmup: bool = False,
+        cold_or_warm: str = "cold",
+        query_types: list[QueryType] | None = None,
+        query_names: list[str] | None = None,
+        query_parameters: dict | None = None,
     ) -> list[BenchmarkRunResult]:
         output_folder_base = Path.cwd() / "results" / "pathling"
-
-        data = self.pc.read.delta("s3a://fhir/default")
+        parameters = get_query_parameters(query_parameters)
 
         results = []
-        queries = {
+        self.sidecar_tables = {
+            "spark-query-metrics": [],
+            "spark-stage-metrics": [],
+            "spark-session-startup": [
+                {"run_id": run_id, "engine": "pathling"} | startup
+                for startup in self.pending_session_startups
+            ],
+        }
+        self.pending_session_startups = []
+
+        if cold_or_warm == "warm-cache":
+            # materialized once per session, before any timing starts
+            if self.cached_data is None:
+                self.cached_data = self._materialize_cache(run_id)
+            data = self.cached_data
+        else:
+            data = self.pc.read.delta(self.warehouse_url)
+        queries = self._get_queries(parameters)
+
+        for query_type in query_types or QUERY_TYPES_TO_RUN:
+            for query in queries[query_type]:
+                for expression in query.get("filters", []):
+                    check_fhirpath_parentheses(expression)
+
+        start_timestamp = datetime.datetime.now(datetime.UTC)
+
+        for query_type in query_types or QUERY_TYPES_TO_RUN:
+            output_folder = output_folder_base / str(query_type)
+            output_folder.mkdir(parents=True, exist_ok=True)
+
+            queries_of_type = queries[query_type]
+            start = run_id % len(queries_of_type)
+            round_robin_queries = queries_of_type[start:] + queries_of_type[:start]
+            if query_names is not None:
+                round_robin_queries = [
+                    q for q in round_robin_queries if q["query_name"] in query_names
+                ]
+
+            for query in round_robin_queries:
+                query_name = query["query_name"]
+                logger.info(
+                    "Running {query_type} query {query_name}",
+                    query_type=query_type,
+                    query_name=query_name,
+                )
+                self.jvm_telemetry.before_query()
+                query_start_timestamp = datetime.datetime.now(datetime.UTC)
+                timings_start = time.perf_counter()
+
+                df: DataFrame = None
+
+                with self.stage_metrics_collector.job_group(
+                    f"{cold_or_warm} run {run_id}: {query_type} {query_name}"
+                ) as job_group_id:
+                    df = self._build_query(data, queries, query_type, query)
+
+                    # force analysis, optimization and physical planning, i.e. the
+                    # translation of the FHIRPath expressions to a Catalyst plan,
+                    # so it can be timed separately from the execution.
+                    executed_plan = df._jdf.queryExecution().executedPlan()
+                    planning_done = time.perf_counter()
+
+                    df.write.option("header", "true").format("csv").mode(
+                        "overwrite"
+                    ).save((output_folder / f"{query_name}.csv").as_posix())
+
+                execution_duration = time.perf_counter() - planning_done
+                duration_total = time.perf_counter() - timings_start
+
+                # Spark writes the output while computing it, so there's no separate
+                # fetch and write step. The whole action counts as fetching.
+                result = BenchmarkRunResult(
+                    run_id=run_id,
+                    start_timestamp=start_timestamp,
+                    engine="pathling",
+                    query=query_name,
+                    query_type=query_type,
+                    total_duration_seconds=duration_total,
+                    write_to_file_duration_seconds=0,
+                    fetch_duration_seconds=execution_duration,
+                    post_process_duration_seconds=0,
+                    planning_duration_seconds=planning_done - timings_start,
+                    is_warmup=is_warmup,
+                    cold_or_warm=cold_or_warm,
+                    query_start_timestamp=query_start_timestamp,
+                    query_end_timestamp=query_start_timestamp
+                    + datetime.timedelta(seconds=duration_total),
+                )
+                self.jvm_telemetry.after_query(result)
+                results.append(result)
+
+                # the file scans of the plan show the paths of the Delta tables
+                scanned_resource_types = set(
+                    self.scanned_table_pattern.findall(executed_plan.toString())
+                )
+                self._collect_stage_metrics(
+                    job_group_id, result, scanned_resource_types
+                )
+
+                df.unpersist(blocking=True)
+
+        return results
+
+    def _get_queries(self, parameters: dict) -> dict[QueryType, list[dict]]:
+        condition_codes = to_fhirpath_code_disjunction(get_condition_codes(parameters))
+        return {
             QueryType.EXTRACT: [
                 {
                     "query_name": "gender-age",
@@ -79,7 +235,7 @@ class PathlingBenchmark(Benchmark):
                         ),
                     ],
                     "filters": [
-                        "Patient.gender = 'female' and Patient.birthDate >= @1970-01-01"
+                        f"Patient.gender = 'female' and Patient.birthDate >= @{parameters['birthdate_min']}"
                     ],
                 },
                 {
@@ -88,7 +244,7 @@ class PathlingBenchmark(Benchmark):
                     "columns": [
                         exp("Condition.id", "condition_id"),
                         exp(
-                            "Condition.code.coding.where(system='http://snomed.info/sct' and (code='73211009' or code='427089005' or code='44054006')).first().code",
+                            f"Condition.code.coding.where(system='http://snomed.info/sct' and ({condition_codes})).first().code",
                             "condition_snomed_code",
                         ),
                         exp("Condition.onsetDateTime", "condition_onset"),
@@ -118,9 +274,9 @@ class PathlingBenchmark(Benchmark):
                         ),
                     ],
                     "filters": [
-                        "Condition.code.coding.where(system='http://snomed.info/sct' and (code='73211009' or code='427089005' or code='44054006')).exists()",
-                        "Condition.encounter.resolve().period.start >= @2020-01-01",
-                        "Condition.subject.resolve().ofType(Patient).birthDate >= @1970-01-01",
+                        f"Condition.code.coding.where(system='http://snomed.info/sct' and ({condition_codes})).exists()",
+                        f"Condition.encounter.resolve().period.start >= @{parameters['encounter_start_min']}",
+                        f"Condition.subject.resolve().ofType(Patient).birthDate >= @{parameters['birthdate_min']}",
                     ],
                 },
                 {
@@ -161,8 +317,8 @@ class PathlingBenchmark(Benchmark):
                         ),
                     ],
                     "filters": [
-                        "Observation.exists((code.coding.exists(system='http://loinc.org' and code='718-7') and valueQuantity.exists(system='http://unitsofmeasure.org' and code='g/dL') and valueQuantity.value > 25) "
-                        + "or (code.coding.exists(system='http://loinc.org' and (code='17856-6' or code='4548-4' or code='4549-2')) and valueQuantity.exists(system='http://unitsofmeasure.org' and code='%') and valueQuantity.value > 5))",
+                        f"Observation.exists((code.coding.exists(system='http://loinc.org' and code='718-7') and valueQuantity.exists(system='http://unitsofmeasure.org' and code='g/dL') and valueQuantity.value > {parameters['hemoglobin_min_g_dl']}) "
+                        + f"or (code.coding.exists(system='http://loinc.org' and (code='17856-6' or code='4548-4' or code='4549-2')) and valueQuantity.exists(system='http://unitsofmeasure.org' and code='%') and valueQuantity.value > {parameters['hemoglobin_min_percent']}))",
                     ],
                 },
             ],
@@ -197,7 +353,7 @@ class PathlingBenchmark(Benchmark):
                         exp("Observation.id", "observation_id"),
                     ],
                     "filters": [
-                        "Observation.code.coding.exists(system='http://loinc.org' and (code='85354-9' or code='72514-3' or code='29463-7' or code='8867-4' or code='9279-1')))",
+                        "Observation.code.coding.exists(system='http://loinc.org' and (code='85354-9' or code='72514-3' or code='29463-7' or code='8867-4' or code='9279-1'))",
                     ],
                 },
                 {
@@ -207,7 +363,7 @@ class PathlingBenchmark(Benchmark):
                         exp("Observation.id", "observation_id"),
                     ],
                     "filters": [
-                        "Observation.code.coding.exists(system='http://loinc.org' and (code='7917-8' or code='18752-6' or code='26881-3' or code='21924-6' or code='62337-1')))",
+                        "Observation.code.coding.exists(system='http://loinc.org' and (code='7917-8' or code='18752-6' or code='26881-3' or code='21924-6' or code='62337-1'))",
                     ],
                 },
                 {
@@ -217,7 +373,7 @@ class PathlingBenchmark(Benchmark):
                         exp("Observation.id", "observation_id"),
                     ],
                     "filters": [
-                        "Observation.code.coding.exists(system='http://loinc.org' and (code='85354-9' or code='72514-3' or code='29463-7' or code='8867-4' or code='9279-1' or code='7917-8' or code='18752-6' or code='26881-3' or code='21924-6' or code='62337-1')))",
+                        "Observation.code.coding.exists(system='http://loinc.org' and (code='85354-9' or code='72514-3' or code='29463-7' or code='8867-4' or code='9279-1' or code='7917-8' or code='18752-6' or code='26881-3' or code='21924-6' or code='62337-1'))",
                     ],
                 },
                 {
@@ -231,13 +387,13 @@ class PathlingBenchmark(Benchmark):
                         ),
                     ],
                     "filters": [
-                        "Observation.code.coding.exists(system='http://loinc.org' and (code='85354-9' or code='72514-3' or code='29463-7' or code='8867-4' or code='9279-1' or code='7917-8' or code='18752-6' or code='26881-3' or code='21924-6' or code='62337-1')))",
+                        "Observation.code.coding.exists(system='http://loinc.org' and (code='85354-9' or code='72514-3' or code='29463-7' or code='8867-4' or code='9279-1' or code='7917-8' or code='18752-6' or code='26881-3' or code='21924-6' or code='62337-1'))",
                     ],
                 },
             ],
             QueryType.JOIN_COUNT_SKEWED: [
                 {
-                    "query_name": "skewed-hot-codes",
+                    "query_name": "join-hot-codes",
                     "resource_type": "Observation",
                     "columns": [
                         exp(
@@ -246,11 +402,11 @@ class PathlingBenchmark(Benchmark):
                         ),
                     ],
                     "filters": [
-                        "Observation.code.coding.exists(system='http://loinc.org' and (code='85354-9' or code='72514-3' or code='29463-7' or code='8867-4' or code='9279-1')))",
+                        "Observation.code.coding.exists(system='http://loinc.org' and (code='85354-9' or code='72514-3' or code='29463-7' or code='8867-4' or code='9279-1'))",
                     ],
                 },
                 {
-                    "query_name": "skewed-rare-codes",
+                    "query_name": "join-rare-codes",
                     "resource_type": "Observation",
                     "columns": [
                         exp(
@@ -259,11 +415,11 @@ class PathlingBenchmark(Benchmark):
                         ),
                     ],
                     "filters": [
-                        "Observation.code.coding.exists(system='http://loinc.org' and (code='7917-8' or code='18752-6' or code='26881-3' or code='21924-6' or code='62337-1')))",
+                        "Observation.code.coding.exists(system='http://loinc.org' and (code='7917-8' or code='18752-6' or code='26881-3' or code='21924-6' or code='62337-1'))",
                     ],
                 },
                 {
-                    "query_name": "skewed-mixed-codes",
+                    "query_name": "join-mixed-codes",
                     "resource_type": "Observation",
                     "columns": [
                         exp(
@@ -272,100 +428,184 @@ class PathlingBenchmark(Benchmark):
                         ),
                     ],
                     "filters": [
-                        "Observation.code.coding.exists(system='http://loinc.org' and (code='85354-9' or code='72514-3' or code='29463-7' or code='8867-4' or code='9279-1' or code='7917-8' or code='18752-6' or code='26881-3' or code='21924-6' or code='62337-1')))",
+                        "Observation.code.coding.exists(system='http://loinc.org' and (code='85354-9' or code='72514-3' or code='29463-7' or code='8867-4' or code='9279-1' or code='7917-8' or code='18752-6' or code='26881-3' or code='21924-6' or code='62337-1'))",
                     ],
                 },
             ],
         }
 
-        start_timestamp = datetime.datetime.now(datetime.UTC)
+    def get_query_definition(self, query_type: QueryType, query_name: str) -> str:
+        # the FHIRPath expressions with the default parameters, overrides are
+        # passed as run options. A count re-uses the extract query of its name.
+        queries = self._get_queries(get_query_parameters(None))
+        if query_type == QueryType.COUNT:
+            query_type = QueryType.EXTRACT
+        query = [q for q in queries[query_type] if q["query_name"] == query_name][0]
+        return json.dumps(query, sort_keys=True, default=lambda e: e.as_tuple())
 
-        for query_type in QUERY_TYPES_TO_RUN:
-            output_folder = output_folder_base / str(query_type)
-            output_folder.mkdir(parents=True, exist_ok=True)
+    def _build_query(
+        self, data, queries: dict, query_type: QueryType, query: dict
+    ) -> DataFrame:
+        query_name = query["query_name"]
 
-            queries_of_type = queries[query_type]
-            start = run_id % len(queries_of_type)
-            round_robin_queries = queries_of_type[start:] + queries_of_type[:start]
+        if query_type == QueryType.AGGREGATE:
+            df = data.aggregate(
+                resource_type=query["resource_type"],
+                aggregations=query["aggregations"],
+                groupings=query["groupings"],
+                filters=query["filters"],
+            )
+            return df.orderBy(query["order_by"], ascending=False).select(
+                "coding.display",
+                "coding.code",
+                "coding.system",
+                "num_observations",
+            )
 
-            for query in round_robin_queries:
-                query_name = query["query_name"]
-                logger.info(
-                    "Running {query_type} query {query_name}",
-                    query_type=query_type,
-                    query_name=query_name,
-                )
-                timings_start = time.perf_counter()
+        # re-use the query with the same name in the list of "extract" queries
+        if query_type == QueryType.COUNT:
+            query = [
+                q for q in queries[QueryType.EXTRACT] if q["query_name"] == query_name
+            ][0]
 
-                df: DataFrame = None
+        df = data.extract(
+            resource_type=query["resource_type"],
+            columns=query["count_columns"] if query_type == QueryType.COUNT else query["columns"],
+            filters=query["filters"],
+        )
 
-                if query_type == QueryType.AGGREGATE:
-                    df = data.aggregate(
-                        resource_type=query["resource_type"],
-                        aggregations=query["aggregations"],
-                        groupings=query["groupings"],
-                        filters=query["filters"],
-                    )
-                    df = df.orderBy(query["order_by"], ascending=False).select(
-                        "coding.display",
-                        "coding.code",
-                        "coding.system",
-                        "num_observations",
-                    )
-                else:
-                    # re-use the query with the same name in the list of "extract" queries
-                    if query_type == QueryType.COUNT:
-                        query = [
-                            q
-                            for q in queries[QueryType.EXTRACT]
-                            if q["query_name"] == query_name
-                        ][0]
-
-                    df = data.extract(
-                        resource_type=query["resource_type"],
-                        columns=query["count_columns"] if query_type == QueryType.COUNT else query["columns"],
-                        filters=query["filters"],
-                    )
-
-                    if query_type == QueryType.COUNT:
-                            df = df.agg(count_distinct("column_to_count"))
-                    elif query_type == QueryType.COUNT_SKEWED:
-                        if query_name == "skewed-mixed-group-by":
-                            df = df.groupBy("code").agg(count("*").alias("count"))
-                        else:
-                            df = df.select(count("*").alias("count"))
-                    elif query_type == QueryType.JOIN_COUNT_SKEWED:
-                        df = df.select(count("patient_id").alias("count"))
-                    else:
-                        df = df.orderBy("patient_id", ascending=True)
-
-                df.write.option("header", "true").format("csv").mode("overwrite").save(
-                    (output_folder / f"{query_name}.csv").as_posix()
-                )
+        if query_type == QueryType.COUNT:
+            return df.agg(count_distinct("column_to_count"))
+        elif query_type == QueryType.COUNT_SKEWED:
+            if query_name == "skewed-mixed-group-by":
+                return df.groupBy("code").agg(count("*").alias("count"))
+            return df.select(count("*").alias("count"))
+        elif query_type == QueryType.JOIN_COUNT_SKEWED:
+            # like Trino's COUNT(DISTINCT patient.id), a patient counts once
+            return df.select(count_distinct("patient_id").alias("count"))
+        return df.orderBy("patient_id", ascending=True)
 
-                duration_total = time.perf_counter() - timings_start
+    def _collect_stage_metrics(
+        self,
+        job_group_id: str,
+        result: BenchmarkRunResult,
+        scanned_resource_types: set[str],
+    ):
+        query_keys = {
+            "run_id": result.run_id,
+            "engine": result.engine,
+            "query": result.query,
+            "query_type": str(result.query_type),
+            "cold_or_warm": result.cold_or_warm,
+            "is_warmup": result.is_warmup,
+            "schema": self.schema,
+        }
 
-                result = BenchmarkRunResult(
-                    run_id=run_id,
-                    start_timestamp=start_timestamp,
-                    engine="pathling",
-                    query=query_name,
-                    query_type=query_type,
-                    total_duration_seconds=duration_total,
-                    write_to_file_duration_seconds=0,
-                    fetch_duration_seconds=0,
-                    post_process_duration_seconds=0,
-                    is_warmup=is_warmup,
-                    cold_or_warm=cold_or_warm,
-                )
-                results.append(result)
+        try:
+            stage_rows = self.stage_metrics_collector.collect(job_group_id)
+            executions = self.stage_metrics_collector.collect_sql_executions(
+                job_group_id
+            )
+            files_read = count_files_read(executions)
+            join_strategies = get_join_strategies(executions)
+            # the result is written while it's computed, so it's only counted here
+            result.result_row_count = count_rows_written(executions)
+            # the files of all scanned tables minus the ones read were skipped
+            files_total = sum(
+                self._get_table_num_files(resource_type)
+                for resource_type in scanned_resource_types
+            )
+        except Exception as exc:
+            # metrics are nice to have, never fail the benchmark because of them
+            logger.warning(
+                "Failed to collect Spark stage metrics: {error}", error=exc
+            )
+            return
 
-                df.unpersist(blocking=True)
+        self.sidecar_tables["spark-stage-metrics"].extend(
+            query_keys | row for row in stage_rows
+        )
+        self.sidecar_tables["spark-query-metrics"].append(
+            query_keys
+            | {
+                "planning_duration_seconds": result.planning_duration_seconds,
+                "execution_duration_seconds": result.fetch_duration_seconds,
+                "scanned_resource_types": ",".join(sorted(scanned_resource_types)),
+                "files_total": files_total,
+                "files_read": files_read,
+                "files_skipped": max(files_total - files_read, 0),
+                "join_strategies": ",".join(join_strategies),
+            }
+            | summarize_stage_metrics(stage_rows)
+        )
 
-        return results
+    def _get_table_num_files(self, resource_type: str) -> int:
+        if resource_type not in self.table_num_files:
+            self.table_num_files[resource_type] = get_table_layout(
+                self.schema, resource_type
+            )["num_files"]
+        return self.table_num_files[resource_type]
+
+    def collect_sidecar_tables(self) -> dict[str, list[dict]]:
+        return self.sidecar_tables
+
+    def _materialize_cache(self, run_id: int):
+        storage_level = CACHE_STORAGE_LEVELS[self.cache_storage_level]
+        logger.info(
+            "Caching {resource_types} with storage level {storage_level}",
+            resource_types=CACHED_RESOURCE_TYPES,
+            storage_level=self.cache_storage_level,
+        )
+
+        delta_data = self.pc.read.delta(self.warehouse_url)
+        cached_resources = {}
+        cache_rows = []
+
+        for resource_type in CACHED_RESOURCE_TYPES:
+            memory_before, disk_before = self._get_cache_footprint()
+            materialization_start = time.perf_counter()
+
+            df = delta_data.read(resource_type).persist(storage_level)
+            # a full count materializes every cached partition
+            row_count = df.count()
+
+            materialization_duration = time.perf_counter() - materialization_start
+            memory_after, disk_after = self._get_cache_footprint()
+
+            cached_resources[resource_type] = df
+            cache_rows.append(
+                {
+                    "run_id": run_id,
+                    "engine": "pathling",
+                    "resource_type": resource_type,
+                    "storage_level": self.cache_storage_level,
+                    "row_count": row_count,
+                    "materialization_duration_seconds": materialization_duration,
+                    "memory_size_bytes": memory_after - memory_before,
+                    "disk_size_bytes": disk_after - disk_before,
+                }
+            )
+            logger.info(
+                "Cached {row_count} {resource_type} resources in {duration:0.2f} s",
+                row_count=row_count,
+                resource_type=resource_type,
+                duration=materialization_duration,
+            )
+
+        self.sidecar_tables["pathling-cache"] = cache_rows
+
+        return self.pc.read.datasets(cached_resources)
+
+    def _get_cache_footprint(self) -> tuple[int, int]:
+        rdd_infos = self.pc.spark.sparkContext._jsc.sc().getRDDStorageInfo()
+        memory_size = sum(info.memSize() for info in rdd_infos)
+        disk_size = sum(info.diskSize() for info in rdd_infos)
+        return memory_size, disk_size
 
-    def reset(self):
-        self.pc.spark.catalog.clearCache()
-        self.pc.spark.sparkContext._jvm.System.gc()
-        self.pc.spark.stop()
+    def reset(self, fresh_jvm: bool = True):
+        # with a fresh JVM, the new session starts from the local jar cache instead
+        # of keeping the previous session's JIT-compiled code and class loading.
+        stop_spark_session(self.pc.spark, stop_jvm=fresh_jvm)
+        self.cached_data = None
+        self.table_num_files = {}
         self._init_pc()
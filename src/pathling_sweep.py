@@ -0,0 +1,263 @@
+import argparse
+import itertools
+import os
+import sys
+import time
+from pathlib import Path
+
+import pandas as pd
+from loguru import logger
+
+from engine_worker import EngineWorker
+from failure_policy import classify_failure
+
+# Spark settings swept by default. Each entry can be overridden via
+# `--param key=value1,value2`. The Delta read options are plain Spark confs.
+DEFAULT_GRID: dict[str, list[str]] = {
+    "spark.sql.shuffle.partitions": ["8", "32", "64", "200", "400"],
+    "spark.sql.adaptive.coalescePartitions.enabled": ["true", "false"],
+    "spark.sql.autoBroadcastJoinThreshold": ["-1", "10485760", "104857600"],
+    "spark.master": ["local[4]", "local[*]"],
+    "spark.driver.memory": [os.getenv("SPARK_DRIVER_MEMORY", "64g")],
+    "spark.sql.files.maxPartitionBytes": ["134217728"],
+    "spark.databricks.delta.stats.skipping": ["true"],
+}
+
+# used as the baseline of the one-at-a-time strategy, i.e. the current defaults
+BASELINE: dict[str, str] = {
+    "spark.sql.shuffle.partitions": "200",
+    "spark.sql.adaptive.coalescePartitions.enabled": "true",
+    "spark.sql.autoBroadcastJoinThreshold": "10485760",
+    "spark.master": "local[*]",
+    "spark.driver.memory": os.getenv("SPARK_DRIVER_MEMORY", "64g"),
+    "spark.sql.files.maxPartitionBytes": "134217728",
+    "spark.databricks.delta.stats.skipping": "true",
+}
+
+
+def parse_params(params: list[str]) -> dict[str, list[str]]:
+    grid = {}
+    for param in params:
+        key, _, values = param.partition("=")
+        if not values:
+            raise ValueError(f"Expected key=value1,value2 but got {param}")
+        grid[key.strip()] = [value.strip() for value in values.split(",")]
+    return grid
+
+
+def build_configs(grid: dict[str, list[str]], strategy: str) -> list[dict[str, str]]:
+    if strategy == "grid":
+        keys = list(grid.keys())
+        return [dict(zip(keys, values)) for values in itertools.product(*grid.values())]
+
+    # one-at-a-time: vary a single setting while keeping the others at the baseline
+    baseline = BASELINE | {
+        key: values[0] for key, values in grid.items() if key not in BASELINE
+    }
+    configs = [baseline]
+    for key, values in grid.items():
+        for value in values:
+            config = baseline | {key: value}
+            if config not in configs:
+                configs.append(config)
+    return configs
+
+
+def run_config(
+    config_id: int, spark_conf: dict[str, str], runs: int
+) -> tuple[list[dict], list[dict]]:
+    worker = EngineWorker(
+        f"pathling-sweep-{config_id}",
+        "pathling_benchmark:PathlingBenchmark",
+        {"spark_conf": spark_conf},
+    )
+
+    rows = []
+    failures = []
+    try:
+        # the first run only warms up the session
+        for run_id in range(runs + 1):
+            try:
+                run_results = worker.call(
+                    "run_all_queries",
+                    run_id=run_id,
+                    is_warmup=(run_id == 0),
+                    cold_or_warm="warm",
+                )
+            except Exception as exc:
+                failure_kind = classify_failure(exc)
+                logger.error(
+                    "Config {config_id} failed ({failure_kind}): {error}",
+                    config_id=config_id,
+                    failure_kind=failure_kind,
+                    error=exc,
+                )
+                failures.append(
+                    {
+                        "config_id": config_id,
+                        "run_id": run_id,
+                        "failure_kind": str(failure_kind),
+                        "error": str(exc).splitlines()[0] if str(exc) else "",
+                    }
+                )
+                # a config which fails once is likely to fail again
+                break
+
+            for result in run_results:
+                rows.append(
+                    {
+                        "config_id": config_id,
+                        "run_id": result.run_id,
+                        "query": result.query,
+                        "query_type": str(result.query_type),
+                        "is_warmup": result.is_warmup,
+                        "total_duration_seconds": result.total_duration_seconds,
+                        "planning_duration_seconds": result.planning_duration_seconds,
+                        "fetch_duration_seconds": result.fetch_duration_seconds,
+                    }
+                    | spark_conf
+                )
+    finally:
+        worker.stop()
+
+    return rows, failures
+
+
+def recommend(
+    results: pd.DataFrame,
+    config_keys: list[str],
+    runs: int,
+    failed_config_ids: set[int] = frozenset(),
+) -> pd.DataFrame:
+    # a config which failed in a later run still has every query of the earlier
+    # ones, but its median would be based on fewer runs than the others'
+    measured = results[
+        ~results["is_warmup"] & ~results["config_id"].isin(failed_config_ids)
+    ]
+    per_query = (
+        measured.groupby(
+            ["synthea_population_size", "query_type", "config_id", "query"]
+        )
+        .agg(
+            total_duration_seconds=("total_duration_seconds", "median"),
+            num_runs=("run_id", "nunique"),
+        )
+        .reset_index()
+    )
+    per_query = per_query[per_query["num_runs"] == runs]
+
+    # only configs which completed every query of a type are eligible
+    queries_per_type = per_query.groupby("query_type")["query"].nunique()
+    per_config = (
+        per_query.groupby(["synthea_population_size", "query_type", "config_id"])
+        .agg(
+            total_median_duration_seconds=("total_duration_seconds", "sum"),
+            num_queries=("query", "nunique"),
+        )
+        .reset_index()
+    )
+    per_config = per_config[
+        per_config["num_queries"]
+        == per_config["query_type"].map(queries_per_type)
+    ]
+
+    best = per_config.loc[
+        per_config.groupby(["synthea_population_size", "query_type"])[
+            "total_median_duration_seconds"
+        ].idxmin()
+    ]
+
+    configs = results[["config_id"] + config_keys].drop_duplicates("config_id")
+    return best.merge(configs, on="config_id", how="left")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Run the Pathling queries over a grid of Spark settings"
+    )
+    parser.add_argument(
+        "--param",
+        action="append",
+        default=[],
+        help="Values to sweep for a Spark setting, e.g. spark.sql.shuffle.partitions=8,64,200. "
+        + "Replaces the default values of that setting.",
+    )
+    parser.add_argument(
+        "--strategy",
+        choices=["grid", "one-at-a-time"],
+        default="one-at-a-time",
+        help="Run the full cartesian product or vary one setting at a time",
+    )
+    parser.add_argument(
+        "--runs", type=int, default=3, help="Measured runs per config (plus a warm-up)"
+    )
+    parser.add_argument(
+        "--population-size",
+        default=os.getenv("SYNTHEA_POPULATION_SIZE", ""),
+        help="The population size of the loaded data",
+    )
+    args = parser.parse_args()
+
+    grid = DEFAULT_GRID | parse_params(args.param)
+    configs = build_configs(grid, args.strategy)
+    logger.info(
+        "Sweeping {count} Spark configurations ({strategy})",
+        count=len(configs),
+        strategy=args.strategy,
+    )
+
+    all_rows = []
+    all_failures = []
+    for config_id, spark_conf in enumerate(configs):
+        logger.info(
+            "Config {config_id}/{total}: {spark_conf}",
+            config_id=config_id + 1,
+            total=len(configs),
+            spark_conf=spark_conf,
+        )
+        rows, failures = run_config(config_id, spark_conf, args.runs)
+        all_rows.extend(rows)
+        all_failures.extend(failures)
+
+    output_dir = Path.cwd() / "results" / "pathling-sweep"
+    output_dir.mkdir(parents=True, exist_ok=True)
+    file_name_prefix = f"{time.strftime('%Y%m%d-%H%M%S')}-{args.population_size}"
+
+    results = pd.DataFrame(all_rows)
+    results["synthea_population_size"] = args.population_size
+    results.to_csv(output_dir / f"{file_name_prefix}-sweep.csv", index=False)
+
+    if all_failures:
+        pd.DataFrame(all_failures).to_csv(
+            output_dir / f"{file_name_prefix}-sweep-failures.csv", index=False
+        )
+
+    if results.empty:
+        logger.error("No configuration completed successfully")
+        return 1
+
+    recommendations = recommend(
+        results,
+        list(grid.keys()),
+        args.runs,
+        {failure["config_id"] for failure in all_failures},
+    )
+    recommendations.to_csv(
+        output_dir / f"{file_name_prefix}-sweep-recommendations.csv", index=False
+    )
+
+    for _, row in recommendations.iterrows():
+        logger.info(
+            "Best config for {query_type} queries at population size {population_size}: "
+            + "{config} ({duration:0.2f} s total median)",
+            query_type=row["query_type"],
+            population_size=row["synthea_population_size"],
+            config={key: row[key] for key in grid.keys()},
+            duration=row["total_median_duration_seconds"],
+        )
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
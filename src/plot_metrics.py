@@ -8,13 +8,23 @@ df = pd.DataFrame()
 
 metrics_dir_path = Path.cwd() / "results" / "import-resource-metrics"
 
-for file in metrics_dir_path.glob("*.csv"):
+# collect_metrics.py writes Parquet, earlier runs wrote CSV files with unix timestamps
+metrics_files = sorted(metrics_dir_path.glob("*-metrics.parquet")) + sorted(
+    metrics_dir_path.glob("*-metrics.csv")
+)
+
+for file in metrics_files:
     if file.name.startswith("_"):
         logger.info("Skipping {file}", file=file)
         continue
 
     logger.info("Adding {file} to dataset", file=file)
-    file_df = pd.read_csv(file)
+    if file.suffix == ".parquet":
+        file_df = pd.read_parquet(file)
+    else:
+        file_df = pd.read_csv(file)
+        file_df["timestamp"] = pd.to_datetime(file_df["timestamp"], unit="s", utc=True)
+        file_df["start"] = pd.to_datetime(file_df["start"], utc=True)
     file_df["synthea_population_size"] = file_df["synthea_population_size"].astype(str)
     df = pd.concat([df, file_df])
 
@@ -0,0 +1,60 @@
+from pathlib import Path
+import pandas as pd
+import seaborn as sns
+from loguru import logger
+
+df = pd.DataFrame()
+
+scaling_dir_path = Path.cwd() / "results" / "scaling"
+
+for file in scaling_dir_path.glob("*-scaling-curves.csv"):
+    if file.name.startswith("_"):
+        logger.info("Skipping {file}", file=file)
+        continue
+
+    logger.info("Adding {file} to dataset", file=file)
+    df = pd.concat([df, pd.read_csv(file)])
+
+df["engine"] = df["engine"].replace({"pathling": "Pathling", "trino": "Trino"})
+
+output_dir = Path.cwd() / "results" / "plots" / "scaling"
+output_dir.mkdir(parents=True, exist_ok=True)
+
+sns.set_theme(style="whitegrid", font="sans-serif", context="paper")
+
+for query_type, query_type_df in df.groupby("query_type"):
+    for metric, label in [
+        ("speedup", "Speed-up"),
+        ("parallel_efficiency", "Parallel efficiency"),
+    ]:
+        g = sns.relplot(
+            data=query_type_df,
+            kind="line",
+            x="cores",
+            y=metric,
+            hue="engine",
+            style="synthea_population_size",
+            col="query",
+            palette="Set2",
+            marker="o",
+        )
+
+        if metric == "speedup":
+            # ideal linear scaling for reference
+            for ax in g.axes.flat:
+                cores = sorted(query_type_df["cores"].unique())
+                ax.plot(
+                    cores,
+                    [c / cores[0] for c in cores],
+                    color=".5",
+                    linestyle="--",
+                    linewidth=1,
+                )
+
+        g.set(xscale="log", xticks=sorted(query_type_df["cores"].unique()))
+        g.set_xticklabels(sorted(query_type_df["cores"].unique()))
+        g.set_titles("{col_name}")
+        g.set_axis_labels("CPU cores", label)
+        g.legend.set_title("Query Engine")
+
+        g.figure.savefig(output_dir / f"{query_type}-{metric}.png", dpi=300)
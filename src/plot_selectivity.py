@@ -0,0 +1,55 @@
+from pathlib import Path
+import pandas as pd
+import seaborn as sns
+from loguru import logger
+
+df = pd.DataFrame()
+
+selectivity_dir_path = Path.cwd() / "results" / "selectivity"
+
+for file in selectivity_dir_path.glob("*-selectivity-curves.csv"):
+    if file.name.startswith("_"):
+        logger.info("Skipping {file}", file=file)
+        continue
+
+    logger.info("Adding {file} to dataset", file=file)
+    df = pd.concat([df, pd.read_csv(file)])
+
+df["engine"] = df["engine"].replace(
+    {
+        "pathling": "Pathling",
+        "trino": "Trino",
+        "pyrate-blaze": "Blaze",
+        "pyrate-hapi": "HAPI",
+    }
+)
+
+output_dir = Path.cwd() / "results" / "plots" / "selectivity"
+output_dir.mkdir(parents=True, exist_ok=True)
+
+sns.set_theme(style="whitegrid", font="sans-serif", context="paper")
+
+for (parameter, query_type), parameter_df in df.groupby(["parameter", "query_type"]):
+    # a selectivity of 0 can't be drawn on a log scale
+    parameter_df = parameter_df[parameter_df["selectivity"] > 0]
+    if parameter_df.empty:
+        continue
+
+    g = sns.relplot(
+        data=parameter_df,
+        kind="line",
+        x="selectivity",
+        y="median_duration_seconds",
+        hue="engine",
+        style="synthea_population_size",
+        col="query",
+        palette="Set2",
+        marker="o",
+    )
+
+    g.set(xscale="log")
+    g.set_titles("{col_name}")
+    g.set_axis_labels(f"Selectivity ({parameter})", "Median duration [s]")
+    g.legend.set_title("Query Engine")
+
+    g.figure.savefig(output_dir / f"{query_type}-{parameter}.png", dpi=300)
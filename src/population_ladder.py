@@ -0,0 +1,486 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import pandas as pd
+import requests
+from loguru import logger
+
+from container_limits import wait_for_url
+from services import COMPOSE_PROJECT_NAME
+from warehouse import BENCHMARK_RESOURCE_TYPES, get_delta_table
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+SRC_DIR = REPO_DIR / "src"
+
+DEFAULT_POPULATION_SIZES = [1000, 5000, 10000, 50000, 100000]
+
+# the same seeds as the generate-fhir-data task
+SYNTHEA_SEED = 20240711
+SYNTHEA_JAR = REPO_DIR / "synthea-with-dependencies.jar"
+SYNTHEA_PROPERTIES = REPO_DIR / "config" / "synthea.properties"
+
+# the stage markers live outside of synthea/, so they survive
+# remove-local-synthea-files. A stage is only skipped if its marker matches the
+# dataset's fingerprint and the loaded data is still there.
+MARKERS_DIR = REPO_DIR / ".population-ladder"
+
+# the first population size's Blaze and HAPI listen on 18000 and 18001, the next
+# free pair is assigned to every new size
+DEFAULT_FHIR_PORT_BASE = 18000
+# Blaze's metrics port is offset from its FHIR port, e.g. 19000 for 18000
+BLAZE_METRICS_PORT_OFFSET = 1000
+
+
+def get_schema(population_size: int) -> str:
+    return f"pop_{population_size}"
+
+
+def get_fhir_compose_project(population_size: int) -> str:
+    return f"{COMPOSE_PROJECT_NAME}-pop-{population_size}"
+
+
+def get_synthea_output_dir(population_size: int) -> Path:
+    return REPO_DIR / "synthea" / f"output-{population_size}"
+
+
+def get_synthea_command(
+    population_size: int, seed: int = SYNTHEA_SEED, base_directory: str | None = None
+) -> list[str]:
+    # only the population seed varies, the clinician seed and the reference and
+    # end dates stay the same
+    fixed = str(SYNTHEA_SEED)
+    return [
+        "java",
+        "-jar",
+        SYNTHEA_JAR.as_posix(),
+        *["-s", str(seed), "-cs", fixed, "-r", fixed, "-e", fixed],
+        *["-p", str(population_size)],
+        *["-c", SYNTHEA_PROPERTIES.relative_to(REPO_DIR).as_posix()],
+        "--exporter.baseDirectory="
+        + (base_directory or f"./synthea/output-{population_size}/bulk"),
+        "--exporter.fhir.bulk_data=true",
+    ]
+
+
+def rename_bulk_files(bulk_fhir_dir: Path):
+    for path in bulk_fhir_dir.glob("*.*.ndjson"):
+        # Patient.1.ndjson -> Patient.ndjson
+        path.rename(path.with_name(f"{path.name.split('.')[0]}.ndjson"))
+
+
+def get_fingerprint(population_size: int) -> str:
+    # everything that determines the generated data. The synthea jar is pinned
+    # by the install-dependencies task.
+    fingerprint = {
+        "seed": SYNTHEA_SEED,
+        "population_size": population_size,
+        "synthea_properties": SYNTHEA_PROPERTIES.read_text(),
+        "synthea_command": get_synthea_command(population_size),
+    }
+    return hashlib.sha256(json.dumps(fingerprint, sort_keys=True).encode()).hexdigest()
+
+
+def get_marker_path(population_size: int, stage: str) -> Path:
+    return MARKERS_DIR / str(population_size) / f"{stage}.json"
+
+
+def has_marker(population_size: int, stage: str, fingerprint: str) -> bool:
+    path = get_marker_path(population_size, stage)
+    if not path.exists():
+        return False
+    return json.loads(path.read_text()).get("fingerprint") == fingerprint
+
+
+def write_marker(population_size: int, stage: str, fingerprint: str, duration: float):
+    path = get_marker_path(population_size, stage)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(
+        json.dumps(
+            {
+                "fingerprint": fingerprint,
+                "population_size": population_size,
+                "stage": stage,
+                "finished_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "duration_seconds": duration,
+            },
+            indent=2,
+        )
+    )
+
+
+def get_ports(population_size: int, port_base: int) -> dict[str, int]:
+    # a size keeps the ports of its first run in its markers, so adding or
+    # reordering sizes doesn't move the FHIR servers which are already running
+    path = MARKERS_DIR / str(population_size) / "ports.json"
+    if path.exists():
+        return json.loads(path.read_text())
+
+    taken = {
+        port
+        for other in MARKERS_DIR.glob("*/ports.json")
+        for port in json.loads(other.read_text()).values()
+    }
+    blaze_port = port_base
+    while blaze_port in taken or blaze_port + 1 in taken:
+        blaze_port += 2
+    ports = {"blaze": blaze_port, "hapi": blaze_port + 1}
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(ports, indent=2))
+    return ports
+
+
+def has_generated_data(population_size: int) -> bool:
+    output_dir = get_synthea_output_dir(population_size)
+    return (output_dir / "bulk" / "fhir" / "Patient.ndjson").exists() and any(
+        (output_dir / "transactions" / "fhir").glob("*.json")
+    )
+
+
+def has_warehouse_tables(population_size: int) -> bool:
+    try:
+        for resource_type in BENCHMARK_RESOURCE_TYPES:
+            get_delta_table(get_schema(population_size), resource_type)
+    except Exception:
+        return False
+    return True
+
+
+def get_patient_count(base_url: str) -> int:
+    try:
+        response = requests.get(
+            f"{base_url}/Patient", params={"_summary": "count"}, timeout=60
+        )
+        response.raise_for_status()
+        return response.json().get("total", 0)
+    except (requests.RequestException, ValueError):
+        return 0
+
+
+def has_fhir_server_data(ports: dict[str, int]) -> bool:
+    return all(
+        get_patient_count(f"http://localhost:{port}/fhir") > 0
+        for port in ports.values()
+    )
+
+
+def run(command: list[str], cwd: Path, env: dict[str, str] | None = None):
+    logger.info("Running {command}", command=" ".join(command))
+    subprocess.run(command, cwd=cwd, env=os.environ | (env or {}), check=True)
+
+
+def generate(population_size: int):
+    output_dir = get_synthea_output_dir(population_size)
+    # stale data of a different fingerprint would be mixed into the new one
+    for directory in ["bulk", "transactions"]:
+        shutil.rmtree(output_dir / directory, ignore_errors=True)
+
+    run(get_synthea_command(population_size), cwd=REPO_DIR)
+    rename_bulk_files(output_dir / "bulk" / "fhir")
+
+    run(
+        [
+            sys.executable,
+            "bulk_to_transactions.py",
+            "--population-size",
+            str(population_size),
+        ],
+        cwd=SRC_DIR,
+    )
+
+
+def load_warehouse(population_size: int):
+    # unlike the $import and warehousekeeper's OPTIMIZE of the default schema,
+    # the tables are sorted by subject and only keep the statistics of
+    # layout_variants.STATS_COLUMNS. The Pathling server only imports into the
+    # default schema.
+    run(
+        [
+            sys.executable,
+            "ndjson_loader.py",
+            "--schema",
+            get_schema(population_size),
+            "--population-size",
+            str(population_size),
+        ],
+        cwd=SRC_DIR,
+    )
+
+
+def get_compose_command(project: str) -> list[str]:
+    return [
+        "docker",
+        "compose",
+        "-p",
+        project,
+        "-f",
+        "compose.blaze.yaml",
+        "-f",
+        "compose.hapi.yaml",
+    ]
+
+
+def get_fhir_env(project: str, ports: dict[str, int]) -> dict[str, str]:
+    return {
+        "BLAZE_PORT": str(ports["blaze"]),
+        "HAPI_PORT": str(ports["hapi"]),
+        "BLAZE_METRICS_PORT": str(ports["blaze"] + BLAZE_METRICS_PORT_OFFSET),
+        "FHIR_COMPOSE_PROJECT_NAME": project,
+        # compose.hapi.yaml mounts config files relative to $PWD
+        "PWD": REPO_DIR.as_posix(),
+    }
+
+
+def get_jvm_metrics_urls(ports: dict[str, int]) -> dict[str, str]:
+    # the same as services.py's for the default ports
+    blaze_metrics_port = ports["blaze"] + BLAZE_METRICS_PORT_OFFSET
+    return {
+        "blaze": f"http://localhost:{blaze_metrics_port}/metrics",
+        "hapi": f"http://localhost:{ports['hapi']}/actuator/prometheus",
+    }
+
+
+def start_fhir_servers(project: str, ports: dict[str, int]):
+    # a no-op for containers which are already running with the same settings.
+    # The volumes belong to the project, so a restart keeps the data.
+    run(
+        get_compose_command(project) + ["up", "-d"],
+        cwd=REPO_DIR,
+        env=get_fhir_env(project, ports),
+    )
+    for name, port in ports.items():
+        wait_for_url(f"http://localhost:{port}/fhir/metadata", name)
+
+
+def vacuum_hapi_database(project: str, ports: dict[str, int]):
+    run(
+        get_compose_command(project)
+        + [
+            "exec",
+            "-T",
+            "hapi-fhir-postgres",
+            *["psql", "-U", "admin", "-d", "hapi", "-f", "/tmp/pg-vacuum.sql"],
+        ],
+        cwd=REPO_DIR,
+        env=get_fhir_env(project, ports),
+    )
+
+
+def upload_fhir_data(population_size: int, ports: dict[str, int]):
+    project = get_fhir_compose_project(population_size)
+    run(
+        [
+            sys.executable,
+            "fhir_ingest.py",
+            "--population-size",
+            str(population_size),
+        ],
+        cwd=SRC_DIR,
+        env=get_fhir_env(project, ports),
+    )
+    vacuum_hapi_database(project, ports)
+
+
+def stop_fhir_servers(project: str, ports: dict[str, int]):
+    run(
+        get_compose_command(project) + ["stop"],
+        cwd=REPO_DIR,
+        env=get_fhir_env(project, ports),
+    )
+
+
+def run_benchmarks(population_size: int, ports: dict[str, int]) -> int:
+    env = get_fhir_env(get_fhir_compose_project(population_size), ports) | {
+        "SYNTHEA_POPULATION_SIZE": str(population_size),
+        "BENCHMARK_SCHEMA": get_schema(population_size),
+    }
+    logger.info(
+        "Running the benchmarks for {population_size}", population_size=population_size
+    )
+    return subprocess.run(
+        [sys.executable, "main.py"], cwd=SRC_DIR, env=os.environ | env
+    ).returncode
+
+
+def run_stage(
+    rows: list[dict],
+    population_size: int,
+    fingerprint: str,
+    stage: str,
+    is_done,
+    action,
+):
+    if has_marker(population_size, stage, fingerprint) and is_done():
+        logger.info(
+            "Skipping {stage} for {population_size}, it's up to date",
+            stage=stage,
+            population_size=population_size,
+        )
+        rows.append(
+            {
+                "population_size": population_size,
+                "stage": stage,
+                "skipped": True,
+                "failed": False,
+                "duration_seconds": 0,
+            }
+        )
+        return
+
+    start = time.perf_counter()
+    action()
+    duration = time.perf_counter() - start
+    write_marker(population_size, stage, fingerprint, duration)
+    rows.append(
+        {
+            "population_size": population_size,
+            "stage": stage,
+            "skipped": False,
+            "failed": False,
+            "duration_seconds": duration,
+        }
+    )
+
+
+def prepare(rows: list[dict], population_size: int, ports: dict[str, int]) -> str:
+    fingerprint = get_fingerprint(population_size)
+
+    warehouse_done = has_marker(
+        population_size, "warehouse", fingerprint
+    ) and has_warehouse_tables(population_size)
+
+    start_fhir_servers(get_fhir_compose_project(population_size), ports)
+    fhir_servers_done = has_marker(
+        population_size, "fhir-servers", fingerprint
+    ) and has_fhir_server_data(ports)
+
+    # the generated files are only needed to load the warehouse or the servers,
+    # so a removed synthea/ directory isn't regenerated for nothing
+    if not (warehouse_done and fhir_servers_done):
+        run_stage(
+            rows,
+            population_size,
+            fingerprint,
+            "generate",
+            lambda: has_generated_data(population_size),
+            lambda: generate(population_size),
+        )
+
+    run_stage(
+        rows,
+        population_size,
+        fingerprint,
+        "warehouse",
+        lambda: warehouse_done,
+        lambda: load_warehouse(population_size),
+    )
+    run_stage(
+        rows,
+        population_size,
+        fingerprint,
+        "fhir-servers",
+        lambda: fhir_servers_done,
+        lambda: upload_fhir_data(population_size, ports),
+    )
+    return fingerprint
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Generate and load every population size into its own warehouse "
+        + "schema and its own Blaze and HAPI instances, then run main.py against each "
+        + "size in turn. Sizes whose data is already loaded are not regenerated."
+    )
+    parser.add_argument(
+        "--population-sizes",
+        type=lambda value: [int(size) for size in value.split(",")],
+        default=DEFAULT_POPULATION_SIZES,
+    )
+    parser.add_argument(
+        "--fhir-port-base",
+        type=int,
+        default=DEFAULT_FHIR_PORT_BASE,
+        help="The first port assigned to new sizes. A size keeps its ports once "
+        + "assigned, they're stored in .population-ladder/<size>/ports.json.",
+    )
+    parser.add_argument(
+        "--prepare-only",
+        action="store_true",
+        help="Only generate and load the data, don't run the benchmarks",
+    )
+    parser.add_argument(
+        "--stop-fhir-servers",
+        action="store_true",
+        help="Stop each size's Blaze and HAPI after its benchmarks. Their volumes are "
+        + "kept. All sizes at once need several hundred GiB of heap.",
+    )
+    args = parser.parse_args()
+
+    rows = []
+    for population_size in args.population_sizes:
+        ports = get_ports(population_size, args.fhir_port_base)
+        logger.info(
+            "Preparing {population_size} as {schema} and {project} on {ports}",
+            population_size=population_size,
+            schema=get_schema(population_size),
+            project=get_fhir_compose_project(population_size),
+            ports=ports,
+        )
+
+        try:
+            prepare(rows, population_size, ports)
+        except (subprocess.CalledProcessError, TimeoutError) as exc:
+            logger.error(
+                "Failed to prepare {population_size}: {error}",
+                population_size=population_size,
+                error=exc,
+            )
+            rows.append(
+                {"population_size": population_size, "stage": "prepare", "failed": True}
+            )
+            continue
+
+        if not args.prepare_only:
+            start = time.perf_counter()
+            returncode = run_benchmarks(population_size, ports)
+            if returncode != 0:
+                logger.error(
+                    "The benchmarks for {population_size} exited with {returncode}",
+                    population_size=population_size,
+                    returncode=returncode,
+                )
+            rows.append(
+                {
+                    "population_size": population_size,
+                    "stage": "benchmark",
+                    "skipped": False,
+                    "failed": returncode != 0,
+                    "duration_seconds": time.perf_counter() - start,
+                }
+            )
+
+        if args.stop_fhir_servers:
+            stop_fhir_servers(get_fhir_compose_project(population_size), ports)
+
+    output_dir = Path.cwd() / "results" / "population-ladder"
+    output_dir.mkdir(parents=True, exist_ok=True)
+    report = pd.DataFrame(rows)
+    report["schema"] = report["population_size"].map(get_schema)
+    report.to_csv(
+        output_dir / f"{time.strftime('%Y%m%d-%H%M%S')}-population-ladder.csv",
+        index=False,
+    )
+
+    logger.info(report)
+    return 1 if report["failed"].any() else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
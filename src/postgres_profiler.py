@@ -0,0 +1,174 @@
+import io
+import re
+
+import docker
+import pandas as pd
+from loguru import logger
+
+from benchmark import BenchmarkRunResult
+
+# statements kept per benchmark query, by their execution time
+TOP_STATEMENTS = 20
+
+# HAPI's tables, e.g. the search parameter index hfj_spidx_token
+HFJ_TABLE_PATTERN = re.compile(r"\bhfj_\w+", re.IGNORECASE)
+
+STATEMENT_COUNTERS = [
+    "calls",
+    "total_exec_time_ms",
+    "rows",
+    "shared_blks_hit",
+    "shared_blks_read",
+    "shared_blk_read_time_ms",
+    "temp_blks_written",
+]
+
+# the statements of HAPI's database, summed up over users and nesting levels.
+# The profiler's own statements are left out.
+SNAPSHOT_QUERY = """
+SELECT
+    queryid,
+    sum(calls) AS calls,
+    sum(total_exec_time) AS total_exec_time_ms,
+    sum(rows) AS rows,
+    sum(shared_blks_hit) AS shared_blks_hit,
+    sum(shared_blks_read) AS shared_blks_read,
+    sum(shared_blk_read_time) AS shared_blk_read_time_ms,
+    sum(temp_blks_written) AS temp_blks_written,
+    min(query) AS statement
+FROM pg_stat_statements
+WHERE dbid = (SELECT oid FROM pg_database WHERE datname = current_database())
+    AND query NOT LIKE '%pg_stat_statements%'
+GROUP BY queryid
+"""
+
+
+def get_hfj_tables(statement: str) -> str:
+    return ",".join(sorted({t.lower() for t in HFJ_TABLE_PATTERN.findall(statement)}))
+
+
+def diff_snapshots(before: pd.DataFrame, after: pd.DataFrame) -> pd.DataFrame:
+    merged = after.merge(
+        before[["queryid"] + STATEMENT_COUNTERS],
+        on="queryid",
+        how="left",
+        suffixes=("", "_before"),
+    )
+    before_counters = (
+        merged[[f"{c}_before" for c in STATEMENT_COUNTERS]].fillna(0).to_numpy()
+    )
+    delta = merged[STATEMENT_COUNTERS].to_numpy() - before_counters
+    # an entry which was evicted and re-added in between starts over
+    restarted = delta[:, 0] < 0
+    delta[restarted] = merged.loc[restarted, STATEMENT_COUNTERS].to_numpy()
+
+    statements = merged[["queryid", "statement"]].copy()
+    statements[STATEMENT_COUNTERS] = delta
+    return statements[statements["calls"] > 0]
+
+
+class PostgresStatementProfiler:
+    """
+    Snapshots pg_stat_statements of HAPI's Postgres before and after each query
+    and keeps the statements that ran in between, with the HAPI tables they read.
+    """
+
+    def __init__(
+        self,
+        container_name: str,
+        database: str = "hapi",
+        user: str = "admin",
+        top_statements: int = TOP_STATEMENTS,
+    ):
+        self.container_name = container_name
+        self.database = database
+        self.user = user
+        self.top_statements = top_statements
+        self.container = None
+        self.enabled = True
+        self.before: pd.DataFrame | None = None
+
+    def _psql(self, sql: str) -> str:
+        if self.container is None:
+            self.container = docker.from_env().containers.get(self.container_name)
+        exit_code, (stdout, stderr) = self.container.exec_run(
+            [
+                *["psql", "-X", "-q", "-v", "ON_ERROR_STOP=1"],
+                *["-U", self.user, "-d", self.database, "-c", sql],
+            ],
+            demux=True,
+        )
+        if exit_code != 0:
+            raise RuntimeError((stderr or b"").decode("utf-8", errors="replace"))
+        return (stdout or b"").decode("utf-8")
+
+    def _snapshot(self) -> pd.DataFrame | None:
+        if not self.enabled:
+            return None
+        try:
+            if self.container is None:
+                # needs pg_stat_statements in shared_preload_libraries
+                self._psql("CREATE EXTENSION IF NOT EXISTS pg_stat_statements")
+            csv = self._psql(f"COPY ({SNAPSHOT_QUERY}) TO STDOUT WITH CSV HEADER")
+            return pd.read_csv(io.StringIO(csv))
+        except Exception as exc:
+            # profiling is nice to have, never fail the benchmark because of it.
+            # It's turned off for the rest of the run to not repeat the warning.
+            logger.warning(
+                "Failed to read pg_stat_statements of {container}, "
+                + "not profiling HAPI's SQL: {error}",
+                container=self.container_name,
+                error=exc,
+            )
+            self.enabled = False
+            return None
+
+    def before_query(self):
+        self.before = self._snapshot()
+
+    def after_query(self, result: BenchmarkRunResult) -> tuple[list[dict], list[dict]]:
+        """
+        Returns the top statements of the query and the totals per HAPI table.
+        """
+        before, self.before = self.before, None
+        after = self._snapshot() if before is not None else None
+        if after is None:
+            return [], []
+
+        statements = diff_snapshots(before, after)
+        statements["mean_exec_time_ms"] = (
+            statements["total_exec_time_ms"] / statements["calls"]
+        )
+        statements["hfj_tables"] = statements["statement"].map(get_hfj_tables)
+
+        query_keys = {
+            "run_id": result.run_id,
+            "engine": result.engine,
+            "query": result.query,
+            "query_type": str(result.query_type),
+            "cold_or_warm": result.cold_or_warm,
+            "is_warmup": result.is_warmup,
+        }
+
+        top = statements.sort_values("total_exec_time_ms", ascending=False).head(
+            self.top_statements
+        )
+        statement_rows = [
+            query_keys | {"rank": rank} | row
+            for rank, row in enumerate(top.to_dict("records"), start=1)
+        ]
+
+        # a statement joining several tables counts for each of them
+        tables = (
+            statements.assign(hfj_table=statements["hfj_tables"].str.split(","))
+            .explode("hfj_table")
+            .query("hfj_table != ''")
+            .groupby("hfj_table")
+            .agg(
+                statements=("queryid", "count"),
+                **{counter: (counter, "sum") for counter in STATEMENT_COUNTERS},
+            )
+            .reset_index()
+        )
+        table_rows = [query_keys | row for row in tables.to_dict("records")]
+        return statement_rows, table_rows
@@ -1,4 +1,5 @@
 import datetime
+import json
 import os
 import time
 from fhir_pyrate import Ahoy, Pirate
@@ -7,12 +8,25 @@ from loguru import logger
 from pandas import DataFrame
 
 from benchmark import Benchmark, BenchmarkRunResult, QueryType, QUERY_TYPES_TO_RUN
+from jvm_telemetry import PROMETHEUS_JVM_METRICS, JvmTelemetry, read_prometheus
+from postgres_profiler import PostgresStatementProfiler
+from query_parameters import (
+    get_condition_codes,
+    get_query_parameters,
+    to_search_token_list,
+)
 
 PAGE_SIZE: int = 1_000
 
 
 class PyrateBenchmark(Benchmark):
-    def __init__(self, fhir_server_base_url: str, fhir_server_name: str):
+    def __init__(
+        self,
+        fhir_server_base_url: str,
+        fhir_server_name: str,
+        jvm_metrics_url: str | None = None,
+        postgres_container: str | None = None,
+    ):
         os.environ["FHIR_USER"] = "any"
         os.environ["FHIR_PASSWORD"] = "any"
 
@@ -26,6 +40,22 @@ class PyrateBenchmark(Benchmark):
 
         self.fhir_server_name = fhir_server_name
 
+        # the server's JVM metrics in the Prometheus format, if it exposes them
+        self.jvm_telemetry = None
+        if jvm_metrics_url and fhir_server_name in PROMETHEUS_JVM_METRICS:
+            self.jvm_telemetry = JvmTelemetry(
+                fhir_server_name,
+                lambda: read_prometheus(
+                    jvm_metrics_url, PROMETHEUS_JVM_METRICS[fhir_server_name]
+                ),
+            )
+
+        # the SQL run by HAPI for each query, from its Postgres' pg_stat_statements
+        self.postgres_profiler = None
+        if postgres_container:
+            self.postgres_profiler = PostgresStatementProfiler(postgres_container)
+        self.sidecar_tables: dict[str, list[dict]] = {}
+
         logger.info("Completed initialization.")
 
     def run_all_queries(
@@ -34,17 +64,155 @@ class PyrateBenchmark(Benchmark):
         is_warmup: bool = False,
         cold_or_warm: str = "cold",
         only_hemoglobin_simple: bool = False,
+        query_types: list[QueryType] | None = None,
+        query_names: list[str] | None = None,
+        query_parameters: dict | None = None,
     ) -> list[BenchmarkRunResult]:
         output_folder_base = Path.cwd() / "results" / f"pyrate-{self.fhir_server_name}"
+        parameters = get_query_parameters(query_parameters)
 
         results = []
-        queries = {
+        self.sidecar_tables = (
+            {"hapi-sql-statements": [], "hapi-sql-tables": []}
+            if self.postgres_profiler is not None
+            else {}
+        )
+        queries = self._get_queries(parameters)
+
+        start_timestamp = datetime.datetime.now(datetime.UTC)
+
+        # remove the default hemoglobin queries if only the simple ones are supposed to run
+        if only_hemoglobin_simple:
+            queries[QueryType.COUNT] = [
+                q for q in queries[QueryType.COUNT] if q["query_name"] != "hemoglobin"
+            ]
+            queries[QueryType.EXTRACT] = [
+                q for q in queries[QueryType.EXTRACT] if q["query_name"] != "hemoglobin"
+            ]
+
+        for query_type in query_types or QUERY_TYPES_TO_RUN:
+            output_folder = output_folder_base / str(query_type)
+            output_folder.mkdir(parents=True, exist_ok=True)
+
+            queries_of_type = queries[query_type]
+            start = run_id % len(queries_of_type)
+            round_robin_queries = queries_of_type[start:] + queries_of_type[:start]
+            if query_names is not None:
+                round_robin_queries = [
+                    q for q in round_robin_queries if q["query_name"] in query_names
+                ]
+
+            for query in round_robin_queries:
+                query_name = query["query_name"]
+                logger.info(
+                    "Running {query_type} query {query_name}",
+                    query_type=query_type,
+                    query_name=query_name,
+                )
+                if self.fhir_server_name == "hapi" and query_name == "hemoglobin":
+                    logger.warning(
+                        "Skipping query {query_name} against HAPI FHIR due to known performance issues.",
+                        query_name=query_name,
+                    )
+                    continue
+
+                # after the skip, so skipped queries don't pay for the snapshots
+                if self.jvm_telemetry is not None:
+                    self.jvm_telemetry.before_query()
+                if self.postgres_profiler is not None:
+                    self.postgres_profiler.before_query()
+                query_start_timestamp = datetime.datetime.now(datetime.UTC)
+                timings_start = time.perf_counter()
+
+                df: DataFrame | dict[str, DataFrame]
+
+                if (
+                    query_type == QueryType.COUNT
+                    or query_type == QueryType.COUNT_SKEWED
+                    or query_type == QueryType.JOIN_COUNT_SKEWED
+                ):
+                    # special handling for the count cases
+                    count = self.search.get_bundle_total(
+                        resource_type=query["resource_type"],
+                        request_params=query["request_params"],
+                    )
+                    df = DataFrame(data={"count": [count]})
+                else:
+                    df = self.search.steal_bundles_to_dataframe(
+                        resource_type=query["resource_type"],
+                        request_params=query["request_params"],
+                        fhir_paths=query["fhir_paths"],
+                    )
+
+                fetch_done_timestamp = time.perf_counter()
+                fetch_duration = fetch_done_timestamp - timings_start
+
+                post_process_duration = 0
+                if query["post_process"] is not None:
+                    post_process_start = time.perf_counter()
+                    df = query["post_process"](df)
+                    post_process_duration = time.perf_counter() - post_process_start
+
+                write_to_file_start = time.perf_counter()
+                if isinstance(df, DataFrame):
+                    df.to_csv(output_folder / f"{query_name}.csv", index=False)
+                else:
+                    for resource_type in df.keys():
+                        df[resource_type].to_csv(
+                            output_folder / f"{query_name}-{resource_type}.csv",
+                            index=False,
+                        )
+
+                write_to_file_duration = time.perf_counter() - write_to_file_start
+                duration_total = time.perf_counter() - timings_start
+
+                result = BenchmarkRunResult(
+                    run_id=run_id,
+                    start_timestamp=start_timestamp,
+                    engine=f"pyrate-{self.fhir_server_name}",
+                    query=query_name,
+                    query_type=query_type,
+                    total_duration_seconds=duration_total,
+                    write_to_file_duration_seconds=write_to_file_duration,
+                    fetch_duration_seconds=fetch_duration,
+                    post_process_duration_seconds=post_process_duration,
+                    is_warmup=is_warmup,
+                    cold_or_warm=cold_or_warm,
+                    query_start_timestamp=query_start_timestamp,
+                    query_end_timestamp=query_start_timestamp
+                    + datetime.timedelta(seconds=duration_total),
+                    result_row_count=len(df)
+                    if isinstance(df, DataFrame)
+                    else sum(len(resource_df) for resource_df in df.values()),
+                )
+                if self.jvm_telemetry is not None:
+                    self.jvm_telemetry.after_query(result)
+                if self.postgres_profiler is not None:
+                    statement_rows, table_rows = self.postgres_profiler.after_query(
+                        result
+                    )
+                    self.sidecar_tables["hapi-sql-statements"].extend(statement_rows)
+                    self.sidecar_tables["hapi-sql-tables"].extend(table_rows)
+                results.append(result)
+
+        return results
+
+    def _get_queries(self, parameters: dict) -> dict[QueryType, list[dict]]:
+        condition_codes = get_condition_codes(parameters)
+        hemoglobin_code_value_quantity = (
+            f"http://loinc.org|4548-4$gt{parameters['hemoglobin_min_percent']}|http://unitsofmeasure.org|%,"
+            + f"http://loinc.org|718-7$gt{parameters['hemoglobin_min_g_dl']}|http://unitsofmeasure.org|g/dL,"
+            + f"http://loinc.org|17856-6$gt{parameters['hemoglobin_min_percent']}|http://unitsofmeasure.org|%,"
+            + f"http://loinc.org|4549-2$gt{parameters['hemoglobin_min_percent']}|http://unitsofmeasure.org|%"
+        )
+
+        return {
             QueryType.EXTRACT: [
                 {
                     "query_name": "gender-age",
                     "resource_type": "Patient",
                     "request_params": {
-                        "birthdate": "ge1970-01-01",
+                        "birthdate": f"ge{parameters['birthdate_min']}",
                         "gender": "female",
                         "_count": PAGE_SIZE,
                         "_sort": "_id",
@@ -60,9 +228,11 @@ class PyrateBenchmark(Benchmark):
                     "query_name": "diabetes",
                     "resource_type": "Condition",
                     "request_params": {
-                        "encounter.date": "ge2020-01-01",
-                        "code": "http://snomed.info/sct|73211009,http://snomed.info/sct|427089005,http://snomed.info/sct|44054006",
-                        "subject:Patient.birthdate": "ge1970-01-01",
+                        "encounter.date": f"ge{parameters['encounter_start_min']}",
+                        "code": to_search_token_list(
+                            "http://snomed.info/sct", condition_codes
+                        ),
+                        "subject:Patient.birthdate": f"ge{parameters['birthdate_min']}",
                         "_include": "Condition:encounter",
                         "_include": "Condition:patient",
                         "_count": PAGE_SIZE,
@@ -72,7 +242,9 @@ class PyrateBenchmark(Benchmark):
                         ("condition_id", "Condition.id"),
                         (
                             "condition_snomed_code",
-                            "Condition.code.coding.where(system = 'http://snomed.info/sct' and (code = '73211009' or code = '427089005' or code = '44054006')).code",
+                            "Condition.code.coding.where(system = 'http://snomed.info/sct' and ("
+                            + " or ".join(f"code = '{code}'" for code in condition_codes)
+                            + ")).code",
                         ),
                         ("condition_onset", "Condition.onsetDateTime"),
                         ("condition_patient_reference", "Condition.subject.reference"),
@@ -90,7 +262,7 @@ class PyrateBenchmark(Benchmark):
                     "query_name": "hemoglobin",
                     "resource_type": "Observation",
                     "request_params": {
-                        "code-value-quantity": "http://loinc.org|4548-4$gt5|http://unitsofmeasure.org|%,http://loinc.org|718-7$gt25|http://unitsofmeasure.org|g/dL,http://loinc.org|17856-6$gt5|http://unitsofmeasure.org|%,http://loinc.org|4549-2$gt5|http://unitsofmeasure.org|%",
+                        "code-value-quantity": hemoglobin_code_value_quantity,
                         "_include": "Observation:patient",
                         "_count": PAGE_SIZE,
                         "_sort": "_id",
@@ -123,7 +295,7 @@ class PyrateBenchmark(Benchmark):
                     "query_name": "hemoglobin-simple",
                     "resource_type": "Observation",
                     "request_params": {
-                        "code-value-quantity": "http://loinc.org|4548-4$gt5|http://unitsofmeasure.org|%",
+                        "code-value-quantity": f"http://loinc.org|4548-4$gt{parameters['hemoglobin_min_percent']}|http://unitsofmeasure.org|%",
                         "_include": "Observation:patient",
                         "_count": PAGE_SIZE,
                         "_sort": "_id",
@@ -185,7 +357,7 @@ class PyrateBenchmark(Benchmark):
                     "query_name": "gender-age",
                     "resource_type": "Patient",
                     "request_params": {
-                        "birthdate": "ge1970-01-01",
+                        "birthdate": f"ge{parameters['birthdate_min']}",
                         "gender": "female",
                         "_summary": "count",
                     },
@@ -196,9 +368,11 @@ class PyrateBenchmark(Benchmark):
                     "query_name": "diabetes",
                     "resource_type": "Condition",
                     "request_params": {
-                        "encounter.date": "ge2020-01-01",
-                        "code": "http://snomed.info/sct|73211009,http://snomed.info/sct|427089005,http://snomed.info/sct|44054006",
-                        "subject:Patient.birthdate": "ge1970-01-01",
+                        "encounter.date": f"ge{parameters['encounter_start_min']}",
+                        "code": to_search_token_list(
+                            "http://snomed.info/sct", condition_codes
+                        ),
+                        "subject:Patient.birthdate": f"ge{parameters['birthdate_min']}",
                         "_summary": "count",
                     },
                     "fhir_paths": [],
@@ -208,7 +382,7 @@ class PyrateBenchmark(Benchmark):
                     "query_name": "hemoglobin",
                     "resource_type": "Patient",
                     "request_params": {
-                        "_has:Observation:patient:code-value-quantity": "http://loinc.org|4548-4$gt5|http://unitsofmeasure.org|%,http://loinc.org|718-7$gt25|http://unitsofmeasure.org|g/dL,http://loinc.org|17856-6$gt5|http://unitsofmeasure.org|%,http://loinc.org|4549-2$gt5|http://unitsofmeasure.org|%",
+                        "_has:Observation:patient:code-value-quantity": hemoglobin_code_value_quantity,
                         "_summary": "count",
                     },
                     "fhir_paths": [],
@@ -218,7 +392,7 @@ class PyrateBenchmark(Benchmark):
                     "query_name": "hemoglobin-simple",
                     "resource_type": "Patient",
                     "request_params": {
-                        "_has:Observation:patient:code-value-quantity": "http://loinc.org|4548-4$gt5|http://unitsofmeasure.org|%",
+                        "_has:Observation:patient:code-value-quantity": f"http://loinc.org|4548-4$gt{parameters['hemoglobin_min_percent']}|http://unitsofmeasure.org|%",
                         "_summary": "count",
                     },
                     "fhir_paths": [],
@@ -262,7 +436,7 @@ class PyrateBenchmark(Benchmark):
                     "query_name": "join-hot-codes",
                     "resource_type": "Patient",
                     "request_params": {
-                        "code": "_has:Observation:patient:code=http://loinc.org|85354-9,http://loinc.org|72514-3,http://loinc.org|29463-7,http://loinc.org|8867-4,http://loinc.org|9279-1",
+                        "_has:Observation:patient:code": "http://loinc.org|85354-9,http://loinc.org|72514-3,http://loinc.org|29463-7,http://loinc.org|8867-4,http://loinc.org|9279-1",
                         "_summary": "count",
                     },
                     "fhir_paths": [],
@@ -272,7 +446,7 @@ class PyrateBenchmark(Benchmark):
                     "query_name": "join-rare-codes",
                     "resource_type": "Patient",
                     "request_params": {
-                        "code": "_has:Observation:patient:code=http://loinc.org|7917-8,http://loinc.org|18752-6,http://loinc.org|26881-3,http://loinc.org|21924-6,http://loinc.org|62337-1",
+                        "_has:Observation:patient:code": "http://loinc.org|7917-8,http://loinc.org|18752-6,http://loinc.org|26881-3,http://loinc.org|21924-6,http://loinc.org|62337-1",
                         "_summary": "count",
                     },
                     "fhir_paths": [],
@@ -282,7 +456,7 @@ class PyrateBenchmark(Benchmark):
                     "query_name": "join-mixed-codes",
                     "resource_type": "Patient",
                     "request_params": {
-                        "code": "_has:Observation:patient:code=http://loinc.org|7917-8,http://loinc.org|18752-6,http://loinc.org|26881-3,http://loinc.org|21924-6,http://loinc.org|62337-1,http://loinc.org|85354-9,http://loinc.org|72514-3,http://loinc.org|29463-7,http://loinc.org|8867-4,http://loinc.org|9279-1",
+                        "_has:Observation:patient:code": "http://loinc.org|7917-8,http://loinc.org|18752-6,http://loinc.org|26881-3,http://loinc.org|21924-6,http://loinc.org|62337-1,http://loinc.org|85354-9,http://loinc.org|72514-3,http://loinc.org|29463-7,http://loinc.org|8867-4,http://loinc.org|9279-1",
                         "_summary": "count",
                     },
                     "fhir_paths": [],
@@ -291,99 +465,18 @@ class PyrateBenchmark(Benchmark):
             ],
         }
 
-        start_timestamp = datetime.datetime.now(datetime.UTC)
-
-        # remove the default hemoglobin queries if only the simple ones are supposed to run
-        if only_hemoglobin_simple:
-            queries[QueryType.COUNT] = [
-                q for q in queries[QueryType.COUNT] if q["query_name"] != "hemoglobin"
-            ]
-            queries[QueryType.EXTRACT] = [
-                q for q in queries[QueryType.EXTRACT] if q["query_name"] != "hemoglobin"
-            ]
-
-        for query_type in QUERY_TYPES_TO_RUN:
-            output_folder = output_folder_base / str(query_type)
-            output_folder.mkdir(parents=True, exist_ok=True)
-
-            queries_of_type = queries[query_type]
-            start = run_id % len(queries_of_type)
-            round_robin_queries = queries_of_type[start:] + queries_of_type[:start]
-
-            for query in round_robin_queries:
-                query_name = query["query_name"]
-                logger.info(
-                    "Running {query_type} query {query_name}",
-                    query_type=query_type,
-                    query_name=query_name,
-                )
-                timings_start = time.perf_counter()
-
-                df: DataFrame | dict[str, DataFrame]
-
-                if self.fhir_server_name == "hapi" and query_name == "hemoglobin":
-                    logger.warning(
-                        "Skipping query {query_name} against HAPI FHIR due to known performance issues.",
-                        query_name=query_name,
-                    )
-                    continue
-
-                if (
-                    query_type == QueryType.COUNT
-                    or query_type == QueryType.COUNT_SKEWED
-                    or query_type == QueryType.JOIN_COUNT_SKEWED
-                ):
-                    # special handling for the count cases
-                    count = self.search.get_bundle_total(
-                        resource_type=query["resource_type"],
-                        request_params=query["request_params"],
-                    )
-                    df = DataFrame(data={"count": [count]})
-                else:
-                    df = self.search.steal_bundles_to_dataframe(
-                        resource_type=query["resource_type"],
-                        request_params=query["request_params"],
-                        fhir_paths=query["fhir_paths"],
-                    )
-
-                fetch_done_timestamp = time.perf_counter()
-                fetch_duration = fetch_done_timestamp - timings_start
-
-                post_process_duration = 0
-                if query["post_process"] is not None:
-                    post_process_start = time.perf_counter()
-                    df = query["post_process"](df)
-                    post_process_duration = time.perf_counter() - post_process_start
-
-                write_to_file_start = time.perf_counter()
-                if isinstance(df, DataFrame):
-                    df.to_csv(output_folder / f"{query_name}.csv", index=False)
-                else:
-                    for resource_type in df.keys():
-                        df[resource_type].to_csv(
-                            output_folder / f"{query_name}-{resource_type}.csv",
-                            index=False,
-                        )
-
-                write_to_file_duration = time.perf_counter() - write_to_file_start
-                duration_total = time.perf_counter() - timings_start
-
-                result = BenchmarkRunResult(
-                    run_id=run_id,
-                    start_timestamp=start_timestamp,
-                    engine=f"pyrate-{self.fhir_server_name}",
-                    query=query_name,
-                    query_type=query_type,
-                    total_duration_seconds=duration_total,
-                    write_to_file_duration_seconds=write_to_file_duration,
-                    fetch_duration_seconds=fetch_duration,
-                    post_process_duration_seconds=post_process_duration,
-                    is_warmup=is_warmup,
-                    cold_or_warm=cold_or_warm,
-                )
-                results.append(result)
+    def get_query_definition(self, query_type: QueryType, query_name: str) -> str:
+        # the search parameters and FHIRPaths with the default parameters,
+        # overrides are passed as run options
+        queries = self._get_queries(get_query_parameters(None))
+        query = [q for q in queries[query_type] if q["query_name"] == query_name][0]
+        return json.dumps(
+            {key: value for key, value in query.items() if key != "post_process"},
+            sort_keys=True,
+        )
 
-        return results
+    def collect_sidecar_tables(self) -> dict[str, list[dict]]:
+        return self.sidecar_tables
 
     def _post_process_observations_by_code(self, df: DataFrame):
         if not isinstance(df, DataFrame):
@@ -0,0 +1,11 @@
+SELECT
+    coding_display AS display,
+    coding_code AS code,
+    coding_system AS code_system,
+    COUNT(*) AS num_observations
+FROM fhir.flat.observation_coding
+GROUP BY
+    coding_code,
+    coding_system,
+    coding_display
+ORDER BY COUNT(*) DESC
@@ -0,0 +1,5 @@
+SELECT COUNT(*)
+FROM fhir.flat.observation_coding
+WHERE
+    coding_system = 'http://loinc.org'
+    AND coding_code IN ('85354-9', '72514-3', '29463-7', '8867-4', '9279-1')
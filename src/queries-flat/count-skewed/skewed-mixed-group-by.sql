@@ -0,0 +1,10 @@
+SELECT
+    coding_code AS code,
+    COUNT(*) AS code_count
+FROM fhir.flat.observation_coding
+WHERE
+    coding_system = 'http://loinc.org' AND coding_code IN (
+        -- Hot codes, rare codes
+        '85354-9', '72514-3', '29463-7', '8867-4', '9279-1', '7917-8', '18752-6', '26881-3', '21924-6', '62337-1'
+    )
+GROUP BY coding_code
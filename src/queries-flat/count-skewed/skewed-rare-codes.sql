@@ -0,0 +1,7 @@
+SELECT COUNT(*)
+FROM fhir.flat.observation_coding
+WHERE
+    coding_system = 'http://loinc.org'
+    AND coding_code IN (
+        '7917-8', '18752-6', '26881-3', '21924-6', '62337-1'
+    )
@@ -0,0 +1,9 @@
+SELECT COUNT(DISTINCT condition.condition_id)
+FROM fhir.flat.condition_coding AS condition
+INNER JOIN fhir.flat.encounter AS encounter ON condition.encounter_id = encounter.encounter_id
+INNER JOIN fhir.flat.patient AS patient ON encounter.patient_id = patient.patient_id
+WHERE
+    encounter.period_start_date >= DATE(:encounter_start_min)
+    AND condition.coding_system = 'http://snomed.info/sct'
+    AND condition.coding_code IN (:condition_snomed_codes)
+    AND patient.birth_date >= DATE(:birthdate_min)
@@ -0,0 +1,3 @@
+SELECT COUNT(DISTINCT patient_id)
+FROM fhir.flat.patient
+WHERE gender = 'female' AND birth_date >= DATE(:birthdate_min)
@@ -0,0 +1,18 @@
+SELECT COUNT(DISTINCT patient.patient_id)
+FROM fhir.flat.observation_coding AS observation
+LEFT JOIN fhir.flat.patient AS patient ON observation.patient_id = patient.patient_id
+WHERE
+    observation.coding_system = 'http://loinc.org'
+    AND observation.value_quantity_system = 'http://unitsofmeasure.org'
+    AND (
+        (
+            observation.coding_code = '718-7'
+            AND observation.value_quantity_code = 'g/dL'
+            AND observation.value_quantity_value > :hemoglobin_min_g_dl
+        )
+        OR (
+            observation.coding_code IN ('17856-6', '4548-4', '4549-2')
+            AND observation.value_quantity_code = '%'
+            AND observation.value_quantity_value > :hemoglobin_min_percent
+        )
+    )
@@ -0,0 +1,19 @@
+SELECT
+    condition.condition_id,
+    condition.coding_code AS condition_snomed_code,
+    condition.onset_datetime AS condition_onset,
+    encounter.encounter_id,
+    encounter.period_start AS encounter_period_start,
+    encounter.period_end AS encounter_period_end,
+    encounter.status AS encounter_status,
+    patient.patient_id,
+    patient.birthdate AS patient_birthdate
+FROM fhir.flat.condition_coding AS condition
+INNER JOIN fhir.flat.encounter AS encounter ON condition.encounter_id = encounter.encounter_id
+INNER JOIN fhir.flat.patient AS patient ON encounter.patient_id = patient.patient_id
+WHERE
+    encounter.period_start_date >= DATE(:encounter_start_min)
+    AND condition.coding_system = 'http://snomed.info/sct'
+    AND condition.coding_code IN (:condition_snomed_codes)
+    AND patient.birth_date >= DATE(:birthdate_min)
+ORDER BY patient.patient_id ASC
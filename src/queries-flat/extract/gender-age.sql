@@ -0,0 +1,7 @@
+SELECT
+    patient_id,
+    birthdate AS patient_birthdate,
+    gender AS patient_gender
+FROM fhir.flat.patient
+WHERE gender = 'female' AND birth_date >= DATE(:birthdate_min)
+ORDER BY patient_id ASC
@@ -0,0 +1,25 @@
+SELECT
+    patient.patient_id,
+    patient.birthdate AS patient_birthdate,
+    observation.observation_id,
+    observation.coding_code AS loinc_code,
+    observation.value_quantity_code AS value_quantity_ucum_code,
+    observation.value_quantity_value,
+    observation.effective_datetime,
+    observation.subject_reference AS observation_patient_reference
+FROM fhir.flat.observation_coding AS observation
+LEFT JOIN fhir.flat.patient AS patient ON observation.patient_id = patient.patient_id
+WHERE
+    observation.coding_system = 'http://loinc.org'
+    AND observation.value_quantity_system = 'http://unitsofmeasure.org'
+    AND ((
+        observation.coding_code = '718-7'
+        AND observation.value_quantity_code = 'g/dL'
+        AND observation.value_quantity_value > :hemoglobin_min_g_dl
+    )
+    OR (
+        observation.coding_code IN ('17856-6', '4548-4', '4549-2')
+        AND observation.value_quantity_code = '%'
+        AND observation.value_quantity_value > :hemoglobin_min_percent
+    ))
+ORDER BY patient.patient_id ASC
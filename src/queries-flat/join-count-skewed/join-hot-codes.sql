@@ -0,0 +1,6 @@
+SELECT COUNT(DISTINCT patient.patient_id)
+FROM fhir.flat.observation_coding AS observation
+INNER JOIN fhir.flat.patient AS patient ON observation.patient_id = patient.patient_id
+WHERE
+    observation.coding_system = 'http://loinc.org'
+    AND observation.coding_code IN ('85354-9', '72514-3', '29463-7', '8867-4', '9279-1')
@@ -0,0 +1,11 @@
+SELECT COUNT(DISTINCT patient.patient_id)
+FROM fhir.flat.observation_coding AS observation
+INNER JOIN fhir.flat.patient AS patient ON observation.patient_id = patient.patient_id
+WHERE
+    observation.coding_system = 'http://loinc.org'
+    AND observation.coding_code IN (
+        -- Hot codes
+        '85354-9', '72514-3', '29463-7', '8867-4', '9279-1',
+        -- Rare codes
+        '7917-8', '18752-6', '26881-3', '21924-6', '62337-1'
+    )
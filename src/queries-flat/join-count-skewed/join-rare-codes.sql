@@ -0,0 +1,8 @@
+SELECT COUNT(DISTINCT patient.patient_id)
+FROM fhir.flat.observation_coding AS observation
+INNER JOIN fhir.flat.patient AS patient ON observation.patient_id = patient.patient_id
+WHERE
+    observation.coding_system = 'http://loinc.org'
+    AND observation.coding_code IN (
+        '7917-8', '18752-6', '26881-3', '21924-6', '62337-1'
+    )
@@ -1,3 +1,3 @@
 SELECT COUNT(DISTINCT patient.id)
 FROM fhir.default.patient
-WHERE patient.gender = 'female' AND DATE(patient.birthdate) >= DATE('1970-01-01')
+WHERE patient.gender = 'female' AND DATE(patient.birthdate) >= DATE(:birthdate_min)
@@ -3,5 +3,5 @@ SELECT
     birthdate AS patient_birthdate,
     gender AS patient_gender
 FROM fhir.default.patient
-WHERE gender = 'female' AND date(birthdate) >= date('1970-01-01')
+WHERE gender = 'female' AND date(birthdate) >= date(:birthdate_min)
 ORDER BY patient.id ASC
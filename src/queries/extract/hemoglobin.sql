@@ -16,11 +16,11 @@ WHERE
     AND ((
         observation_code_coding.code = '718-7'
         AND valuequantity.code = 'g/dL'
-        AND valuequantity.value > 25.0
+        AND valuequantity.value > :hemoglobin_min_g_dl
     )
     OR (
         observation_code_coding.code IN ('17856-6', '4548-4', '4549-2')
         AND valuequantity.code = '%'
-        AND valuequantity.value > 5
+        AND valuequantity.value > :hemoglobin_min_percent
     ))
 ORDER BY patient.id ASC
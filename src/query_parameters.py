@@ -0,0 +1,95 @@
+import re
+from typing import Any
+
+# SNOMED CT codes of Conditions generated by Synthea. The first three are the
+# diabetes codes of the original queries, the others widen the code set when
+# sweeping `condition_code_count`.
+CONDITION_SNOMED_CODES = [
+    "73211009",
+    "427089005",
+    "44054006",
+    "15777000",
+    "271737000",
+    "55822004",
+    "38341003",
+    "59621000",
+    "162864005",
+    "40055000",
+    "10509002",
+    "444814009",
+    "195662009",
+    "72892002",
+    "230690007",
+]
+
+# the literals the queries were originally written with
+DEFAULT_QUERY_PARAMETERS: dict[str, Any] = {
+    "birthdate_min": "1970-01-01",
+    "encounter_start_min": "2020-01-01",
+    "condition_code_count": 3,
+    "hemoglobin_min_g_dl": 25,
+    "hemoglobin_min_percent": 5,
+}
+
+# the queries (of the count and extract types) which use each parameter
+PARAMETER_QUERIES: dict[str, list[str]] = {
+    "birthdate_min": ["gender-age", "diabetes"],
+    "encounter_start_min": ["diabetes"],
+    "condition_code_count": ["diabetes"],
+    "hemoglobin_min_g_dl": ["hemoglobin"],
+    "hemoglobin_min_percent": ["hemoglobin"],
+}
+
+# `:name`, like sqlfluff's colon placeholders, but not a `::` cast
+_PLACEHOLDER = re.compile(r"(?<![:\w]):(\w+)")
+
+
+def get_query_parameters(overrides: dict[str, Any] | None = None) -> dict[str, Any]:
+    unknown = set(overrides or {}) - set(DEFAULT_QUERY_PARAMETERS)
+    if unknown:
+        raise ValueError(
+            f"Unknown query parameters {unknown}. "
+            + f"Available: {list(DEFAULT_QUERY_PARAMETERS.keys())}"
+        )
+
+    parameters = DEFAULT_QUERY_PARAMETERS | (overrides or {})
+    if not 1 <= int(parameters["condition_code_count"]) <= len(CONDITION_SNOMED_CODES):
+        raise ValueError(
+            f"condition_code_count must be between 1 and {len(CONDITION_SNOMED_CODES)}"
+        )
+    return parameters
+
+
+def get_condition_codes(parameters: dict[str, Any]) -> list[str]:
+    return CONDITION_SNOMED_CODES[: int(parameters["condition_code_count"])]
+
+
+def to_sql_literal(value: Any) -> str:
+    if isinstance(value, (list, tuple)):
+        return ", ".join(to_sql_literal(item) for item in value)
+    if isinstance(value, str):
+        return "'" + value.replace("'", "''") + "'"
+    return str(value)
+
+
+def render_sql(template: str, parameters: dict[str, Any]) -> str:
+    # placeholders are written as :name, derived values are available as well
+    values = parameters | {"condition_snomed_codes": get_condition_codes(parameters)}
+
+    def replace(match: re.Match) -> str:
+        name = match.group(1)
+        if name not in values:
+            raise KeyError(f"Unknown query parameter {name} in SQL template")
+        return to_sql_literal(values[name])
+
+    return _PLACEHOLDER.sub(replace, template)
+
+
+def to_fhirpath_code_disjunction(codes: list[str]) -> str:
+    # e.g. "code='73211009' or code='427089005'"
+    return " or ".join(f"code='{code}'" for code in codes)
+
+
+def to_search_token_list(system: str, codes: list[str]) -> str:
+    # e.g. "http://snomed.info/sct|73211009,http://snomed.info/sct|427089005"
+    return ",".join(f"{system}|{code}" for code in codes)
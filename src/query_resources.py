@@ -0,0 +1,259 @@
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from loguru import logger
+
+from collect_metrics import RATE_WINDOW_SECONDS
+from services import FHIR_COMPOSE_PROJECT_NAME, get_container_name
+
+# rates (per second) are integrated over the query window, gauges maxed
+RATE_METRICS = {
+    "cpu": "cpu_seconds",
+    "fs_read_bytes": "fs_read_bytes",
+    "fs_write_bytes": "fs_write_bytes",
+    "network_receive_bytes": "network_receive_bytes",
+    "network_transmit_bytes": "network_transmit_bytes",
+    "blkio_read_bytes": "blkio_read_bytes",
+    "blkio_write_bytes": "blkio_write_bytes",
+}
+GAUGE_METRICS = {
+    "memory_working_set_bytes": "peak_memory_working_set_bytes",
+    "memory_rss": "peak_memory_rss_bytes",
+}
+
+# the containers doing the work of each engine. Pathling runs in the benchmark's
+# own process, its CPU time comes from the spark-query-metrics sidecar table.
+ENGINE_CONTAINERS = {
+    "trino": [get_container_name("trino"), get_container_name("minio")],
+    "trino-flat": [get_container_name("trino"), get_container_name("minio")],
+    "pathling": [get_container_name("minio")],
+    "pyrate-blaze": [get_container_name("blaze", FHIR_COMPOSE_PROJECT_NAME)],
+    "pyrate-hapi": [
+        get_container_name("hapi-fhir", FHIR_COMPOSE_PROJECT_NAME),
+        get_container_name("hapi-fhir-postgres", FHIR_COMPOSE_PROJECT_NAME),
+    ],
+}
+
+QUERY_KEYS = ["run_id", "engine", "query_type", "query", "cold_or_warm", "is_warmup"]
+
+
+def get_engine_containers(engine: str) -> list[str]:
+    # results restored by result_cache.py are attributed like the engine's own
+    return ENGINE_CONTAINERS.get(engine.removesuffix("-cached"), [])
+
+
+def to_seconds(timestamps: pd.Series) -> np.ndarray:
+    return pd.to_datetime(timestamps, utc=True).astype("int64").to_numpy() / 1e9
+
+
+def integrate(times: np.ndarray, values: np.ndarray, start: float, end: float) -> float:
+    # trapezoids over the samples inside the window, linearly interpolated at its
+    # edges. Windows shorter than the sampling interval get the interpolated rate.
+    if len(times) == 0 or end <= start:
+        return 0.0
+    inside = (times > start) & (times < end)
+    grid = np.concatenate([[start], times[inside], [end]])
+    rates = np.interp(grid, times, values)
+    return float(np.sum(np.diff(grid) * (rates[1:] + rates[:-1]) / 2))
+
+
+def peak(times: np.ndarray, values: np.ndarray, start: float, end: float) -> float:
+    if len(times) == 0:
+        return 0.0
+    inside = (times >= start) & (times <= end)
+    edges = np.interp([start, end], times, values)
+    return float(max(values[inside].max(initial=0), edges.max()))
+
+
+def read_metrics(path: Path) -> pd.DataFrame:
+    # a rate sample at t is the mean over the preceding window, e.g. 10s for
+    # collect_metrics.py and the sampling interval for container_sampler.py. It's
+    # moved onto the window's middle.
+    table = pq.read_table(path)
+    metadata = table.schema.metadata or {}
+    rate_window_seconds = float(
+        metadata.get(b"rate_window_seconds", RATE_WINDOW_SECONDS)
+    )
+    metrics = table.to_pandas()
+    is_rate = metrics["metric"].isin(RATE_METRICS.keys())
+    metrics.loc[is_rate, "timestamp"] -= pd.Timedelta(seconds=rate_window_seconds / 2)
+    return metrics
+
+
+def get_series(metrics: pd.DataFrame) -> dict[tuple[str, str], tuple]:
+    series = {}
+    for (container, metric), samples in metrics.groupby(["container", "metric"]):
+        samples = samples.sort_values("timestamp")
+        series[(container, metric)] = (
+            to_seconds(samples["timestamp"]),
+            samples["value"].to_numpy(dtype=float),
+        )
+    return series
+
+
+def attribute(
+    results: pd.DataFrame, metrics: pd.DataFrame
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    series = get_series(metrics)
+    by_container = []
+    for row in results.itertuples(index=False):
+        start = to_seconds(pd.Series([row.query_start_timestamp]))[0]
+        end = to_seconds(pd.Series([row.query_end_timestamp]))[0]
+        for container in get_engine_containers(row.engine):
+            values = {"container": container}
+            for metric, column in RATE_METRICS.items():
+                if (container, metric) in series:
+                    values[column] = integrate(*series[(container, metric)], start, end)
+            for metric, column in GAUGE_METRICS.items():
+                if (container, metric) in series:
+                    values[column] = peak(*series[(container, metric)], start, end)
+            by_container.append({key: getattr(row, key) for key in QUERY_KEYS} | values)
+
+    by_container = pd.DataFrame(by_container)
+    if by_container.empty:
+        return results, by_container
+
+    # the peaks of the containers are summed up, as they're all held by the query
+    per_query = (
+        by_container.drop(columns=["container"])
+        .groupby(QUERY_KEYS, dropna=False)
+        .sum(min_count=1)
+        .reset_index()
+    )
+    return results.merge(per_query, on=QUERY_KEYS, how="left"), by_container
+
+
+def add_spark_cpu(results: pd.DataFrame, spark_metrics_path: Path) -> pd.DataFrame:
+    if not spark_metrics_path.exists():
+        results["spark_executor_cpu_seconds"] = np.nan
+        return results
+
+    spark_metrics = pd.read_csv(spark_metrics_path)
+    spark_metrics["spark_executor_cpu_seconds"] = (
+        spark_metrics["executor_cpu_time_ns"] / 1e9
+    )
+    return results.merge(
+        spark_metrics[QUERY_KEYS + ["spark_executor_cpu_seconds"]],
+        on=QUERY_KEYS,
+        how="left",
+    )
+
+
+def add_efficiency(results: pd.DataFrame) -> pd.DataFrame:
+    cpu_seconds = results.get("cpu_seconds", pd.Series(np.nan, index=results.index))
+    results["total_cpu_seconds"] = cpu_seconds.fillna(0) + results[
+        "spark_executor_cpu_seconds"
+    ].fillna(0)
+    results["mean_cpu_cores"] = results["total_cpu_seconds"] / results[
+        "total_duration_seconds"
+    ].replace(0, np.nan)
+
+    rows = results["result_row_count"].replace(0, np.nan)
+    results["cpu_seconds_per_result_row"] = results["total_cpu_seconds"] / rows
+    read_bytes = results.get("fs_read_bytes", 0) + results.get(
+        "network_receive_bytes", 0
+    )
+    results["read_bytes_per_result_row"] = read_bytes / rows
+    return results
+
+
+def get_latest_results() -> Path | None:
+    paths = sorted(
+        (Path.cwd() / "results" / "benchmark-runs").glob("*/*-benchmark-results.csv"),
+        key=lambda path: path.name,
+    )
+    return paths[-1] if paths else None
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Attribute the containers' CPU, memory and IO to the benchmark's "
+        + "queries by integrating the container samples over each query's window"
+    )
+    parser.add_argument(
+        "--results",
+        default=None,
+        help="A *-benchmark-results.csv of main.py. Defaults to the latest one.",
+    )
+    parser.add_argument(
+        "--metrics",
+        default=None,
+        nargs="+",
+        help="Parquet files of collect_metrics.py or container_sampler.py covering "
+        + "the benchmark run. Defaults to the run's samples written by main.py.",
+    )
+    parser.add_argument(
+        "--population-size",
+        default=os.getenv("SYNTHEA_POPULATION_SIZE", ""),
+        help="The population size of the benchmark run",
+    )
+    args = parser.parse_args()
+
+    results_path = Path(args.results) if args.results else get_latest_results()
+    if results_path is None:
+        logger.error("No benchmark results found")
+        return 1
+
+    results = pd.read_csv(results_path)
+    if "query_start_timestamp" not in results.columns:
+        logger.error(
+            "{path} has no query timestamps, it was written by an older version",
+            path=results_path,
+        )
+        return 1
+    results = results[results["query_start_timestamp"].notna()].copy()
+
+    # sidecar tables are written next to the results by main.py
+    file_name_prefix = results_path.name.removesuffix("-benchmark-results.csv")
+    metrics_paths = args.metrics or [
+        results_path.parent
+        / "container-samples"
+        / f"{file_name_prefix}-container-samples.parquet"
+    ]
+    missing_paths = [path for path in metrics_paths if not Path(path).exists()]
+    if missing_paths:
+        logger.error("{paths} don't exist, pass --metrics", paths=missing_paths)
+        return 1
+
+    metrics = pd.concat(read_metrics(Path(path)) for path in metrics_paths)
+    logger.info(
+        "Attributing {samples} samples to {queries} queries of {path}",
+        samples=len(metrics),
+        queries=len(results),
+        path=results_path,
+    )
+
+    results, by_container = attribute(results, metrics)
+
+    results = add_spark_cpu(
+        results,
+        results_path.parent
+        / "spark-query-metrics"
+        / f"{file_name_prefix}-spark-query-metrics.csv",
+    )
+    results = add_efficiency(results)
+
+    output_dir = Path.cwd() / "results" / "query-resources"
+    output_dir.mkdir(parents=True, exist_ok=True)
+    output_prefix = f"{time.strftime('%Y%m%d-%H%M%S')}-{args.population_size}"
+    results.to_csv(output_dir / f"{output_prefix}-query-resources.csv", index=False)
+    by_container.to_csv(
+        output_dir / f"{output_prefix}-query-resources-by-container.csv", index=False
+    )
+
+    logger.info(
+        results.groupby(["engine", "query_type", "query"])[
+            ["total_cpu_seconds", "cpu_seconds_per_result_row"]
+        ].median()
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
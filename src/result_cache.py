@@ -0,0 +1,411 @@
+import datetime
+import hashlib
+import json
+import re
+import shutil
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+from pathlib import Path
+from typing import Any
+
+import requests
+from loguru import logger
+
+from benchmark import Benchmark, BenchmarkRunResult, QueryType, QUERY_TYPES_TO_RUN
+from engine_worker import load_factory
+from warehouse import BENCHMARK_RESOURCE_TYPES, get_benchmark_schema, get_delta_table
+
+_LINE_COMMENT = re.compile(r"--[^\n]*")
+_STRING_LITERAL = re.compile(r"('(?:[^']|'')*')")
+
+
+def normalize_query(query: str) -> str:
+    # comments, whitespace and the case of keywords and identifiers don't change
+    # the result, the case of string literals does
+    parts = _STRING_LITERAL.split(_LINE_COMMENT.sub(" ", query))
+    normalized = "".join(
+        part if index % 2 == 1 else " ".join(part.split()).lower()
+        for index, part in enumerate(parts)
+    )
+    return normalized.strip().rstrip(";").strip()
+
+
+def get_delta_versions(schema: str) -> str:
+    return ",".join(
+        f"{resource_type}={get_delta_table(schema, resource_type).version()}"
+        for resource_type in BENCHMARK_RESOURCE_TYPES
+    )
+
+
+def get_last_updated_watermark(fhir_server_base_url: str) -> str:
+    # the latest _lastUpdated doesn't change on deletes, so the total is included
+    watermarks = []
+    for resource_type in BENCHMARK_RESOURCE_TYPES:
+        url = f"{fhir_server_base_url.rstrip('/')}/{resource_type}"
+        latest = requests.get(
+            url,
+            params={"_sort": "-_lastUpdated", "_count": 1, "_elements": "id"},
+            timeout=60,
+        )
+        latest.raise_for_status()
+        entries = latest.json().get("entry", [])
+        last_updated = (
+            entries[0]["resource"].get("meta", {}).get("lastUpdated", "")
+            if entries
+            else ""
+        )
+
+        total = requests.get(url, params={"_summary": "count"}, timeout=600)
+        total.raise_for_status()
+        watermarks.append(f"{resource_type}={last_updated}/{total.json()['total']}")
+    return ",".join(watermarks)
+
+
+def get_result_paths(engine: str, query_type: QueryType, query_name: str) -> list[Path]:
+    # every adapter writes to results/<engine>/<query type>/<query>.csv (a directory
+    # for Spark), pyrate additionally to <query>-<ResourceType>.csv for _include-s
+    output_folder = Path.cwd() / "results" / engine / str(query_type)
+    return [output_folder / f"{query_name}.csv"] + sorted(
+        output_folder.glob(f"{query_name}-[A-Z]*.csv")
+    )
+
+
+def read_result_files(paths: list[Path]) -> dict[str, bytes]:
+    files = {}
+    for path in paths:
+        if path.is_dir():
+            for file in sorted(path.rglob("*")):
+                if file.is_file() and not file.name.startswith((".", "_")):
+                    files[file.relative_to(path.parent).as_posix()] = file.read_bytes()
+        elif path.exists():
+            files[path.name] = path.read_bytes()
+    return files
+
+
+def write_result_files(output_folder: Path, files: dict[str, bytes]):
+    for top_level in {Path(name).parts[0] for name in files}:
+        path = output_folder / top_level
+        if path.is_dir():
+            shutil.rmtree(path)
+    for name, content in files.items():
+        path = output_folder / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(content)
+
+
+def hash_result_files(files: dict[str, bytes]) -> str:
+    # independent of the row order and of how Spark split the output into parts
+    headers = set()
+    rows = []
+    for content in files.values():
+        lines = content.decode("utf-8", errors="replace").splitlines()
+        if lines:
+            headers.add(lines[0])
+            rows.extend(lines[1:])
+
+    digest = hashlib.sha256()
+    for line in sorted(headers) + sorted(rows):
+        digest.update(line.encode("utf-8"))
+        digest.update(b"\n")
+    return digest.hexdigest()
+
+
+@dataclass
+class CacheEntry:
+    files: dict[str, bytes]
+    size_bytes: int
+    result_sha256: str
+    result_row_count: int | None = None
+
+
+class ResultCache:
+    """
+    LRU cache of query results, bounded by the total size of the cached results.
+    """
+
+    def __init__(self, max_size_bytes: int):
+        self.max_size_bytes = max_size_bytes
+        self.size_bytes = 0
+        self.evictions = 0
+        self._entries: OrderedDict[str, CacheEntry] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> CacheEntry | None:
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key: str, entry: CacheEntry) -> bool:
+        if entry.size_bytes > self.max_size_bytes:
+            return False
+
+        if key in self._entries:
+            self.size_bytes -= self._entries.pop(key).size_bytes
+
+        while self.size_bytes + entry.size_bytes > self.max_size_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.size_bytes -= evicted.size_bytes
+            self.evictions += 1
+
+        self._entries[key] = entry
+        self.size_bytes += entry.size_bytes
+        return True
+
+
+class CachedBenchmark(Benchmark):
+    """
+    Serves repeated queries from a ResultCache as long as the underlying data
+    hasn't changed, otherwise runs them on the wrapped engine.
+    """
+
+    def __init__(
+        self,
+        engine_factory: str,
+        engine_kwargs: dict[str, Any] | None = None,
+        max_size_bytes: int = 1024 * 1024 * 1024,
+    ):
+        self.engine_kwargs = engine_kwargs or {}
+        self.engine: Benchmark = load_factory(engine_factory)(**self.engine_kwargs)
+        self.cache = ResultCache(max_size_bytes)
+        # the FHIR servers are versioned by _lastUpdated, the Delta tables directly.
+        # The version is checked once per run_all_queries round.
+        self.fhir_server_base_url = self.engine_kwargs.get("fhir_server_base_url")
+        self.schema = self.engine_kwargs.get("schema") or get_benchmark_schema()
+        # (engine, query names) of each query type, known after its first run
+        self.known_queries: dict[QueryType, tuple[str, list[str]]] = {}
+        self.sidecar_tables: dict[str, list[dict]] = {}
+        self.start_timestamp = datetime.datetime.now(datetime.UTC)
+        # queries without a definition, whose results are never cached
+        self.uncacheable: set[tuple[QueryType, str]] = set()
+        # e.g. the query parameters, which change the result just like the query
+        self.run_options: dict[str, Any] = {}
+
+    def get_data_version(self) -> str:
+        if self.fhir_server_base_url is not None:
+            return get_last_updated_watermark(self.fhir_server_base_url)
+        return get_delta_versions(self.schema)
+
+    def get_cache_key(
+        self, engine: str, query_type: QueryType, query_name: str, data_version: str
+    ) -> str | None:
+        definition = normalize_query(
+            self.engine.get_query_definition(query_type, query_name)
+        )
+        if not definition:
+            # the name alone would serve another query's result after a change
+            if (query_type, query_name) not in self.uncacheable:
+                logger.warning(
+                    "{engine} doesn't define {query_type} {query_name}, not caching it",
+                    engine=engine,
+                    query_type=query_type,
+                    query_name=query_name,
+                )
+                self.uncacheable.add((query_type, query_name))
+            return None
+        run_options = json.dumps(self.run_options, sort_keys=True, default=str)
+        return "|".join(
+            [engine, str(query_type), query_name, definition, run_options, data_version]
+        )
+
+    def run_all_queries(
+        self,
+        run_id: int,
+        is_warmup: bool = False,
+        cold_or_warm: str = "cold",
+        query_types: list[QueryType] | None = None,
+        query_names: list[str] | None = None,
+        **run_options,
+    ) -> list[BenchmarkRunResult]:
+        self.sidecar_tables = {"result-cache": []}
+        self.start_timestamp = datetime.datetime.now(datetime.UTC)
+        self.run_options = run_options
+        run_kwargs = {
+            "run_id": run_id,
+            "is_warmup": is_warmup,
+            "cold_or_warm": cold_or_warm,
+        } | run_options
+
+        # once per round instead of per query, so a hit only pays for its key
+        version_start = time.perf_counter()
+        data_version = self.get_data_version()
+        version_duration = time.perf_counter() - version_start
+
+        results = []
+        for query_type in query_types or QUERY_TYPES_TO_RUN:
+            if query_type not in self.known_queries:
+                # the engine knows its queries, so the first run of a type populates
+                engine_results = self._run_engine(
+                    query_types=[query_type], query_names=query_names, **run_kwargs
+                )
+                if query_names is None and engine_results:
+                    self.known_queries[query_type] = (
+                        engine_results[0].engine,
+                        [result.query for result in engine_results],
+                    )
+                for result in engine_results:
+                    results.append(self._store(result, data_version, version_duration))
+                continue
+
+            engine, names = self.known_queries[query_type]
+            for query_name in names:
+                if query_names is not None and query_name not in query_names:
+                    continue
+                results.append(
+                    self._run_query(
+                        engine,
+                        query_type,
+                        query_name,
+                        data_version,
+                        version_duration,
+                        run_kwargs,
+                    )
+                )
+
+        return results
+
+    def _run_query(
+        self,
+        engine: str,
+        query_type: QueryType,
+        query_name: str,
+        data_version: str,
+        version_duration: float,
+        run_kwargs: dict,
+    ) -> BenchmarkRunResult:
+        query_start_timestamp = datetime.datetime.now(datetime.UTC)
+        start = time.perf_counter()
+        key = self.get_cache_key(engine, query_type, query_name, data_version)
+        key_duration = time.perf_counter() - start
+
+        lookup_start = time.perf_counter()
+        entry = self.cache.get(key) if key is not None else None
+        lookup_duration = time.perf_counter() - lookup_start
+
+        if entry is None:
+            engine_results = self._run_engine(
+                query_types=[query_type], query_names=[query_name], **run_kwargs
+            )
+            return self._store(engine_results[0], data_version, version_duration)
+
+        restore_start = time.perf_counter()
+        write_result_files(Path.cwd() / "results" / engine / str(query_type), entry.files)
+        restore_duration = time.perf_counter() - restore_start
+
+        total_duration = time.perf_counter() - start
+        result = BenchmarkRunResult(
+            run_id=run_kwargs["run_id"],
+            start_timestamp=self.start_timestamp,
+            engine=f"{engine}-cached",
+            query=query_name,
+            query_type=query_type,
+            total_duration_seconds=total_duration,
+            write_to_file_duration_seconds=restore_duration,
+            fetch_duration_seconds=key_duration + lookup_duration,
+            is_warmup=run_kwargs["is_warmup"],
+            cold_or_warm=run_kwargs["cold_or_warm"],
+            query_start_timestamp=query_start_timestamp,
+            query_end_timestamp=query_start_timestamp
+            + datetime.timedelta(seconds=total_duration),
+            result_row_count=entry.result_row_count,
+        )
+        self._add_sidecar_row(
+            result,
+            cache_hit=True,
+            data_version=data_version,
+            version_check_duration_seconds=version_duration,
+            key_duration_seconds=key_duration,
+            lookup_duration_seconds=lookup_duration,
+            restore_duration_seconds=restore_duration,
+            result_size_bytes=entry.size_bytes,
+            result_sha256=entry.result_sha256,
+        )
+        return result
+
+    def _run_engine(self, **kwargs) -> list[BenchmarkRunResult]:
+        results = self.engine.run_all_queries(**kwargs)
+        # the engine resets its sidecar tables on every call
+        for table_name, rows in self.engine.collect_sidecar_tables().items():
+            self.sidecar_tables.setdefault(table_name, []).extend(rows)
+        return results
+
+    def _store(
+        self, result: BenchmarkRunResult, data_version: str, version_duration: float
+    ) -> BenchmarkRunResult:
+        store_start = time.perf_counter()
+        files = read_result_files(
+            get_result_paths(result.engine, result.query_type, result.query)
+        )
+        entry = CacheEntry(
+            files=files,
+            size_bytes=sum(len(content) for content in files.values()),
+            result_sha256=hash_result_files(files),
+            result_row_count=result.result_row_count,
+        )
+        key_start = time.perf_counter()
+        key = self.get_cache_key(
+            result.engine, result.query_type, result.query, data_version
+        )
+        key_duration = time.perf_counter() - key_start
+        if key is not None and not self.cache.put(key, entry):
+            logger.warning(
+                "Result of {query} ({size} bytes) exceeds the cache size",
+                query=result.query,
+                size=entry.size_bytes,
+            )
+        store_duration = time.perf_counter() - store_start
+
+        cached_result = replace(
+            result,
+            engine=f"{result.engine}-cached",
+            total_duration_seconds=result.total_duration_seconds + store_duration,
+        )
+        self._add_sidecar_row(
+            cached_result,
+            cache_hit=False,
+            cacheable=key is not None,
+            data_version=data_version,
+            version_check_duration_seconds=version_duration,
+            key_duration_seconds=key_duration,
+            store_duration_seconds=store_duration,
+            engine_duration_seconds=result.total_duration_seconds,
+            result_size_bytes=entry.size_bytes,
+            result_sha256=entry.result_sha256,
+        )
+        return cached_result
+
+    def _add_sidecar_row(self, result: BenchmarkRunResult, **values):
+        self.sidecar_tables["result-cache"].append(
+            {
+                "run_id": result.run_id,
+                "engine": result.engine,
+                "query": result.query,
+                "query_type": str(result.query_type),
+                "cold_or_warm": result.cold_or_warm,
+                "is_warmup": result.is_warmup,
+                "cacheable": True,
+                "key_duration_seconds": 0,
+                "lookup_duration_seconds": 0,
+                "restore_duration_seconds": 0,
+                "store_duration_seconds": 0,
+                "engine_duration_seconds": 0,
+            }
+            | values
+            | {
+                "cache_entries": len(self.cache),
+                "cache_size_bytes": self.cache.size_bytes,
+                "cache_evictions": self.cache.evictions,
+            }
+        )
+
+    def collect_sidecar_tables(self) -> dict[str, list[dict]]:
+        return self.sidecar_tables
+
+    def get_resource_counts(self, resource_types: list[str]) -> dict[str, int]:
+        return self.engine.get_resource_counts(resource_types)
+
+    def get_resource_counts_total(self, resource_types: list[str]) -> int:
+        return self.engine.get_resource_counts_total(resource_types)
@@ -0,0 +1,355 @@
+import argparse
+import os
+import sys
+import time
+import uuid
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import requests
+from deltalake import write_deltalake
+from loguru import logger
+
+from engine_registry import get_engines
+from engine_worker import EngineWorker
+from population_ladder import (
+    SRC_DIR,
+    get_fhir_env,
+    get_jvm_metrics_urls,
+    has_fhir_server_data,
+    run,
+    start_fhir_servers,
+    stop_fhir_servers,
+    vacuum_hapi_database,
+)
+from services import COMPOSE_PROJECT_NAME, HAPI_SQL_PROFILING, get_container_name
+from warehouse import (
+    BENCHMARK_RESOURCE_TYPES,
+    DELTALAKE_STORAGE_OPTIONS,
+    get_benchmark_schema,
+    get_delta_table,
+    get_table_url,
+    register_schema,
+)
+
+MIB = 1024 * 1024
+
+# the invalidation test appends and deletes a resource, so it runs against a
+# copy of the warehouse and its own Blaze and HAPI, never the benchmark dataset
+SCRATCH_FHIR_COMPOSE_PROJECT = f"{COMPOSE_PROJECT_NAME}-result-cache"
+DEFAULT_FHIR_PORT_BASE = 18300
+
+# the appended resource changes the result of e.g. aggregate/observations-by-code
+APPENDED_RESOURCE_TYPE = "Observation"
+
+
+def get_scratch_schema(schema: str) -> str:
+    return f"{schema}_result_cache"
+
+
+def copy_schema(source_schema: str, schema: str):
+    for resource_type in BENCHMARK_RESOURCE_TYPES:
+        logger.info(
+            "Copying {resource_type} to {schema}",
+            resource_type=resource_type,
+            schema=schema,
+        )
+        # streamed from the source's files, so the table never has to fit in memory
+        write_deltalake(
+            get_table_url(schema, resource_type, scheme="s3"),
+            get_delta_table(source_schema, resource_type).to_pyarrow_dataset(),
+            mode="overwrite",
+            schema_mode="overwrite",
+            engine="rust",
+            storage_options=DELTALAKE_STORAGE_OPTIONS,
+        )
+    register_schema(schema, BENCHMARK_RESOURCE_TYPES)
+
+
+def start_scratch_fhir_servers(ports: dict[str, int], population_size: str):
+    # a no-op if they're already running. The appended resources are deleted
+    # again, so the data is only loaded once and kept in the project's volumes.
+    start_fhir_servers(SCRATCH_FHIR_COMPOSE_PROJECT, ports)
+    if has_fhir_server_data(ports):
+        return
+
+    env = get_fhir_env(SCRATCH_FHIR_COMPOSE_PROJECT, ports)
+    run(
+        [
+            sys.executable,
+            "fhir_ingest.py",
+            "--population-size",
+            population_size,
+            "--output-prefix",
+            f"{population_size}-result-cache",
+        ],
+        cwd=SRC_DIR,
+        env=env,
+    )
+    vacuum_hapi_database(SCRATCH_FHIR_COMPOSE_PROJECT, ports)
+
+
+def get_scratch_kwargs(kwargs: dict, schema: str, ports: dict[str, int]) -> dict:
+    if kwargs.get("fhir_server_base_url") is None:
+        return kwargs | {"schema": schema}
+
+    server = kwargs["fhir_server_name"]
+    scratch_kwargs = kwargs | {
+        "fhir_server_base_url": f"http://localhost:{ports[server]}/fhir/",
+        "jvm_metrics_url": get_jvm_metrics_urls(ports)[server],
+    }
+    if server == "hapi" and HAPI_SQL_PROFILING:
+        scratch_kwargs["postgres_container"] = get_container_name(
+            "hapi-fhir-postgres", SCRATCH_FHIR_COMPOSE_PROJECT
+        )
+    return scratch_kwargs
+
+
+def append_delta_resource(schema: str) -> str:
+    # a copy of an existing resource with a new id, so it matches the table's schema
+    table = get_delta_table(schema, APPENDED_RESOURCE_TYPE)
+    row = table.to_pyarrow_dataset().head(1)
+    resource_id = f"result-cache-{uuid.uuid4()}"
+    row = row.set_column(
+        row.schema.get_field_index("id"), "id", pa.array([resource_id])
+    )
+    write_deltalake(
+        get_table_url(schema, APPENDED_RESOURCE_TYPE, scheme="s3"),
+        row,
+        mode="append",
+        engine="rust",
+        storage_options=DELTALAKE_STORAGE_OPTIONS,
+    )
+    return resource_id
+
+
+def remove_delta_resource(schema: str, resource_id: str):
+    get_delta_table(schema, APPENDED_RESOURCE_TYPE).delete(f"id = '{resource_id}'")
+
+
+def append_fhir_resource(fhir_server_base_url: str) -> str:
+    base_url = fhir_server_base_url.rstrip("/")
+    response = requests.get(
+        f"{base_url}/{APPENDED_RESOURCE_TYPE}", params={"_count": 1}, timeout=60
+    )
+    response.raise_for_status()
+    resource = response.json()["entry"][0]["resource"]
+    resource.pop("id", None)
+    resource.pop("meta", None)
+
+    response = requests.post(
+        f"{base_url}/{APPENDED_RESOURCE_TYPE}", json=resource, timeout=60
+    )
+    response.raise_for_status()
+    return response.json()["id"]
+
+
+def remove_fhir_resource(fhir_server_base_url: str, resource_id: str):
+    response = requests.delete(
+        f"{fhir_server_base_url.rstrip('/')}/{APPENDED_RESOURCE_TYPE}/{resource_id}",
+        timeout=60,
+    )
+    response.raise_for_status()
+
+
+def run_phase(worker: EngineWorker, phase: str, run_id: int) -> list[dict]:
+    worker.call("run_all_queries", run_id=run_id, cold_or_warm="warm")
+    rows = worker.call("collect_sidecar_tables").get("result-cache", [])
+    return [row | {"phase": phase} for row in rows]
+
+
+def benchmark_engine(
+    engine: str,
+    hit_runs: int,
+    max_size_bytes: int,
+    schema: str,
+    ports: dict[str, int],
+) -> list[dict]:
+    spec = get_engines([engine])[0]
+    engine_kwargs = get_scratch_kwargs(spec.kwargs, schema, ports)
+    fhir_server_base_url = engine_kwargs.get("fhir_server_base_url")
+
+    def create_worker(name: str, cache_size_bytes: int) -> EngineWorker:
+        return EngineWorker(
+            name,
+            "result_cache:CachedBenchmark",
+            {
+                "engine_factory": spec.factory,
+                "engine_kwargs": engine_kwargs,
+                "max_size_bytes": cache_size_bytes,
+            },
+        )
+
+    rows = []
+    worker = create_worker(f"{engine}-cached", max_size_bytes)
+    resource_id = None
+    try:
+        rows.extend(run_phase(worker, "populate", 0))
+        for run_id in range(1, hit_runs + 1):
+            rows.extend(run_phase(worker, "hit", run_id))
+
+        if fhir_server_base_url is not None:
+            resource_id = append_fhir_resource(fhir_server_base_url)
+        else:
+            resource_id = append_delta_resource(schema)
+        logger.info(
+            "Appended {resource_type}/{resource_id}",
+            resource_type=APPENDED_RESOURCE_TYPE,
+            resource_id=resource_id,
+        )
+
+        # every query has to miss once and then hit again
+        rows.extend(run_phase(worker, "after-append", hit_runs + 1))
+        rows.extend(run_phase(worker, "hit-after-append", hit_runs + 2))
+        worker.stop()
+
+        # a cache which can't store anything always runs the queries on the engine
+        baseline_worker = create_worker(f"{engine}-uncached", 0)
+        try:
+            rows.extend(run_phase(baseline_worker, "baseline", hit_runs + 3))
+        finally:
+            baseline_worker.stop()
+    finally:
+        worker.stop()
+        if resource_id is not None:
+            if fhir_server_base_url is not None:
+                remove_fhir_resource(fhir_server_base_url, resource_id)
+            else:
+                remove_delta_resource(schema, resource_id)
+
+    return rows
+
+
+def summarize(rows: pd.DataFrame) -> pd.DataFrame:
+    summaries = []
+    for engine, engine_rows in rows.groupby("engine"):
+        hits = engine_rows[engine_rows["phase"] == "hit"]
+        misses = engine_rows[engine_rows["phase"] == "populate"]
+        after_append = engine_rows[engine_rows["phase"] == "after-append"]
+        baseline = engine_rows[engine_rows["phase"] == "baseline"]
+
+        expected_hashes = dict(
+            zip(
+                baseline["query_type"] + "/" + baseline["query"],
+                baseline["result_sha256"],
+            )
+        )
+        actual_hashes = dict(
+            zip(
+                after_append["query_type"] + "/" + after_append["query"],
+                after_append["result_sha256"],
+            )
+        )
+
+        summaries.append(
+            {
+                "engine": engine,
+                "hit_rate": hits["cache_hit"].mean(),
+                "median_hit_latency_seconds": (
+                    hits["key_duration_seconds"]
+                    + hits["lookup_duration_seconds"]
+                    + hits["restore_duration_seconds"]
+                ).median(),
+                "median_key_duration_seconds": hits["key_duration_seconds"].median(),
+                # checked once per round and shared by all of its queries
+                "median_version_check_duration_seconds": engine_rows.drop_duplicates(
+                    "run_id"
+                )["version_check_duration_seconds"].median(),
+                "median_miss_engine_duration_seconds": misses[
+                    "engine_duration_seconds"
+                ].median(),
+                "median_miss_overhead_seconds": misses[
+                    "store_duration_seconds"
+                ].median(),
+                "invalidated_after_append": not after_append["cache_hit"].any(),
+                "results_match_uncached_after_append": actual_hashes
+                == expected_hashes,
+                "hit_rate_after_append": engine_rows[
+                    engine_rows["phase"] == "hit-after-append"
+                ]["cache_hit"].mean(),
+                "max_cache_size_bytes": engine_rows["cache_size_bytes"].max(),
+            }
+        )
+    return pd.DataFrame(summaries)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Measure the result cache's hit latency, miss overhead and "
+        + "invalidation after appending a resource"
+    )
+    parser.add_argument(
+        "--engines",
+        type=lambda value: value.split(","),
+        default=["trino", "pathling", "blaze", "hapi"],
+    )
+    parser.add_argument(
+        "--hit-runs", type=int, default=5, help="Runs served from the cache"
+    )
+    parser.add_argument("--max-size-mib", type=int, default=1024)
+    parser.add_argument(
+        "--fhir-port-base",
+        type=int,
+        default=DEFAULT_FHIR_PORT_BASE,
+        help="Port of the scratch Blaze, HAPI gets the next one",
+    )
+    parser.add_argument(
+        "--stop-fhir-servers",
+        action="store_true",
+        help="Stop the scratch FHIR servers when done. Their volumes are kept.",
+    )
+    parser.add_argument(
+        "--population-size",
+        default=os.getenv("SYNTHEA_POPULATION_SIZE", ""),
+        help="The population size of the loaded data",
+    )
+    args = parser.parse_args()
+
+    specs = get_engines(args.engines)
+    fhir_engines = [
+        spec.name for spec in specs if "fhir_server_base_url" in spec.kwargs
+    ]
+    if fhir_engines and not args.population_size:
+        parser.error(f"--population-size is required to load {fhir_engines}")
+
+    schema = get_scratch_schema(get_benchmark_schema())
+    if len(fhir_engines) < len(specs):
+        copy_schema(get_benchmark_schema(), schema)
+    ports = {"blaze": args.fhir_port_base, "hapi": args.fhir_port_base + 1}
+    if fhir_engines:
+        start_scratch_fhir_servers(ports, args.population_size)
+
+    all_rows = []
+    try:
+        for engine in args.engines:
+            logger.info("Benchmarking the result cache of {engine}", engine=engine)
+            all_rows.extend(
+                benchmark_engine(
+                    engine, args.hit_runs, args.max_size_mib * MIB, schema, ports
+                )
+            )
+    finally:
+        if fhir_engines and args.stop_fhir_servers:
+            stop_fhir_servers(SCRATCH_FHIR_COMPOSE_PROJECT, ports)
+
+    output_dir = Path.cwd() / "results" / "result-cache"
+    output_dir.mkdir(parents=True, exist_ok=True)
+    file_name_prefix = f"{time.strftime('%Y%m%d-%H%M%S')}-{args.population_size}"
+
+    rows = pd.DataFrame(all_rows)
+    rows["synthea_population_size"] = args.population_size
+    rows.to_csv(output_dir / f"{file_name_prefix}-result-cache.csv", index=False)
+
+    summary = summarize(rows)
+    summary["synthea_population_size"] = args.population_size
+    summary.to_csv(
+        output_dir / f"{file_name_prefix}-result-cache-summary.csv", index=False
+    )
+
+    logger.info(summary)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,226 @@
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+import pandas as pd
+from loguru import logger
+
+from container_limits import (
+    TRINO_CONTAINER,
+    get_limits,
+    restart_and_wait,
+    restore_cpuset,
+    set_cpuset,
+)
+from engine_worker import EngineWorker
+from failure_policy import classify_failure
+
+DEFAULT_CORES = [1, 2, 4, 8, 16]
+
+
+def get_failed_row(engine: str, exc: Exception) -> dict:
+    failure_kind = classify_failure(exc)
+    logger.error(
+        "{engine} failed ({failure_kind}): {error}",
+        engine=engine,
+        failure_kind=failure_kind,
+        error=exc,
+    )
+    return {
+        "engine": engine,
+        "status": "failed",
+        "failure_kind": str(failure_kind),
+        "error": str(exc).splitlines()[0] if str(exc) else "",
+    }
+
+
+def run_engine(engine: str, worker: EngineWorker, runs: int) -> list[dict]:
+    rows = []
+    try:
+        # the first run only warms up the engine
+        for run_id in range(runs + 1):
+            for result in worker.call(
+                "run_all_queries",
+                run_id=run_id,
+                is_warmup=(run_id == 0),
+                cold_or_warm="warm",
+            ):
+                rows.append(
+                    {
+                        "engine": result.engine,
+                        "run_id": result.run_id,
+                        "query": result.query,
+                        "query_type": str(result.query_type),
+                        "is_warmup": result.is_warmup,
+                        "total_duration_seconds": result.total_duration_seconds,
+                        "status": "success",
+                        "failure_kind": "",
+                        "error": "",
+                    }
+                )
+    except Exception as exc:
+        # the configuration is kept in the results, e.g. a core count too small
+        # for the engine to finish its queries
+        rows.append(get_failed_row(engine, exc))
+    finally:
+        worker.stop()
+    return rows
+
+
+def run_pathling(cores: int, runs: int) -> list[dict]:
+    worker = EngineWorker(
+        f"pathling-{cores}-cores",
+        "pathling_benchmark:PathlingBenchmark",
+        {"spark_conf": {"spark.master": f"local[{cores}]"}},
+    )
+    return run_engine("pathling", worker, runs)
+
+
+def run_trino(cores: int, runs: int) -> list[dict]:
+    # Trino sizes its thread pools from the visible CPUs at start-up, so the
+    # container is restarted after changing its cpuset.
+    set_cpuset(TRINO_CONTAINER, cores)
+    restart_and_wait(TRINO_CONTAINER)
+
+    worker = EngineWorker(
+        f"trino-{cores}-cores",
+        "trino_benchmark:TrinoBenchmark",
+        # a power of two, checked by main()
+        {"session_properties": {"task_concurrency": str(cores)}},
+    )
+    return run_engine("trino", worker, runs)
+
+
+def compute_scaling_curves(results: pd.DataFrame) -> pd.DataFrame:
+    succeeded = results[results["status"] == "success"]
+    medians = (
+        succeeded[~succeeded["is_warmup"].astype(bool)]
+        .groupby(["synthea_population_size", "engine", "query_type", "query", "cores"])[
+            "total_duration_seconds"
+        ]
+        .median()
+        .reset_index(name="median_duration_seconds")
+    )
+
+    # relative to the smallest measured core count of each query
+    baseline = medians.loc[
+        medians.groupby(["synthea_population_size", "engine", "query_type", "query"])[
+            "cores"
+        ].idxmin()
+    ][
+        [
+            "synthea_population_size",
+            "engine",
+            "query_type",
+            "query",
+            "cores",
+            "median_duration_seconds",
+        ]
+    ].rename(
+        columns={
+            "cores": "baseline_cores",
+            "median_duration_seconds": "baseline_median_duration_seconds",
+        }
+    )
+
+    curves = medians.merge(
+        baseline, on=["synthea_population_size", "engine", "query_type", "query"]
+    )
+    curves["speedup"] = (
+        curves["baseline_median_duration_seconds"] / curves["median_duration_seconds"]
+    )
+    curves["parallel_efficiency"] = curves["speedup"] / (
+        curves["cores"] / curves["baseline_cores"]
+    )
+    return curves
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Re-run the Trino and Pathling queries with a constrained number of CPU cores"
+    )
+    parser.add_argument(
+        "--cores",
+        type=lambda value: [int(cores) for cores in value.split(",")],
+        default=DEFAULT_CORES,
+        help="Comma-separated core counts, e.g. 1,2,4,8,16",
+    )
+    parser.add_argument(
+        "--engines",
+        type=lambda value: value.split(","),
+        default=["trino", "pathling"],
+        help="Comma-separated engines to scale, trino and/or pathling",
+    )
+    parser.add_argument(
+        "--runs", type=int, default=3, help="Measured runs per core count (plus a warm-up)"
+    )
+    parser.add_argument(
+        "--population-size",
+        default=os.getenv("SYNTHEA_POPULATION_SIZE", ""),
+        help="The population size of the loaded data",
+    )
+    args = parser.parse_args()
+
+    runners = {"trino": run_trino, "pathling": run_pathling}
+    unknown_engines = set(args.engines) - set(runners)
+    if unknown_engines:
+        parser.error(f"Unknown engines {unknown_engines}, available: {list(runners)}")
+    if any(cores < 1 for cores in args.cores):
+        parser.error("--cores must be positive")
+    # Trino's task_concurrency, which is set to the core count, has to be a power
+    # of two. Otherwise every query of the core count would fail.
+    if "trino" in args.engines and any(cores & (cores - 1) for cores in args.cores):
+        parser.error("--cores must be powers of two to scale trino")
+
+    cpu_count = os.cpu_count() or 1
+    core_counts = [cores for cores in args.cores if cores <= cpu_count]
+    if len(core_counts) < len(args.cores):
+        logger.warning(
+            "Skipping core counts above the host's {cpu_count} CPUs", cpu_count=cpu_count
+        )
+
+    trino_limits = get_limits(TRINO_CONTAINER) if "trino" in args.engines else None
+
+    all_rows = []
+    try:
+        for cores in core_counts:
+            for engine in args.engines:
+                logger.info(
+                    "Running {engine} with {cores} cores", engine=engine, cores=cores
+                )
+                try:
+                    rows = runners[engine](cores, args.runs)
+                except Exception as exc:
+                    # e.g. Trino didn't come up again with the new cpuset
+                    rows = [get_failed_row(engine, exc)]
+                all_rows.extend(row | {"cores": cores} for row in rows)
+    finally:
+        if trino_limits is not None:
+            # only the cpuset was changed
+            restore_cpuset(TRINO_CONTAINER, trino_limits)
+            restart_and_wait(TRINO_CONTAINER)
+
+    output_dir = Path.cwd() / "results" / "scaling"
+    output_dir.mkdir(parents=True, exist_ok=True)
+    file_name_prefix = f"{time.strftime('%Y%m%d-%H%M%S')}-{args.population_size}"
+
+    results = pd.DataFrame(all_rows)
+    results["synthea_population_size"] = args.population_size
+    results.to_csv(output_dir / f"{file_name_prefix}-scaling.csv", index=False)
+
+    # the failed configurations are kept in the results above either way
+    if not any(row["status"] == "success" for row in all_rows):
+        logger.error("No successful runs")
+        return 1
+
+    curves = compute_scaling_curves(results)
+    curves.to_csv(output_dir / f"{file_name_prefix}-scaling-curves.csv", index=False)
+
+    logger.info(curves)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
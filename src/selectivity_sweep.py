@@ -0,0 +1,260 @@
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+import pandas as pd
+from loguru import logger
+
+from benchmark import QueryType
+from engine_registry import get_engines
+from engine_worker import EngineWorker
+from failure_policy import classify_failure
+from pathling_sweep import parse_params
+from query_parameters import DEFAULT_QUERY_PARAMETERS, PARAMETER_QUERIES
+
+# values of each parameter, chosen to span from almost nothing to almost
+# everything of the Synthea data
+DEFAULT_SWEEPS: dict[str, list[str]] = {
+    "birthdate_min": [
+        "1910-01-01",
+        "1930-01-01",
+        "1950-01-01",
+        "1970-01-01",
+        "1990-01-01",
+        "2005-01-01",
+        "2015-01-01",
+        "2022-01-01",
+    ],
+    "encounter_start_min": [
+        "1950-01-01",
+        "1990-01-01",
+        "2010-01-01",
+        "2020-01-01",
+        "2023-01-01",
+        "2024-06-01",
+    ],
+    "condition_code_count": ["1", "2", "3", "5", "8", "12", "15"],
+    "hemoglobin_min_g_dl": ["0", "10", "13", "15", "17", "20", "25"],
+    "hemoglobin_min_percent": ["0", "4", "5", "6", "7", "10", "20"],
+}
+
+# the resource type whose total count the result count is relative to
+SELECTIVITY_BASES = {
+    "gender-age": "Patient",
+    "diabetes": "Condition",
+    "hemoglobin": "Patient",
+}
+
+SWEEP_QUERY_TYPES = [QueryType.COUNT, QueryType.EXTRACT]
+
+
+def parse_value(parameter: str, value: str):
+    # dates stay strings, numbers become numbers again
+    if isinstance(DEFAULT_QUERY_PARAMETERS[parameter], str):
+        return value
+    return int(value) if value.lstrip("-").isdigit() else float(value)
+
+
+def get_match_counts(
+    trino: EngineWorker, parameter: str, value, query_names: list[str]
+) -> dict[str, int]:
+    # the ground truth of each point is the result of Trino's count query
+    trino.call(
+        "run_all_queries",
+        run_id=0,
+        cold_or_warm="warm",
+        query_types=[QueryType.COUNT],
+        query_names=query_names,
+        query_parameters={parameter: value},
+    )
+    counts = {}
+    for query_name in query_names:
+        result = pd.read_csv(
+            Path.cwd() / "results" / "trino" / str(QueryType.COUNT) / f"{query_name}.csv"
+        )
+        counts[query_name] = int(result.iloc[0, 0])
+    return counts
+
+
+def get_selectivities(sweeps: dict[str, list[str]]) -> pd.DataFrame:
+    trino = EngineWorker.from_spec(get_engines(["trino"])[0])
+    try:
+        totals = trino.call(
+            "get_resource_counts",
+            resource_types=sorted(set(SELECTIVITY_BASES.values())),
+        )
+        rows = []
+        for parameter, values in sweeps.items():
+            query_names = PARAMETER_QUERIES[parameter]
+            for value in values:
+                value = parse_value(parameter, value)
+                counts = get_match_counts(trino, parameter, value, query_names)
+                for query_name, count in counts.items():
+                    rows.append(
+                        {
+                            "parameter": parameter,
+                            "value": value,
+                            "query": query_name,
+                            "matching_count": count,
+                            "selectivity": count
+                            / max(totals[SELECTIVITY_BASES[query_name]], 1),
+                        }
+                    )
+    finally:
+        trino.stop()
+    return pd.DataFrame(rows)
+
+
+def run_engine(
+    engine: str, sweeps: dict[str, list[str]], query_types: list[QueryType], runs: int
+) -> list[dict]:
+    spec = get_engines([engine])[0]
+    worker = EngineWorker.from_spec(spec)
+
+    rows = []
+    try:
+        # warm up once with the default parameters
+        worker.call(
+            "run_all_queries",
+            run_id=0,
+            is_warmup=True,
+            cold_or_warm="warm",
+            query_types=query_types,
+        )
+
+        for parameter, values in sweeps.items():
+            for value in values:
+                value = parse_value(parameter, value)
+                logger.info(
+                    "Running {engine} with {parameter}={value}",
+                    engine=engine,
+                    parameter=parameter,
+                    value=value,
+                )
+                for run_id in range(1, runs + 1):
+                    try:
+                        results = worker.call(
+                            "run_all_queries",
+                            run_id=run_id,
+                            cold_or_warm="warm",
+                            query_types=query_types,
+                            query_names=PARAMETER_QUERIES[parameter],
+                            query_parameters={parameter: value},
+                        )
+                    except Exception as exc:
+                        logger.error(
+                            "{engine} failed with {parameter}={value} ({failure_kind}): {error}",
+                            engine=engine,
+                            parameter=parameter,
+                            value=value,
+                            failure_kind=classify_failure(exc),
+                            error=exc,
+                        )
+                        break
+
+                    for result in results:
+                        rows.append(
+                            {
+                                "engine": result.engine,
+                                "parameter": parameter,
+                                "value": value,
+                                "run_id": result.run_id,
+                                "query_type": str(result.query_type),
+                                "query": result.query,
+                                "total_duration_seconds": result.total_duration_seconds,
+                            }
+                        )
+    finally:
+        worker.stop()
+    return rows
+
+
+def compute_curves(runs: pd.DataFrame, selectivities: pd.DataFrame) -> pd.DataFrame:
+    medians = (
+        runs.groupby(["engine", "parameter", "value", "query_type", "query"])[
+            "total_duration_seconds"
+        ]
+        .median()
+        .reset_index(name="median_duration_seconds")
+    )
+    # the values were parsed to different types per parameter
+    medians["value"] = medians["value"].astype(str)
+    selectivities = selectivities.assign(value=selectivities["value"].astype(str))
+    return medians.merge(
+        selectivities, on=["parameter", "value", "query"], how="left"
+    ).sort_values(["engine", "parameter", "query_type", "query", "selectivity"])
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Run the parameterized queries over a range of selectivities"
+    )
+    parser.add_argument(
+        "--sweep",
+        action="append",
+        default=[],
+        help="Values to sweep for a query parameter, e.g. birthdate_min=1950-01-01,2000-01-01. "
+        + "Replaces the default values of that parameter.",
+    )
+    parser.add_argument(
+        "--parameters",
+        type=lambda value: value.split(","),
+        default=list(DEFAULT_SWEEPS.keys()),
+        help="Comma-separated parameters to sweep",
+    )
+    parser.add_argument(
+        "--engines",
+        type=lambda value: value.split(","),
+        default=["trino", "pathling", "blaze", "hapi"],
+    )
+    parser.add_argument(
+        "--query-types",
+        type=lambda value: [QueryType(query_type) for query_type in value.split(",")],
+        default=SWEEP_QUERY_TYPES,
+    )
+    parser.add_argument(
+        "--runs", type=int, default=3, help="Measured runs per point (plus one warm-up)"
+    )
+    parser.add_argument(
+        "--population-size",
+        default=os.getenv("SYNTHEA_POPULATION_SIZE", ""),
+        help="The population size of the loaded data",
+    )
+    args = parser.parse_args()
+
+    sweeps = DEFAULT_SWEEPS | parse_params(args.sweep)
+    sweeps = {parameter: sweeps[parameter] for parameter in args.parameters}
+
+    logger.info("Determining the selectivity of every point")
+    selectivities = get_selectivities(sweeps)
+
+    all_rows = []
+    for engine in args.engines:
+        all_rows.extend(run_engine(engine, sweeps, args.query_types, args.runs))
+
+    if not all_rows:
+        logger.error("No successful runs")
+        return 1
+
+    output_dir = Path.cwd() / "results" / "selectivity"
+    output_dir.mkdir(parents=True, exist_ok=True)
+    file_name_prefix = f"{time.strftime('%Y%m%d-%H%M%S')}-{args.population_size}"
+
+    runs = pd.DataFrame(all_rows)
+    runs["synthea_population_size"] = args.population_size
+    runs.to_csv(output_dir / f"{file_name_prefix}-selectivity.csv", index=False)
+
+    curves = compute_curves(runs, selectivities)
+    curves["synthea_population_size"] = args.population_size
+    curves.to_csv(
+        output_dir / f"{file_name_prefix}-selectivity-curves.csv", index=False
+    )
+
+    logger.info(curves)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,40 @@
+import os
+
+# the docker compose project of the services, which also names their containers
+# (<project>-<service>-1). Defaults to the name of the repository's directory,
+# like docker compose itself.
+COMPOSE_PROJECT_NAME = os.getenv("COMPOSE_PROJECT_NAME", "analytics-on-fhir-benchmark")
+
+# Blaze and HAPI may run in their own project, e.g. one per population size
+# started by population_ladder.py, with their own host ports
+FHIR_COMPOSE_PROJECT_NAME = os.getenv("FHIR_COMPOSE_PROJECT_NAME", COMPOSE_PROJECT_NAME)
+BLAZE_PORT = int(os.getenv("BLAZE_PORT", "8083"))
+HAPI_PORT = int(os.getenv("HAPI_PORT", "8084"))
+BLAZE_METRICS_PORT = int(os.getenv("BLAZE_METRICS_PORT", "8085"))
+
+# snapshots HAPI's pg_stat_statements around every query. Needs its Postgres to
+# run with compose.hapi-profiling.yaml.
+HAPI_SQL_PROFILING = os.getenv("HAPI_SQL_PROFILING", "false").lower() == "true"
+
+BLAZE_BASE_URL = f"http://localhost:{BLAZE_PORT}/fhir"
+HAPI_BASE_URL = f"http://localhost:{HAPI_PORT}/fhir"
+
+# the JVM metrics in the Prometheus format, see jvm_telemetry.py. Blaze serves
+# them on a port of their own, HAPI's Spring Boot actuator on the FHIR port.
+BLAZE_METRICS_URL = f"http://localhost:{BLAZE_METRICS_PORT}/metrics"
+HAPI_METRICS_URL = f"http://localhost:{HAPI_PORT}/actuator/prometheus"
+
+
+# the warehouse schema of the Delta tables loaded by the Pathling server. Layout
+# variants etc. live in schemas of their own, see warehouse.py.
+DEFAULT_SCHEMA = "default"
+
+
+def get_benchmark_schema() -> str:
+    # selects the warehouse variant the benchmarks run against. Kept here rather
+    # than in warehouse.py, so the orchestrator doesn't import the trino client.
+    return os.getenv("BENCHMARK_SCHEMA", DEFAULT_SCHEMA)
+
+
+def get_container_name(service: str, project: str = COMPOSE_PROJECT_NAME) -> str:
+    return f"{project}-{service}-1"
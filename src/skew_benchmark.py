@@ -0,0 +1,289 @@
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+import pandas as pd
+from loguru import logger
+
+from benchmark import QueryType
+from engine_registry import get_engines
+from engine_worker import EngineWorker
+from failure_policy import classify_failure
+from population_ladder import (
+    get_jvm_metrics_urls,
+    has_fhir_server_data,
+    start_fhir_servers,
+)
+from services import HAPI_SQL_PROFILING, get_container_name
+from skew_fhir_servers import (
+    DEFAULT_FHIR_PORT_BASE,
+    get_fhir_compose_project,
+    get_fhir_ports,
+)
+from skew_generator import DEFAULT_EXPONENTS, get_skew_schema
+
+SKEW_QUERY_TYPES = [QueryType.COUNT_SKEWED, QueryType.JOIN_COUNT_SKEWED]
+
+# engine kwargs to let the optimizer choose or to force a broadcast or a
+# partitioned (shuffled) join
+JOIN_STRATEGIES: dict[str, dict[str, dict]] = {
+    "auto": {
+        "trino": {"session_properties": {"join_distribution_type": "AUTOMATIC"}},
+        "pathling": {},
+    },
+    "broadcast": {
+        "trino": {"session_properties": {"join_distribution_type": "BROADCAST"}},
+        "pathling": {"spark_conf": {"spark.sql.autoBroadcastJoinThreshold": "1g"}},
+    },
+    "partitioned": {
+        "trino": {"session_properties": {"join_distribution_type": "PARTITIONED"}},
+        "pathling": {"spark_conf": {"spark.sql.autoBroadcastJoinThreshold": "-1"}},
+    },
+}
+
+# the joins each engine actually ran, by engine: (sidecar table, column)
+JOIN_METRICS = {
+    "trino": ("trino-query-metrics", "join_distributions"),
+    "pathling": ("spark-query-metrics", "join_strategies"),
+}
+
+# Blaze and HAPI of skew_fhir_servers.py hold a single skew level, loaded from
+# the generated bundles
+FHIR_SERVER_ENGINES = ["blaze", "hapi"]
+
+
+def to_rows(
+    schema: str,
+    data_source: str,
+    join_strategy: str,
+    results: list,
+    sidecar_tables: dict[str, list[dict]],
+    engine: str,
+) -> list[dict]:
+    joins = {}
+    if engine in JOIN_METRICS:
+        table_name, column = JOIN_METRICS[engine]
+        joins = {
+            (row["run_id"], row["query_type"], row["query"]): row.get(column)
+            for row in sidecar_tables.get(table_name, [])
+        }
+
+    return [
+        {
+            "schema": schema,
+            "data_source": data_source,
+            "join_strategy": join_strategy,
+            "engine": result.engine,
+            "run_id": result.run_id,
+            "query_type": str(result.query_type),
+            "query": result.query,
+            "is_warmup": result.is_warmup,
+            "total_duration_seconds": result.total_duration_seconds,
+            "joins": joins.get((result.run_id, str(result.query_type), result.query)),
+        }
+        for result in results
+    ]
+
+
+def run_level(
+    schema: str,
+    engine: str,
+    join_strategy: str,
+    runs: int,
+    fhir_port_base: int = DEFAULT_FHIR_PORT_BASE,
+) -> list[dict]:
+    spec = get_engines([engine])[0]
+    kwargs = dict(spec.kwargs)
+    if engine in FHIR_SERVER_ENGINES:
+        # never the default servers, they hold the unskewed benchmark dataset
+        project = get_fhir_compose_project(schema)
+        ports = get_fhir_ports(fhir_port_base)
+        kwargs |= {
+            "fhir_server_base_url": f"http://localhost:{ports[engine]}/fhir/",
+            "jvm_metrics_url": get_jvm_metrics_urls(ports)[engine],
+        }
+        if engine == "hapi" and HAPI_SQL_PROFILING:
+            kwargs["postgres_container"] = get_container_name(
+                "hapi-fhir-postgres", project
+            )
+        data_source = f"{project}:{ports[engine]}"
+    else:
+        kwargs |= {"schema": schema} | JOIN_STRATEGIES[join_strategy][engine]
+        data_source = f"fhir.{schema}"
+    if engine == "trino":
+        kwargs["explain_joins"] = True
+
+    rows = []
+    worker = None
+    try:
+        worker = EngineWorker(f"{engine}-{schema}-{join_strategy}", spec.factory, kwargs)
+        # the first run only warms up the engine
+        for run_id in range(runs + 1):
+            results = worker.call(
+                "run_all_queries",
+                run_id=run_id,
+                is_warmup=(run_id == 0),
+                cold_or_warm="warm",
+                query_types=SKEW_QUERY_TYPES,
+            )
+            rows.extend(
+                to_rows(
+                    schema,
+                    data_source,
+                    join_strategy,
+                    results,
+                    worker.call("collect_sidecar_tables"),
+                    engine,
+                )
+            )
+    except Exception as exc:
+        logger.error(
+            "{engine} failed on {schema} with {join_strategy} joins ({failure_kind}): {error}",
+            engine=engine,
+            schema=schema,
+            join_strategy=join_strategy,
+            failure_kind=classify_failure(exc),
+            error=exc,
+        )
+    finally:
+        if worker is not None:
+            worker.stop()
+    return rows
+
+
+def summarize(runs: pd.DataFrame, levels: pd.DataFrame | None) -> pd.DataFrame:
+    measured = runs[~runs["is_warmup"]]
+    summary = (
+        measured.groupby(
+            ["schema", "data_source", "join_strategy", "engine", "query_type", "query"]
+        )
+        .agg(
+            median_duration_seconds=("total_duration_seconds", "median"),
+            p95_duration_seconds=("total_duration_seconds", lambda d: d.quantile(0.95)),
+            joins=("joins", lambda joins: ";".join(sorted(set(joins.dropna())))),
+        )
+        .reset_index()
+    )
+    if levels is not None:
+        summary = summary.merge(levels, on="schema", how="left")
+    return summary
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Run the skewed query suites against the Zipf skew levels "
+        + "written by skew_generator.py"
+    )
+    parser.add_argument(
+        "--exponents",
+        type=lambda value: [float(exponent) for exponent in value.split(",")],
+        default=DEFAULT_EXPONENTS,
+    )
+    parser.add_argument(
+        "--engines",
+        type=lambda value: value.split(","),
+        default=["trino", "pathling"],
+    )
+    parser.add_argument(
+        "--join-strategies",
+        type=lambda value: value.split(","),
+        default=list(JOIN_STRATEGIES.keys()),
+        help=f"Comma-separated join strategies. Available: {list(JOIN_STRATEGIES.keys())}",
+    )
+    parser.add_argument(
+        "--fhir-server-exponent",
+        type=float,
+        default=None,
+        help="The skew level whose bundles skew_fhir_servers.py loaded into "
+        + "Blaze and HAPI. Required to run them.",
+    )
+    parser.add_argument("--fhir-port-base", type=int, default=DEFAULT_FHIR_PORT_BASE)
+    parser.add_argument(
+        "--levels",
+        default=None,
+        help="A *-skew-levels.csv of skew_generator.py to add the realized "
+        + "hot and rare code shares to the summary",
+    )
+    parser.add_argument(
+        "--runs", type=int, default=3, help="Measured runs per skew level"
+    )
+    parser.add_argument(
+        "--population-size",
+        default=os.getenv("SYNTHEA_POPULATION_SIZE", ""),
+        help="The population size of the loaded data",
+    )
+    args = parser.parse_args()
+
+    unknown_strategies = set(args.join_strategies) - set(JOIN_STRATEGIES.keys())
+    if unknown_strategies:
+        logger.error("Unknown join strategies: {unknown}", unknown=unknown_strategies)
+        return 1
+
+    all_rows = []
+    for engine in args.engines:
+        if engine in FHIR_SERVER_ENGINES:
+            if args.fhir_server_exponent is None:
+                logger.warning(
+                    "Skipping {engine}, --fhir-server-exponent isn't set", engine=engine
+                )
+                continue
+            schema = get_skew_schema(args.fhir_server_exponent)
+            # fails if another level's servers hold the ports, so a result can't
+            # be attributed to the wrong level
+            ports = get_fhir_ports(args.fhir_port_base)
+            start_fhir_servers(get_fhir_compose_project(schema), ports)
+            if not has_fhir_server_data(ports):
+                logger.warning(
+                    "Skipping {engine}, {schema} isn't loaded into its servers",
+                    engine=engine,
+                    schema=schema,
+                )
+                continue
+            logger.info("Running {engine} against {schema}", engine=engine, schema=schema)
+            all_rows.extend(
+                run_level(schema, engine, "n/a", args.runs, args.fhir_port_base)
+            )
+            continue
+
+        for exponent in args.exponents:
+            schema = get_skew_schema(exponent)
+            for join_strategy in args.join_strategies:
+                logger.info(
+                    "Running {engine} against {schema} with {join_strategy} joins",
+                    engine=engine,
+                    schema=schema,
+                    join_strategy=join_strategy,
+                )
+                all_rows.extend(run_level(schema, engine, join_strategy, args.runs))
+
+    if not all_rows:
+        logger.error("No successful runs")
+        return 1
+
+    output_dir = Path.cwd() / "results" / "skew"
+    output_dir.mkdir(parents=True, exist_ok=True)
+    file_name_prefix = f"{time.strftime('%Y%m%d-%H%M%S')}-{args.population_size}"
+
+    runs = pd.DataFrame(all_rows)
+    runs["synthea_population_size"] = args.population_size
+    runs.to_csv(output_dir / f"{file_name_prefix}-skew-runs.csv", index=False)
+
+    levels = None
+    if args.levels is not None:
+        levels = pd.read_csv(args.levels)
+        levels = levels[levels["target"] == "delta"].drop(
+            columns=["target", "synthea_population_size"]
+        )
+
+    summary = summarize(runs, levels)
+    summary["synthea_population_size"] = args.population_size
+    summary.to_csv(output_dir / f"{file_name_prefix}-skew-summary.csv", index=False)
+
+    logger.info(summary)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,93 @@
+import argparse
+import os
+import sys
+
+from loguru import logger
+
+from population_ladder import (
+    SRC_DIR,
+    get_fhir_env,
+    get_synthea_output_dir,
+    run,
+    start_fhir_servers,
+    stop_fhir_servers,
+    vacuum_hapi_database,
+)
+from services import COMPOSE_PROJECT_NAME
+from skew_generator import get_skew_schema
+
+# a skew level's Blaze and HAPI listen on 18200 and 18201, next to the ones of
+# the population ladder and incremental_growth.py. The default servers keep the
+# benchmark dataset, so only one level at a time can be loaded.
+DEFAULT_FHIR_PORT_BASE = 18200
+
+
+def get_fhir_compose_project(schema: str) -> str:
+    # the volumes belong to the project, so every level keeps its own data
+    return f"{COMPOSE_PROJECT_NAME}-{schema.replace('_', '-')}"
+
+
+def get_fhir_ports(port_base: int = DEFAULT_FHIR_PORT_BASE) -> dict[str, int]:
+    return {"blaze": port_base, "hapi": port_base + 1}
+
+
+def upload_skewed_fhir_data(schema: str, population_size: int, ports: dict[str, int]):
+    project = get_fhir_compose_project(schema)
+    start_fhir_servers(project, ports)
+    bundles_dir = get_synthea_output_dir(population_size) / schema / "transactions"
+    # the hospital and practitioner bundles are uploaded first, like by
+    # upload-fhir-data. The results are kept apart from the ones of the original data.
+    run(
+        [
+            sys.executable,
+            "fhir_ingest.py",
+            "--population-size",
+            str(population_size),
+            "--bundles-dir",
+            (bundles_dir / "fhir").as_posix(),
+            "--output-prefix",
+            f"{population_size}-{schema}",
+        ],
+        cwd=SRC_DIR,
+        env=get_fhir_env(project, ports),
+    )
+    vacuum_hapi_database(project, ports)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Load a skew level's transaction bundles into its own Blaze and "
+        + "HAPI, or stop them"
+    )
+    parser.add_argument(
+        "--exponent", type=float, required=True, help="The skew level to load"
+    )
+    parser.add_argument("--fhir-port-base", type=int, default=DEFAULT_FHIR_PORT_BASE)
+    parser.add_argument(
+        "--stop",
+        action="store_true",
+        help="Stop the level's FHIR servers instead. Their volumes are kept.",
+    )
+    parser.add_argument(
+        "--population-size",
+        type=int,
+        default=os.getenv("SYNTHEA_POPULATION_SIZE", "1000"),
+        help="The population size whose skewed bundles are loaded",
+    )
+    args = parser.parse_args()
+
+    schema = get_skew_schema(args.exponent)
+    ports = get_fhir_ports(args.fhir_port_base)
+    if args.stop:
+        stop_fhir_servers(get_fhir_compose_project(schema), ports)
+        return 0
+
+    logger.info(
+        "Loading {schema} into Blaze and HAPI on {ports}", schema=schema, ports=ports
+    )
+    upload_skewed_fhir_data(schema, args.population_size, ports)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,359 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from deltalake import write_deltalake
+from loguru import logger
+
+from warehouse import (
+    BENCHMARK_RESOURCE_TYPES,
+    DEFAULT_SCHEMA,
+    DELTALAKE_STORAGE_OPTIONS,
+    get_delta_table,
+    get_table_url,
+    register_schema,
+)
+
+LOINC_SYSTEM = "http://loinc.org"
+
+# the code sets of the count-skewed and join-count-skewed queries. The hot codes
+# get the highest ranks of the Zipf distribution, the rare codes the lowest.
+HOT_CODES = ["85354-9", "72514-3", "29463-7", "8867-4", "9279-1"]
+RARE_CODES = ["7917-8", "18752-6", "26881-3", "21924-6", "62337-1"]
+
+# 0 is a uniform distribution over all codes, larger exponents concentrate more
+# and more Observations on the hot codes
+DEFAULT_EXPONENTS = [0.0, 0.5, 1.0, 1.5, 2.0]
+
+DEFAULT_SEED = 20240711
+
+
+def get_skew_schema(exponent: float) -> str:
+    # e.g. skew_z1_5 for an exponent of 1.5
+    return "skew_z" + f"{exponent:g}".replace(".", "_")
+
+
+def get_code_vocabulary(source_schema: str) -> pd.DataFrame:
+    # every LOINC code of the source's Observations, ranked hot codes first, then
+    # by their frequency in the source and the rare codes last
+    codes = (
+        get_delta_table(source_schema, "Observation")
+        .to_pyarrow_dataset()
+        .to_table(columns=["code"])
+        .column("code")
+    )
+    codings = pc.list_flatten(pc.struct_field(codes, "coding"))
+    codings = pa.table(
+        {
+            field: pc.struct_field(codings, field)
+            for field in ["system", "code", "display"]
+        }
+    ).to_pandas()
+    codings = codings[codings["system"] == LOINC_SYSTEM]
+
+    frequencies = (
+        codings.groupby("code")
+        .agg(display=("display", "first"), source_count=("display", "size"))
+        .reset_index()
+    )
+    ranked = frequencies[~frequencies["code"].isin(HOT_CODES + RARE_CODES)]
+    ranked = ranked.sort_values(["source_count", "code"], ascending=[False, True])
+
+    # keep the order of the code sets, even if a code doesn't occur in the source
+    hot = frequencies.set_index("code").reindex(HOT_CODES).reset_index()
+    rare = frequencies.set_index("code").reindex(RARE_CODES).reset_index()
+    vocabulary = pd.concat([hot, ranked, rare], ignore_index=True)
+    vocabulary["display"] = vocabulary["display"].fillna(vocabulary["code"])
+    vocabulary["source_count"] = vocabulary["source_count"].fillna(0).astype(int)
+    vocabulary["rank"] = range(1, len(vocabulary) + 1)
+    return vocabulary
+
+
+def get_zipf_cdf(num_codes: int, exponent: float) -> np.ndarray:
+    ranks = np.arange(1, num_codes + 1, dtype=np.float64)
+    weights = ranks**-exponent
+    return np.cumsum(weights / weights.sum())
+
+
+def draw_code_indices(resource_ids: list[str], cdf: np.ndarray, seed: int) -> np.ndarray:
+    # derived from the resource id instead of a random state, so the same
+    # Observation gets the same code in the Delta tables and in the bundles
+    uniform = np.array(
+        [
+            int.from_bytes(
+                hashlib.blake2b(
+                    f"{seed}:{resource_id}".encode(), digest_size=8
+                ).digest()
+            )
+            / 2**64
+            for resource_id in resource_ids
+        ]
+    )
+    return np.minimum(np.searchsorted(cdf, uniform, side="right"), len(cdf) - 1)
+
+
+def rewrite_codes(
+    batch: pa.RecordBatch, vocabulary: pd.DataFrame, cdf: np.ndarray, seed: int
+) -> tuple[pa.RecordBatch, np.ndarray]:
+    indices = draw_code_indices(batch.column("id").to_pylist(), cdf, seed)
+    codes = pa.array(vocabulary["code"].to_numpy()[indices], pa.string())
+    displays = pa.array(vocabulary["display"].to_numpy()[indices], pa.string())
+    num_rows = len(batch)
+
+    code_column = batch.column("code")
+    coding_list_type = code_column.type.field("coding").type
+    coding_type = coding_list_type.value_type
+
+    # a single LOINC coding, all other fields of the encoded Coding are left empty
+    coding_values = {"system": pa.array([LOINC_SYSTEM] * num_rows, pa.string())}
+    coding_values |= {"code": codes, "display": displays}
+    codings = pa.StructArray.from_arrays(
+        [
+            coding_values[field.name].cast(field.type)
+            if field.name in coding_values
+            else pa.nulls(num_rows, field.type)
+            for field in coding_type
+        ],
+        fields=list(coding_type),
+    )
+    coding_lists = pa.ListArray.from_arrays(
+        pa.array(range(num_rows + 1), pa.int32()), codings, type=coding_list_type
+    )
+
+    code_fields = list(code_column.type)
+    new_code = pa.StructArray.from_arrays(
+        [
+            coding_lists
+            if field.name == "coding"
+            else displays.cast(field.type)
+            if field.name == "text"
+            else code_column.field(field.name)
+            for field in code_fields
+        ],
+        fields=code_fields,
+    )
+    batch = batch.set_column(batch.schema.get_field_index("code"), "code", new_code)
+    return batch, indices
+
+
+def build_delta_variant(
+    exponent: float, source_schema: str, vocabulary: pd.DataFrame, seed: int
+) -> dict:
+    schema = get_skew_schema(exponent)
+    cdf = get_zipf_cdf(len(vocabulary), exponent)
+    code_counts = np.zeros(len(vocabulary), dtype=np.int64)
+
+    for resource_type in BENCHMARK_RESOURCE_TYPES:
+        logger.info(
+            "Writing {resource_type} to {schema}",
+            resource_type=resource_type,
+            schema=schema,
+        )
+        source = get_delta_table(source_schema, resource_type).to_pyarrow_dataset()
+        data = source
+        if resource_type == "Observation":
+
+            def rewritten_batches():
+                for batch in source.to_batches():
+                    batch, indices = rewrite_codes(batch, vocabulary, cdf, seed)
+                    code_counts[:] += np.bincount(indices, minlength=len(vocabulary))
+                    yield batch
+
+            # streamed, so the table never has to fit in memory
+            data = pa.RecordBatchReader.from_batches(
+                source.schema, rewritten_batches()
+            )
+
+        write_deltalake(
+            get_table_url(schema, resource_type, scheme="s3"),
+            data,
+            mode="overwrite",
+            schema_mode="overwrite",
+            engine="rust",
+            storage_options=DELTALAKE_STORAGE_OPTIONS,
+        )
+    register_schema(schema, BENCHMARK_RESOURCE_TYPES)
+
+    return summarize_level(schema, exponent, vocabulary, cdf, code_counts)
+
+
+def summarize_level(
+    schema: str,
+    exponent: float,
+    vocabulary: pd.DataFrame,
+    cdf: np.ndarray,
+    code_counts: np.ndarray,
+) -> dict:
+    probabilities = np.diff(cdf, prepend=0)
+    is_hot = vocabulary["code"].isin(HOT_CODES).to_numpy()
+    is_rare = vocabulary["code"].isin(RARE_CODES).to_numpy()
+    total = max(int(code_counts.sum()), 1)
+    return {
+        "schema": schema,
+        "zipf_exponent": exponent,
+        "num_codes": len(vocabulary),
+        "observation_count": int(code_counts.sum()),
+        "hot_code_count": int(code_counts[is_hot].sum()),
+        "rare_code_count": int(code_counts[is_rare].sum()),
+        "hot_code_share": code_counts[is_hot].sum() / total,
+        "rare_code_share": code_counts[is_rare].sum() / total,
+        "top_code_share": code_counts.max() / total,
+        "expected_hot_code_share": probabilities[is_hot].sum(),
+        "expected_rare_code_share": probabilities[is_rare].sum(),
+    }
+
+
+def rewrite_bundle(
+    bundle_path: Path,
+    output_dir: Path,
+    vocabulary: list[tuple[str, str]],
+    cdf: np.ndarray,
+    seed: int,
+) -> Counter:
+    bundle = json.loads(bundle_path.read_text())
+    entries = [
+        entry
+        for entry in bundle.get("entry", [])
+        if entry.get("resource", {}).get("resourceType") == "Observation"
+    ]
+
+    # Synthea uses the same ids for the bulk export and the transaction bundles'
+    # urn:uuid: full URLs, so these match the codes of the Delta tables
+    resource_ids = [
+        entry["resource"].get("id") or entry["fullUrl"].removeprefix("urn:uuid:")
+        for entry in entries
+    ]
+    indices = draw_code_indices(resource_ids, cdf, seed) if entries else []
+    for entry, index in zip(entries, indices):
+        code, display = vocabulary[index]
+        entry["resource"]["code"] = {
+            "coding": [{"system": LOINC_SYSTEM, "code": code, "display": display}],
+            "text": display,
+        }
+
+    (output_dir / bundle_path.name).write_text(json.dumps(bundle))
+    return Counter(int(index) for index in indices)
+
+
+def build_bundle_variant(
+    exponent: float,
+    synthea_output_dir: Path,
+    vocabulary: pd.DataFrame,
+    seed: int,
+    max_workers: int | None,
+) -> dict:
+    schema = get_skew_schema(exponent)
+    cdf = get_zipf_cdf(len(vocabulary), exponent)
+    input_dir = synthea_output_dir / "transactions" / "fhir"
+    output_dir = synthea_output_dir / schema / "transactions" / "fhir"
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    bundle_paths = sorted(input_dir.glob("*.json"))
+    logger.info(
+        "Rewriting {count} bundles to {output_dir}",
+        count=len(bundle_paths),
+        output_dir=output_dir,
+    )
+
+    code_counts = np.zeros(len(vocabulary), dtype=np.int64)
+    rewrite = partial(
+        rewrite_bundle,
+        output_dir=output_dir,
+        vocabulary=list(zip(vocabulary["code"], vocabulary["display"])),
+        cdf=cdf,
+        seed=seed,
+    )
+    # also copies the hospital and practitioner bundles, which have no Observations
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for counts in executor.map(rewrite, bundle_paths, chunksize=64):
+            for index, count in counts.items():
+                code_counts[index] += count
+
+    return summarize_level(schema, exponent, vocabulary, cdf, code_counts)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Rewrite the Observation codes to follow a Zipf distribution, "
+        + "as Delta warehouse variants and as transaction bundles for the FHIR servers"
+    )
+    parser.add_argument(
+        "--exponents",
+        type=lambda value: [float(exponent) for exponent in value.split(",")],
+        default=DEFAULT_EXPONENTS,
+        help="Comma-separated Zipf exponents, one skew level each",
+    )
+    parser.add_argument("--source-schema", default=DEFAULT_SCHEMA)
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument(
+        "--skip-delta", action="store_true", help="Don't write the Delta variants"
+    )
+    parser.add_argument(
+        "--skip-bundles",
+        action="store_true",
+        help="Don't write the transaction bundles for Blaze and HAPI",
+    )
+    parser.add_argument("--synthea-dir", default="../synthea")
+    parser.add_argument("--max-workers", type=int, default=None)
+    parser.add_argument(
+        "--population-size",
+        default=os.getenv("SYNTHEA_POPULATION_SIZE", ""),
+        help="The population size of the loaded data",
+    )
+    args = parser.parse_args()
+
+    # the codes are ranked by the source Delta table for both outputs
+    vocabulary = get_code_vocabulary(args.source_schema)
+    logger.info("Ranked {count} LOINC codes", count=len(vocabulary))
+
+    synthea_output_dir = Path(args.synthea_dir) / f"output-{args.population_size}"
+
+    levels = []
+    for exponent in args.exponents:
+        if not args.skip_delta:
+            levels.append(
+                build_delta_variant(
+                    exponent, args.source_schema, vocabulary, args.seed
+                )
+                | {"target": "delta"}
+            )
+        if not args.skip_bundles:
+            levels.append(
+                build_bundle_variant(
+                    exponent,
+                    synthea_output_dir,
+                    vocabulary,
+                    args.seed,
+                    args.max_workers,
+                )
+                | {"target": "bundles"}
+            )
+
+    output_dir = Path.cwd() / "results" / "skew"
+    output_dir.mkdir(parents=True, exist_ok=True)
+    file_name_prefix = f"{time.strftime('%Y%m%d-%H%M%S')}-{args.population_size}"
+
+    vocabulary["synthea_population_size"] = args.population_size
+    vocabulary.to_csv(output_dir / f"{file_name_prefix}-skew-codes.csv", index=False)
+
+    levels = pd.DataFrame(levels)
+    levels["synthea_population_size"] = args.population_size
+    levels.to_csv(output_dir / f"{file_name_prefix}-skew-levels.csv", index=False)
+
+    logger.info(levels)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,220 @@
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Iterator
+
+import requests
+from loguru import logger
+from pyspark.sql import SparkSession
+
+# stage fields of Spark's REST API (/api/v1/applications/<app>/stages/<stage>)
+# mapped to the column names of the stage metrics sidecar table.
+STAGE_METRICS = {
+    "numTasks": "num_tasks",
+    "numFailedTasks": "num_failed_tasks",
+    "executorRunTime": "executor_run_time_ms",
+    "executorCpuTime": "executor_cpu_time_ns",
+    "jvmGcTime": "jvm_gc_time_ms",
+    "inputBytes": "input_bytes",
+    "inputRecords": "input_records",
+    "outputBytes": "output_bytes",
+    "shuffleReadBytes": "shuffle_read_bytes",
+    "shuffleWriteBytes": "shuffle_write_bytes",
+    "memoryBytesSpilled": "memory_bytes_spilled",
+    "diskBytesSpilled": "disk_bytes_spilled",
+}
+
+_FINISHED_STAGE_STATES = {"COMPLETE", "FAILED", "SKIPPED"}
+
+# SQL metric of the file scan nodes. With Delta, the files are already pruned using
+# the min/max statistics in the transaction log, i.e. skipped files aren't counted.
+FILES_READ_METRIC = "number of files read"
+
+# SQL metric of the command writing the query's result, i.e. its number of rows
+ROWS_WRITTEN_METRIC = "number of output rows"
+WRITE_COMMAND_NODE_NAME = "Execute InsertIntoHadoopFsRelationCommand"
+
+# physical join operators of the final (adaptive) plan, e.g. to tell broadcast
+# from partitioned joins
+JOIN_NODE_NAMES = {
+    "BroadcastHashJoin",
+    "BroadcastNestedLoopJoin",
+    "ShuffledHashJoin",
+    "SortMergeJoin",
+    "CartesianProduct",
+}
+
+
+class SparkStageMetricsCollector:
+    """
+    Tags every query with its own Spark job group and reads the metrics of the
+    group's stages from the status tracker and the driver's REST API.
+    """
+
+    def __init__(self, spark: SparkSession, listener_timeout_seconds: float = 10):
+        self.spark = spark
+        self.listener_timeout_seconds = listener_timeout_seconds
+        # SQL executions are listed oldest first, so skip the ones already seen
+        # the executions of earlier queries are skipped by their id
+        self._last_sql_execution_id = -1
+
+    @contextmanager
+    def job_group(self, description: str) -> Iterator[str]:
+        group_id = f"benchmark-{uuid.uuid4()}"
+        sc = self.spark.sparkContext
+        sc.setJobGroup(group_id, description)
+        try:
+            yield group_id
+        finally:
+            sc.setLocalProperty("spark.jobGroup.id", None)
+            sc.setLocalProperty("spark.job.description", None)
+
+    def collect(self, group_id: str) -> list[dict[str, Any]]:
+        sc = self.spark.sparkContext
+        status_tracker = sc.statusTracker()
+
+        rows = []
+        for job_id in status_tracker.getJobIdsForGroup(group_id):
+            job_info = status_tracker.getJobInfo(job_id)
+            if job_info is None:
+                continue
+
+            for stage_id in job_info.stageIds:
+                for stage_attempt in self._get_stage_attempts(stage_id):
+                    row = {
+                        "spark_job_id": job_id,
+                        "spark_stage_id": stage_id,
+                        "spark_stage_attempt_id": stage_attempt.get("attemptId", 0),
+                        "spark_stage_status": stage_attempt.get("status", ""),
+                        "spark_stage_name": stage_attempt.get("name", ""),
+                    }
+                    for field, column in STAGE_METRICS.items():
+                        row[column] = stage_attempt.get(field, 0)
+                    rows.append(row)
+        return rows
+
+    def collect_sql_executions(self, group_id: str) -> list[dict[str, Any]]:
+        sc = self.spark.sparkContext
+        job_ids = set(sc.statusTracker().getJobIdsForGroup(group_id))
+        url = f"{sc.uiWebUrl}/api/v1/applications/{sc.applicationId}/sql"
+
+        deadline = time.perf_counter() + self.listener_timeout_seconds
+        while True:
+            executions = [
+                execution
+                for execution in self._get_sql_executions(url)
+                if execution["id"] > self._last_sql_execution_id
+                and job_ids.intersection(
+                    execution.get("successJobIds", [])
+                    + execution.get("failedJobIds", [])
+                    + execution.get("runningJobIds", [])
+                )
+            ]
+
+            if (
+                all(e.get("status") != "RUNNING" for e in executions)
+                or time.perf_counter() > deadline
+            ):
+                break
+            time.sleep(0.1)
+
+        if executions:
+            self._last_sql_execution_id = max(e["id"] for e in executions)
+        return executions
+
+    def _get_sql_executions(self, url: str, page_size: int = 1000) -> list[dict]:
+        # the offset is a position in the executions the UI still retains
+        # (spark.sql.ui.retainedExecutions), not an execution id. Once the old ones
+        # are evicted, the ids are larger than the positions, so it always pages
+        # from the start.
+        executions = []
+        while True:
+            response = requests.get(
+                url,
+                params={
+                    "details": "true",
+                    "planDescription": "false",
+                    "offset": len(executions),
+                    "length": page_size,
+                },
+                timeout=10,
+            )
+            response.raise_for_status()
+            page = response.json()
+            executions.extend(page)
+            if len(page) < page_size:
+                return executions
+
+    def _get_stage_attempts(self, stage_id: int) -> list[dict[str, Any]]:
+        sc = self.spark.sparkContext
+        url = f"{sc.uiWebUrl}/api/v1/applications/{sc.applicationId}/stages/{stage_id}"
+
+        # the status store is updated asynchronously by the listener bus, so the
+        # metrics of the last stage may not be final right after the action returned.
+        deadline = time.perf_counter() + self.listener_timeout_seconds
+        while True:
+            response = requests.get(url, params={"details": "false"}, timeout=10)
+            if response.status_code == 404:
+                # skipped stages which never ran may not be known to the store
+                return []
+            response.raise_for_status()
+            attempts = response.json()
+
+            if (
+                all(a.get("status") in _FINISHED_STAGE_STATES for a in attempts)
+                or time.perf_counter() > deadline
+            ):
+                if time.perf_counter() > deadline:
+                    logger.warning(
+                        "Timed out waiting for stage {stage_id} metrics to be final",
+                        stage_id=stage_id,
+                    )
+                return attempts
+
+            time.sleep(0.1)
+
+
+def count_files_read(executions: list[dict[str, Any]]) -> int:
+    files_read = 0
+    for execution in executions:
+        for node in execution.get("nodes", []):
+            for metric in node.get("metrics", []):
+                if metric.get("name") == FILES_READ_METRIC:
+                    # formatted with thousands separators
+                    files_read += int(str(metric["value"]).replace(",", ""))
+    return files_read
+
+
+def count_rows_written(executions: list[dict[str, Any]]) -> int | None:
+    rows_written = None
+    for execution in executions:
+        for node in execution.get("nodes", []):
+            if not node.get("nodeName", "").startswith(WRITE_COMMAND_NODE_NAME):
+                continue
+            for metric in node.get("metrics", []):
+                if metric.get("name") == ROWS_WRITTEN_METRIC:
+                    rows_written = (rows_written or 0) + int(
+                        str(metric["value"]).replace(",", "")
+                    )
+    return rows_written
+
+
+def get_join_strategies(executions: list[dict[str, Any]]) -> list[str]:
+    # the graph of an execution is updated with the plan chosen by adaptive query
+    # execution, so a sort-merge join converted to a broadcast join shows as such
+    return sorted(
+        node["nodeName"]
+        for execution in executions
+        for node in execution.get("nodes", [])
+        if node.get("nodeName") in JOIN_NODE_NAMES
+    )
+
+
+def summarize_stage_metrics(rows: list[dict[str, Any]]) -> dict[str, Any]:
+    summary = {
+        "num_jobs": len({row["spark_job_id"] for row in rows}),
+        "num_stages": len({row["spark_stage_id"] for row in rows}),
+    }
+    for column in STAGE_METRICS.values():
+        summary[column] = sum(row[column] for row in rows)
+    return summary
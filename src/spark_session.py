@@ -0,0 +1,147 @@
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Any
+from urllib.parse import urlparse
+
+from loguru import logger
+from pyspark import SparkContext
+from pyspark.sql import SparkSession
+
+SPARK_PACKAGES = "au.csiro.pathling:library-runtime:7.2.0,io.delta:delta-spark_2.12:3.3.0,org.apache.hadoop:hadoop-aws:3.3.4"
+
+# the jars resolved from SPARK_PACKAGES are copied here on first start-up, so later
+# sessions (e.g. for cold runs) don't pay for the Ivy dependency resolution.
+JAR_CACHE_DIR = Path(os.getenv("SPARK_JAR_CACHE_DIR", Path.cwd() / "spark-jars"))
+JAR_CACHE_MANIFEST = "manifest.json"
+
+
+def get_default_spark_conf() -> dict[str, str]:
+    return {
+        "fs.s3a.access.key": "admin",
+        "fs.s3a.secret.key": "miniopass",
+        "spark.sql.extensions": "io.delta.sql.DeltaSparkSessionExtension",
+        "spark.sql.catalog.spark_catalog": "org.apache.spark.sql.delta.catalog.DeltaCatalog",
+        "spark.driver.memory": os.getenv("SPARK_DRIVER_MEMORY", "64g"),
+        "spark.hadoop.fs.s3a.endpoint": "localhost:9000",
+        "spark.hadoop.fs.s3a.connection.ssl.enabled": "false",
+        "spark.serializer": "org.apache.spark.serializer.KryoSerializer",
+        "spark.hadoop.fs.s3a.path.style.access": "true",
+        "spark.sql.shuffle.partitions": "200",
+        "spark.sql.adaptive.enabled": "true",
+        "spark.local.dir": (Path.cwd() / "spark-tmp").as_posix(),
+    }
+
+
+def get_cached_jars() -> list[Path] | None:
+    manifest_path = JAR_CACHE_DIR / JAR_CACHE_MANIFEST
+    if not manifest_path.exists():
+        return None
+
+    manifest = json.loads(manifest_path.read_text())
+    if manifest.get("packages") != SPARK_PACKAGES:
+        logger.info("Jar cache was created for different packages. Ignoring it.")
+        return None
+
+    jars = [JAR_CACHE_DIR / name for name in manifest["jars"]]
+    if not all(jar.exists() for jar in jars):
+        logger.warning("Jar cache at {path} is incomplete", path=JAR_CACHE_DIR)
+        return None
+
+    return jars
+
+
+def populate_jar_cache(spark: SparkSession):
+    # after resolving `spark.jars.packages`, spark-submit lists the local paths
+    # of all resolved jars (including transitive ones) in `spark.jars`.
+    resolved_jars = [
+        Path(urlparse(jar).path)
+        for jar in spark.sparkContext.getConf().get("spark.jars", "").split(",")
+        if jar
+    ]
+    if not resolved_jars:
+        logger.warning("No resolved jars found, not populating the jar cache")
+        return
+
+    JAR_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    for jar in resolved_jars:
+        shutil.copy2(jar, JAR_CACHE_DIR / jar.name)
+
+    (JAR_CACHE_DIR / JAR_CACHE_MANIFEST).write_text(
+        json.dumps(
+            {
+                "packages": SPARK_PACKAGES,
+                "jars": [jar.name for jar in resolved_jars],
+            },
+            indent=2,
+        )
+    )
+    logger.info(
+        "Cached {count} resolved jars in {path}",
+        count=len(resolved_jars),
+        path=JAR_CACHE_DIR,
+    )
+
+
+def create_spark_session(
+    spark_conf: dict[str, str] | None = None, use_jar_cache: bool = True
+) -> tuple[SparkSession, dict[str, Any]]:
+    """
+    Returns the session and a record of how long the start-up took and whether
+    the jars were resolved via Ivy or loaded from the local jar cache.
+    """
+    startup_start = time.perf_counter()
+
+    builder = SparkSession.builder
+    cached_jars = get_cached_jars() if use_jar_cache else None
+    if cached_jars is not None:
+        jar_source = "local-cache"
+        builder = builder.config(
+            "spark.jars", ",".join(jar.as_posix() for jar in cached_jars)
+        )
+    else:
+        jar_source = "ivy"
+        builder = builder.config("spark.jars.packages", SPARK_PACKAGES)
+
+    for key, value in (get_default_spark_conf() | (spark_conf or {})).items():
+        builder = builder.config(key, value)
+
+    spark = builder.getOrCreate()
+    startup_duration = time.perf_counter() - startup_start
+
+    if use_jar_cache and cached_jars is None:
+        populate_jar_cache(spark)
+
+    logger.info(
+        "Started Spark session in {duration:0.2f} s using jars from {jar_source}",
+        duration=startup_duration,
+        jar_source=jar_source,
+    )
+
+    return spark, {
+        "jar_source": jar_source,
+        "session_startup_duration_seconds": startup_duration,
+    }
+
+
+def stop_spark_session(spark: SparkSession, stop_jvm: bool = True):
+    spark.catalog.clearCache()
+    spark.sparkContext._jvm.System.gc()
+    spark.stop()
+
+    if not stop_jvm or SparkContext._gateway is None:
+        return
+
+    # SparkSession.stop() keeps the driver JVM (and its JIT-compiled code) alive,
+    # which makes a "cold" session noticeably warmer. The py4j gateway server exits
+    # as soon as its stdin is closed, so the next session starts in a fresh JVM.
+    gateway = SparkContext._gateway
+    gateway.shutdown()
+    process = getattr(gateway, "proc", None)
+    if process is not None:
+        process.stdin.close()
+        process.wait()
+    SparkContext._gateway = None
+    SparkContext._jvm = None
@@ -1,4 +1,5 @@
 import datetime
+import re
 import trino
 import pandas as pd
 from pathlib import Path
@@ -6,29 +7,72 @@ from loguru import logger
 import time
 
 from benchmark import Benchmark, BenchmarkRunResult, QueryType, QUERY_TYPES_TO_RUN
+from jvm_telemetry import JvmTelemetry, read_trino_jmx
+from query_parameters import get_query_parameters, render_sql
+from warehouse import (
+    BENCHMARK_RESOURCE_TYPES,
+    DEFAULT_SCHEMA,
+    get_benchmark_schema,
+    get_table_layout,
+)
+
+# the queries are written against fhir.default.<table>
+TABLE_PATTERN = re.compile(r"\bfhir\.default\.(\w+)", re.IGNORECASE)
+
+# join nodes of EXPLAIN's output, e.g. "InnerJoin[criteria = (...), distribution = REPLICATED]"
+JOIN_DISTRIBUTION_PATTERN = re.compile(r"distribution = (REPLICATED|PARTITIONED)")
 
 
 class TrinoBenchmark(Benchmark):
-    def __init__(self):
+    def __init__(
+        self,
+        session_properties: dict[str, str] | None = None,
+        schema: str | None = None,
+        queries_dir: str = "queries",
+        engine_name: str = "trino",
+        explain_joins: bool = False,
+    ):
+        # the warehouse variant to query, e.g. a differently laid out copy
+        self.schema = schema or get_benchmark_schema()
+        # e.g. "queries-flat" for the queries against the flattened tables
+        self.queries_dir = queries_dir
+        self.engine_name = engine_name
+        # whether to EXPLAIN every query after running it to report if its joins
+        # were broadcast (REPLICATED) or PARTITIONED
+        self.explain_joins = explain_joins
         self.trino_connection = trino.dbapi.connect(
             host="localhost",
             port="8080",
             user="trino",
             catalog="fhir",
-            schema="default",
+            schema=self.schema,
+            session_properties=session_properties,
+        )
+        self.table_num_files: dict[str, int] = {}
+        self.sidecar_tables: dict[str, list[dict]] = {}
+        self.jvm_telemetry = JvmTelemetry(
+            "trino", lambda: read_trino_jmx(self.trino_connection)
         )
         logger.info("Completed initialization.")
 
     def run_all_queries(
-        self, run_id: int, is_warmup: bool = False, cold_or_warm: str = "cold"
+        self,
+        run_id: int,
+        is_warmup: bool = False,
+        cold_or_warm: str = "cold",
+        query_types: list[QueryType] | None = None,
+        query_names: list[str] | None = None,
+        query_parameters: dict | None = None,
     ) -> list[BenchmarkRunResult]:
         logger.info("Begin trino benchmarking")
-        queries_base_path = Path.cwd() / "queries"
+        parameters = get_query_parameters(query_parameters)
+        queries_base_path = Path.cwd() / self.queries_dir
 
         results = []
+        self.sidecar_tables = {"trino-query-metrics": []}
         start_timestamp = datetime.datetime.now(datetime.UTC)
 
-        for query_type in QUERY_TYPES_TO_RUN:
+        for query_type in query_types or QUERY_TYPES_TO_RUN:
             queries_dir_path = queries_base_path / str(query_type)
             logger.info(
                 "Looking for sql files in {queries_dir_path}",
@@ -38,6 +82,10 @@ class TrinoBenchmark(Benchmark):
             queries = list(queries_dir_path.glob("*.sql"))
             start = run_id % len(queries)
             round_robin_queries = queries[start:] + queries[:start]
+            if query_names is not None:
+                round_robin_queries = [
+                    q for q in round_robin_queries if q.stem in query_names
+                ]
 
             for file in round_robin_queries:
                 query_name = file.stem
@@ -48,7 +96,9 @@ class TrinoBenchmark(Benchmark):
                 )
 
                 output_file_name = f"{query_name}.csv"
-                output_folder = Path.cwd() / "results" / "trino" / str(query_type)
+                output_folder = (
+                    Path.cwd() / "results" / self.engine_name / str(query_type)
+                )
                 output_folder.mkdir(parents=True, exist_ok=True)
                 output_file_path = output_folder / output_file_name
 
@@ -57,11 +107,18 @@ class TrinoBenchmark(Benchmark):
                     output_file_path=output_file_path,
                 )
 
-                query = file.read_text()
+                query = render_sql(file.read_text(), parameters)
+                scanned_tables = {t.lower() for t in TABLE_PATTERN.findall(query)}
+                if self.schema != DEFAULT_SCHEMA:
+                    query = TABLE_PATTERN.sub(
+                        lambda match: f"fhir.{self.schema}.{match.group(1)}", query
+                    )
 
                 cursor = self.trino_connection.cursor()
 
+                self.jvm_telemetry.before_query()
                 # technically, the query is likely first executed on fetchall
+                query_start_timestamp = datetime.datetime.now(datetime.UTC)
                 timings_start = time.perf_counter()
                 cursor.execute(query)
 
@@ -92,7 +149,7 @@ class TrinoBenchmark(Benchmark):
                 result = BenchmarkRunResult(
                     run_id=run_id,
                     start_timestamp=start_timestamp,
-                    engine="trino",
+                    engine=self.engine_name,
                     query=query_name,
                     query_type=query_type,
                     total_duration_seconds=duration_total,
@@ -105,18 +162,101 @@ class TrinoBenchmark(Benchmark):
                     / 1000.0,
                     is_warmup=is_warmup,
                     cold_or_warm=cold_or_warm,
+                    query_start_timestamp=query_start_timestamp,
+                    query_end_timestamp=query_start_timestamp
+                    + datetime.timedelta(seconds=duration_total),
+                    result_row_count=len(rows),
                 )
 
+                self.jvm_telemetry.after_query(result)
                 results.append(result)
 
+                self._collect_query_metrics(
+                    result, cursor.stats, scanned_tables, query
+                )
+
         return results
 
+    def get_query_definition(self, query_type: QueryType, query_name: str) -> str:
+        return (
+            Path.cwd() / self.queries_dir / str(query_type) / f"{query_name}.sql"
+        ).read_text()
+
+    def _collect_query_metrics(
+        self,
+        result: BenchmarkRunResult,
+        stats: dict,
+        scanned_tables: set[str],
+        query: str,
+    ):
+        try:
+            # the files of all scanned tables. Trino creates (at least) one split per
+            # file it doesn't skip, so for files smaller than `delta.max-split-size`
+            # the splits equal the files read.
+            files_total = (
+                sum(self._get_table_num_files(table) for table in scanned_tables)
+                if scanned_tables
+                else None
+            )
+        except Exception as exc:
+            logger.warning("Failed to read the table layouts: {error}", error=exc)
+            files_total = None
+
+        join_distributions = None
+        if self.explain_joins:
+            try:
+                join_distributions = ",".join(self._explain_join_distributions(query))
+            except Exception as exc:
+                logger.warning("Failed to explain the query: {error}", error=exc)
+
+        self.sidecar_tables["trino-query-metrics"].append(
+            {
+                "run_id": result.run_id,
+                "engine": result.engine,
+                "query": result.query,
+                "query_type": str(result.query_type),
+                "cold_or_warm": result.cold_or_warm,
+                "is_warmup": result.is_warmup,
+                "schema": self.schema,
+                "scanned_tables": ",".join(sorted(scanned_tables)),
+                "files_total": files_total,
+                "total_splits": stats.get("totalSplits", 0),
+                "processed_rows": stats.get("processedRows", 0),
+                "processed_bytes": stats.get("processedBytes", 0),
+                "physical_input_bytes": stats.get("physicalInputBytes", 0),
+                "peak_memory_bytes": stats.get("peakMemoryBytes", 0),
+                "join_distributions": join_distributions,
+            }
+        )
+
+    def _explain_join_distributions(self, query: str) -> list[str]:
+        # the plan is chosen with the same session properties and table statistics
+        # as the query that just ran
+        cursor = self.trino_connection.cursor()
+        cursor.execute(f"EXPLAIN (TYPE DISTRIBUTED) {query}")
+        plan = "\n".join(row[0] for row in cursor.fetchall())
+        cursor.close()
+        return sorted(JOIN_DISTRIBUTION_PATTERN.findall(plan))
+
+    def _get_table_num_files(self, table: str) -> int:
+        if table not in self.table_num_files:
+            resource_type = next(
+                r for r in BENCHMARK_RESOURCE_TYPES if r.lower() == table
+            )
+            self.table_num_files[table] = get_table_layout(self.schema, resource_type)[
+                "num_files"
+            ]
+        return self.table_num_files[table]
+
+    def collect_sidecar_tables(self) -> dict[str, list[dict]]:
+        return self.sidecar_tables
+
     def get_resource_counts_total(self, resource_types: list[str]) -> int:
         cursor = self.trino_connection.cursor()
         total = 0
         for resource_type in resource_types:
             query = (
-                f"SELECT COUNT(DISTINCT(id)) AS count FROM fhir.default.{resource_type}"
+                f"SELECT COUNT(DISTINCT(id)) AS count FROM fhir.{self.schema}.{resource_type}"
             )
 
             cursor.execute(query)
@@ -131,7 +271,7 @@ class TrinoBenchmark(Benchmark):
         result = {}
         for resource_type in resource_types:
             query = (
-                f"SELECT COUNT(DISTINCT(id)) AS count FROM fhir.default.{resource_type}"
+                f"SELECT COUNT(DISTINCT(id)) AS count FROM fhir.{self.schema}.{resource_type}"
             )
 
             cursor.execute(query)
@@ -0,0 +1,96 @@
+import trino
+from deltalake import DeltaTable
+from loguru import logger
+
+# re-exported for the modules which import them from here
+from services import DEFAULT_SCHEMA, get_benchmark_schema
+
+# the Pathling server imports every resource type into its own Delta table at
+# s3a://fhir/<database>/<ResourceType>.parquet and the warehousekeeper registers
+# them in the Hive metastore as fhir.<database>.<resourcetype>. Variants of the
+# warehouse (different layouts, encodings, populations, ...) follow the same
+# convention, so they can be selected by their schema name alone.
+WAREHOUSE_BUCKET = "fhir"
+
+BENCHMARK_RESOURCE_TYPES = ["Patient", "Observation", "Condition", "Encounter"]
+
+# for the deltalake (delta-rs) package, which talks to MinIO directly
+DELTALAKE_STORAGE_OPTIONS = {
+    "AWS_ACCESS_KEY_ID": "admin",
+    "AWS_SECRET_ACCESS_KEY": "miniopass",
+    "AWS_ENDPOINT_URL": "http://localhost:9000",
+    "AWS_REGION": "eu-central-1",
+    "AWS_ALLOW_HTTP": "true",
+    "AWS_S3_ALLOW_UNSAFE_RENAME": "true",
+}
+
+
+def get_schema_url(schema: str, scheme: str = "s3a") -> str:
+    return f"{scheme}://{WAREHOUSE_BUCKET}/{schema}"
+
+
+def get_table_url(schema: str, resource_type: str, scheme: str = "s3a") -> str:
+    return f"{get_schema_url(schema, scheme)}/{resource_type}.parquet"
+
+
+def get_delta_table(schema: str, resource_type: str) -> DeltaTable:
+    return DeltaTable(
+        get_table_url(schema, resource_type, scheme="s3"),
+        storage_options=DELTALAKE_STORAGE_OPTIONS,
+    )
+
+
+def get_table_layout(schema: str, resource_type: str) -> dict:
+    table = get_delta_table(schema, resource_type)
+    file_sizes = table.get_add_actions(flatten=True).column("size_bytes").to_pylist()
+    return {
+        "schema": schema,
+        "resource_type": resource_type,
+        "table_version": table.version(),
+        "num_files": len(file_sizes),
+        "total_size_bytes": sum(file_sizes),
+        "mean_file_size_bytes": sum(file_sizes) / len(file_sizes) if file_sizes else 0,
+        "min_file_size_bytes": min(file_sizes, default=0),
+        "max_file_size_bytes": max(file_sizes, default=0),
+    }
+
+
+def register_schema(schema: str, resource_types: list[str]):
+    # requires `delta.register-table-procedure.enabled=true` in the fhir catalog
+    connection = trino.dbapi.connect(
+        host="localhost", port="8080", user="trino", catalog="fhir"
+    )
+    cursor = connection.cursor()
+
+    cursor.execute(
+        f"CREATE SCHEMA IF NOT EXISTS fhir.{schema} "
+        + f"WITH (location = '{get_schema_url(schema)}/')"
+    )
+    cursor.fetchall()
+
+    for resource_type in resource_types:
+        table_name = resource_type.lower()
+        cursor.execute(
+            "SELECT COUNT(*) FROM fhir.information_schema.tables "
+            + "WHERE table_schema = ? AND table_name = ?",
+            [schema, table_name],
+        )
+        if cursor.fetchone()[0] > 0:
+            # re-register, the table may have been rewritten at the same location
+            cursor.execute(
+                f"CALL fhir.system.unregister_table(schema_name => '{schema}', table_name => '{table_name}')"
+            )
+            cursor.fetchall()
+
+        cursor.execute(
+            f"CALL fhir.system.register_table(schema_name => '{schema}', table_name => '{table_name}', "
+            + f"table_location => '{get_table_url(schema, resource_type)}')"
+        )
+        cursor.fetchall()
+        logger.info(
+            "Registered fhir.{schema}.{table_name}",
+            schema=schema,
+            table_name=table_name,
+        )
+
+    cursor.close()